@@ -0,0 +1,280 @@
+"""
+Бенчмарки экстракции, загрузки, фильтрации и поиска.
+
+Примеры:
+    python bench.py --sizes 10000,100000 --out bench.json
+    python bench.py --only extract,ingest --files 500 --file-lines 400
+
+Результат — JSON (одна запись на измерение), пригодный для сравнения между коммитами.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from typing import List, Dict, Any, Callable
+
+import numpy as np
+
+from code_filter import Filter
+from kb_local_hybrid import LocalKB, Chunk
+
+
+EMBEDDING_DIM = 384
+
+_MODULES = [
+    "os", "sys", "json", "re", "typing", "pathlib", "asyncio", "logging", "numpy",
+    "httpx", "fastapi", "pydantic", "sqlalchemy", "requests", "jose", "torch", "collections",
+]
+_WORDS = [
+    "user", "config", "cache", "token", "request", "response", "session", "parse", "load",
+    "save", "client", "server", "retry", "item", "value", "result", "handler", "path", "data",
+]
+_LANGUAGES = ["python", "go", "javascript"]
+_EXTENSIONS = {"python": ".py", "go": ".go", "javascript": ".js"}
+
+
+def _ident(rng: random.Random, camel: bool = False) -> str:
+    a, b = rng.choice(_WORDS), rng.choice(_WORDS)
+    return a + b.capitalize() if camel else f"{a}_{b}"
+
+
+def make_python_source(rng: random.Random, n_lines: int) -> str:
+    lines = []
+    for m in rng.sample(_MODULES, 4):
+        if rng.random() < 0.5:
+            lines.append(f"import {m}")
+        else:
+            lines.append(f"from {m} import {_ident(rng)}")
+    lines.append("")
+    while len(lines) < n_lines:
+        if rng.random() < 0.3:
+            lines.append(f"class {_ident(rng, camel=True).capitalize()}({rng.choice(['object', 'Base'])}):")
+            for _ in range(rng.randint(1, 4)):
+                lines.append(f"    def {_ident(rng)}(self, {_ident(rng)}: int, {_ident(rng)}=None) -> dict:")
+                lines.append(f"        return {{'{_ident(rng)}': {_ident(rng)}}}")
+                lines.append("")
+        else:
+            lines.append(f"def {_ident(rng)}({_ident(rng)}: str, {_ident(rng)}: int = 0):")
+            lines.append(f"    {_ident(rng)} = {_ident(rng)}({rng.randint(0, 100)})")
+            lines.append(f"    return {_ident(rng)}")
+            lines.append("")
+    return "\n".join(lines[:n_lines]) + "\n"
+
+
+def make_other_source(rng: random.Random, language: str, n_lines: int) -> str:
+    lines = []
+    while len(lines) < n_lines:
+        name = _ident(rng, camel=True)
+        if language == "go":
+            lines.append(f"func {name}({_ident(rng, camel=True)} int) int {{")
+            lines.append(f"    return {_ident(rng, camel=True)} + {rng.randint(0, 100)}")
+        else:
+            lines.append(f"function {name}({_ident(rng, camel=True)}) {{")
+            lines.append(f"    return {_ident(rng, camel=True)}.{_ident(rng, camel=True)}();")
+        lines.append("}")
+    return "\n".join(lines[:n_lines]) + "\n"
+
+
+def generate_corpus(out_dir: str, n_files: int, file_lines: int, python_share: float = 0.7, seed: int = 0) -> List[str]:
+    """Создаёт синтетический корпус файлов. Возвращает список путей."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(n_files):
+        language = "python" if rng.random() < python_share else rng.choice(_LANGUAGES[1:])
+        path = os.path.join(out_dir, f"file_{i:06d}{_EXTENSIONS[language]}")
+        if language == "python":
+            source = make_python_source(rng, file_lines)
+        else:
+            source = make_other_source(rng, language, file_lines)
+        with open(path, "w", encoding="utf8") as f:
+            f.write(source)
+        paths.append(path)
+    return paths
+
+
+def make_chunks(n: int, seed: int = 0, content_lines: int = 12) -> List[Chunk]:
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(n):
+        language = rng.choice(_LANGUAGES)
+        chunks.append(Chunk(
+            chunk_id=f"ch_{i}",
+            repo=f"bench/repo_{i % 50}",
+            path=f"src/module_{i}{_EXTENSIONS[language]}",
+            language=language,
+            imports=rng.sample(_MODULES, 3),
+            classes=[],
+            functions=[],
+            content=make_python_source(rng, content_lines),
+        ))
+    return chunks
+
+
+def build_synthetic_kb(dir_path: str, n: int, seed: int = 0) -> None:
+    """
+    Заполняет каталог LocalKB n чанками через add_many без вызова модели:
+    векторы — случайные нормированные (add_many(vectors=...)), остальное — как при обычной загрузке.
+    """
+    kb = LocalKB(dir_path)
+    vectors = np.random.default_rng(seed).standard_normal((n, EMBEDDING_DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    kb.add_many(make_chunks(n, seed), vectors=vectors)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    arr = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def _timed(fn: Callable[[], Any], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def bench_extract(corpus_dir: str, n_files: int, file_lines: int, seed: int) -> Dict[str, Any]:
+    paths = generate_corpus(corpus_dir, n_files, file_lines, python_share=1.0, seed=seed)
+    code_filter = Filter("python")
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+
+    t0 = time.perf_counter()
+    for p in paths:
+        code_filter.extract_context(p)
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "name": "extract_context",
+        "files": len(paths),
+        "seconds": elapsed,
+        "files_per_s": len(paths) / elapsed,
+        "mb_per_s": total_bytes / elapsed / 1e6,
+    }
+
+
+def bench_ingest(kb_dir: str, n_chunks: int, batch: int, seed: int) -> Dict[str, Any]:
+    """Честная загрузка через add_many (включая модель эмбеддингов)."""
+    kb = LocalKB(kb_dir)
+    kb.model  # загрузка модели не входит в замер
+    chunks = make_chunks(n_chunks, seed)
+
+    t0 = time.perf_counter()
+    for i in range(0, len(chunks), batch):
+        kb.add_many(chunks[i:i + batch])
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "name": "add_many",
+        "chunks": n_chunks,
+        "batch": batch,
+        "seconds": elapsed,
+        "chunks_per_s": n_chunks / elapsed,
+    }
+
+
+def bench_scale(kb_dir: str, n: int, queries: int, k: int, seed: int) -> List[Dict[str, Any]]:
+    build_synthetic_kb(kb_dir, n, seed)
+
+    t0 = time.perf_counter()
+    kb = LocalKB(kb_dir)
+    cold_start = time.perf_counter() - t0
+
+    rng = random.Random(seed + 1)
+    qrng = np.random.default_rng(seed + 1)
+    results: List[Dict[str, Any]] = [{"name": "load", "chunks": n, "seconds": cold_start}]
+
+    filter_args = [(rng.choice(_LANGUAGES), rng.sample(_MODULES, 2)) for _ in range(queries)]
+    it = iter(filter_args)
+    samples = _timed(lambda: kb.get_filtered_chunks(*next(it)), queries)
+    results.append({"name": "get_filtered_chunks", "chunks": n, "queries": queries, **_percentiles(samples)})
+
+    texts = [" ".join(_ident(rng) for _ in range(6)) for _ in range(queries)]
+    it = iter(texts)
+    samples = _timed(lambda: kb.search_bm25(next(it), k=k), queries)
+    results.append({"name": "search_bm25", "chunks": n, "queries": queries, "k": k, **_percentiles(samples)})
+
+    q_vectors = qrng.standard_normal((queries, EMBEDDING_DIM), dtype=np.float32)
+    q_vectors /= np.linalg.norm(q_vectors, axis=1, keepdims=True)
+    it = iter(zip(texts, q_vectors))
+    samples = _timed(lambda: _vector(kb, next(it), k), queries)
+    results.append({"name": "search_vector", "chunks": n, "queries": queries, "k": k, **_percentiles(samples)})
+
+    it = iter(zip(texts, q_vectors))
+    samples = _timed(lambda: _hybrid(kb, next(it), k), queries)
+    results.append({"name": "search_hybrid", "chunks": n, "queries": queries, "k": k, **_percentiles(samples)})
+
+    return results
+
+
+def _vector(kb: LocalKB, q: tuple, k: int) -> Any:
+    text, vector = q
+    return kb.search_vector(text, k=k, query_vector=vector)
+
+
+def _hybrid(kb: LocalKB, q: tuple, k: int) -> Any:
+    text, vector = q
+    return kb.search_hybrid(text, k=k, query_vector=vector)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки code_filter / kb_local_hybrid")
+    parser.add_argument("--only", default="extract,ingest,scale", help="какие группы запускать: extract,ingest,scale")
+    parser.add_argument("--files", type=int, default=200, help="число файлов для extract_context")
+    parser.add_argument("--file-lines", type=int, default=300)
+    parser.add_argument("--ingest-chunks", type=int, default=256, help="число чанков для add_many (с моделью)")
+    parser.add_argument("--ingest-batch", type=int, default=64)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="размеры базы для load/filter/search")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="каталог для временных данных (по умолчанию tmp)")
+    parser.add_argument("--out", default=None, help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    groups = {g.strip() for g in args.only.split(",") if g.strip()}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="code_filter_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results: List[Dict[str, Any]] = []
+    try:
+        if "extract" in groups:
+            results.append(bench_extract(os.path.join(workdir, "corpus"), args.files, args.file_lines, args.seed))
+        if "ingest" in groups:
+            results.append(bench_ingest(os.path.join(workdir, "kb_ingest"), args.ingest_chunks, args.ingest_batch, args.seed))
+        if "scale" in groups:
+            for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+                kb_dir = os.path.join(workdir, f"kb_{size}")
+                results.extend(bench_scale(kb_dir, size, args.queries, args.k, args.seed))
+                shutil.rmtree(kb_dir, ignore_errors=True)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import tree_sitter
+
+from code_filter import Filter
+from kb_local_hybrid import Chunk
+
+
+CLASS_NODE_TYPES = {"class_definition"}
+FUNCTION_NODE_TYPES = {"function_definition"}
+COMMENT_NODE_TYPES = {"comment", "line_comment", "block_comment"}
+
+
+@dataclass
+class _Segment:
+    start_byte: int
+    end_byte: int
+    start_line: int  # с 1
+    end_line: int
+    symbol: str = ""
+    classes: List[str] = field(default_factory=list)
+    functions: List[str] = field(default_factory=list)
+    # строка-заголовок класса для кусков, вырезанных из его тела
+    header: str = ""
+    # CodeInfo определений куска: {"classes": [...], "functions": [...]}
+    info: Optional[Dict[str, Any]] = None
+
+
+class Chunker:
+    """
+    Разбиение файла на чанки по границам классов и функций (узлы AST из Filter).
+
+    - функция верхнего уровня — отдельный чанк;
+    - класс целиком, если помещается в max_bytes, иначе по методам
+      (к каждому куску добавляется строка заголовка класса);
+    - остальной код верхнего уровня склеивается в чанки до max_bytes;
+    - кусок больше max_bytes дорезается по строкам;
+    - комментарии прямо перед классом, функцией или методом идут в их чанк.
+
+    Все чанки файла наследуют его импорты (и их же с модулями — qualified_imports),
+    классы и функции чанка — свои,
+    в Chunk.info — полный CodeInfo этих классов и функций (параметры, декораторы, ...).
+    Для языков без описанных типов узлов разбиение идёт по узлам верхнего уровня.
+    """
+
+    def __init__(self, code_filter: Filter, max_bytes: int = 2000):
+        self.filter = code_filter
+        self.max_bytes = max_bytes
+
+    def chunk_file(self, file_path: str, repo: str, path: Optional[str] = None) -> List[Chunk]:
+        path = path or file_path
+        self.filter.create_tree_from_file(file_path)
+        root = self.filter.get_root_node()
+        code_info = self.filter.get_code_info(root)
+        context = self.filter.flatten_code_info(code_info)
+        qualified_imports = self.filter.qualified_imports(code_info)
+
+        chunks = []
+        # сколько чанков уже получили диапазон строк: у нескольких кусков одной строки
+        # id различаются порядковым номером ("...::1-1#2")
+        seen: Dict[Tuple[int, int], int] = {}
+        for seg in self._split(root):
+            for start_line, end_line, content in self._cap(seg):
+                ordinal = seen.get((start_line, end_line), 0) + 1
+                seen[(start_line, end_line)] = ordinal
+                suffix = f"#{ordinal}" if ordinal > 1 else ""
+                chunks.append(Chunk(
+                    chunk_id=f"{repo}::{path}::{start_line}-{end_line}{suffix}",
+                    repo=repo,
+                    path=path,
+                    language=context["language"],
+                    # у каждого чанка свои списки: изменение одного чанка не задевает соседей
+                    imports=list(context["imports"]),
+                    qualified_imports=list(qualified_imports),
+                    classes=list(seg.classes),
+                    functions=list(seg.functions),
+                    content=content,
+                    start_line=start_line,
+                    end_line=end_line,
+                    symbol=seg.symbol,
+                    info=seg.info,
+                ))
+        return chunks
+
+    def _line_start(self, node: tree_sitter.Node) -> int:
+        """
+        Начало строки node вместе с отступом; если на этой строке перед node уже есть код
+        (несколько узлов на одной строке: минифицированный JS, "a = 1; b = 2"),
+        кусок начинается с самого node, иначе куски перекрывались бы.
+        """
+        # start_point[1] — смещение в байтах от начала строки
+        line_start = node.start_byte - node.start_point[1]
+        if self.filter.get_source_text(line_start, node.start_byte).strip():
+            return node.start_byte
+        return line_start
+
+    def _node_segment(self, node: tree_sitter.Node, leading: Optional[List[tree_sitter.Node]] = None, **kwargs) -> _Segment:
+        """Кусок от начала node (или первого из leading — комментариев перед ним) до конца node."""
+        first = leading[0] if leading else node
+        return _Segment(self._line_start(first), node.end_byte, first.start_point[0] + 1, node.end_point[0] + 1, **kwargs)
+
+    @staticmethod
+    def _definition(node: tree_sitter.Node) -> Optional[tree_sitter.Node]:
+        """Узел класса/функции (с учётом декораторов) или None."""
+        if node.type == "decorated_definition":
+            node = node.child_by_field_name("definition")
+            if node is None:
+                return None
+        if node.type in CLASS_NODE_TYPES or node.type in FUNCTION_NODE_TYPES:
+            return node
+        return None
+
+    def _split(self, root: tree_sitter.Node) -> List[_Segment]:
+        segments: List[_Segment] = []
+        pending: Optional[_Segment] = None
+        # комментарии, которые ещё не ясно куда отнести: к следующему определению или к прочему коду
+        leading: List[tree_sitter.Node] = []
+
+        for node in root.children:
+            if node.type in COMMENT_NODE_TYPES:
+                leading.append(node)
+                continue
+            definition = self._definition(node)
+            if definition is None:
+                for comment in leading:
+                    pending = self._accumulate(pending, comment, segments)
+                leading = []
+                pending = self._accumulate(pending, node, segments)
+                continue
+
+            if pending is not None:
+                segments.append(pending)
+                pending = None
+
+            if definition.type in CLASS_NODE_TYPES:
+                segments.extend(self._class_segments(node, definition, leading))
+            else:
+                function_info = self.filter.get_function_info(definition)
+                name = function_info.get("name", "")
+                segments.append(self._node_segment(
+                    node, leading, symbol=name, functions=[name] if name else [],
+                    info={"classes": [], "functions": [function_info]},
+                ))
+            leading = []
+
+        for comment in leading:
+            pending = self._accumulate(pending, comment, segments)
+        if pending is not None:
+            segments.append(pending)
+        return segments
+
+    def _accumulate(self, pending: Optional[_Segment], node: tree_sitter.Node, segments: List[_Segment], **meta) -> _Segment:
+        """
+        Приклеивает узел к текущему куску прочего кода, пока тот не превысит max_bytes.
+        meta — метаданные для нового куска (класс, заголовок).
+        """
+        if pending is not None and node.end_byte - pending.start_byte <= self.max_bytes:
+            pending.end_byte = node.end_byte
+            pending.end_line = node.end_point[0] + 1
+            return pending
+        if pending is not None:
+            segments.append(pending)
+        return self._node_segment(node, **meta)
+
+    def _class_segments(
+        self, node: tree_sitter.Node, definition: tree_sitter.Node, leading: List[tree_sitter.Node],
+    ) -> List[_Segment]:
+        class_info = self.filter.get_class_info(definition)
+        name = class_info.get("name", "")
+        methods = [fn.get("name", "") for fn in class_info.get("functions", []) if fn.get("name")]
+
+        body = definition.child_by_field_name("body")
+        start = self._line_start(leading[0] if leading else node)
+        if node.end_byte - start <= self.max_bytes or body is None:
+            return [self._node_segment(
+                node, leading, symbol=name, classes=[name], functions=methods,
+                info={"classes": [class_info], "functions": []},
+            )]
+
+        # у кусков класса — класс только с теми методами, что попали в кусок
+        def part_info(functions: List[Dict[str, Any]]) -> Dict[str, Any]:
+            part = {k: v for k, v in class_info.items() if k != "functions"}
+            part["functions"] = functions
+            return {"classes": [part], "functions": []}
+
+        # заголовок — до двоеточия: комментарии между ним и телом относятся к первому методу
+        colon = next((c for c in definition.children if c.type == ":"), None)
+        header_end = colon.end_byte if colon is not None else body.start_byte
+        header = self.filter.get_source_text(definition.start_byte, header_end).rstrip()
+        segments: List[_Segment] = []
+        # первый кусок начинается с заголовка класса (вместе с декораторами и комментариями перед ним)
+        first = leading[0] if leading else node
+        header_segment = _Segment(
+            start, header_end, first.start_point[0] + 1,
+            (colon.end_point[0] if colon is not None else max(node.start_point[0], body.start_point[0] - 1)) + 1,
+            symbol=name, classes=[name], info=part_info([]),
+        )
+        pending: Optional[_Segment] = header_segment
+        accumulate = lambda pending, child: self._accumulate(
+            pending, child, segments, symbol=name, classes=[name], header=header, info=part_info([]),
+        )
+
+        # комментарии между методами — к следующему методу, а не отдельным чанком из заголовка и комментария
+        comments: List[tree_sitter.Node] = [
+            c for c in definition.children if c.type in COMMENT_NODE_TYPES and c.start_byte >= header_end
+        ]
+        for child in body.children:
+            if child.type in COMMENT_NODE_TYPES:
+                comments.append(child)
+                continue
+            method = self._definition(child)
+            if method is None or method.type not in FUNCTION_NODE_TYPES:
+                for comment in comments:
+                    pending = accumulate(pending, comment)
+                comments = []
+                pending = accumulate(pending, child)
+                continue
+            if pending is not None:
+                segments.append(pending)
+                pending = None
+            method_info = self.filter.get_function_info(method)
+            method_name = method_info.get("name", "")
+            segments.append(self._node_segment(
+                child, comments, symbol=f"{name}.{method_name}", classes=[name],
+                functions=[method_name] if method_name else [], header=header,
+                info=part_info([method_info]),
+            ))
+            comments = []
+
+        if comments and pending is None and segments:
+            # комментарии в конце тела класса дописываются к последнему методу
+            segments[-1].end_byte = comments[-1].end_byte
+            segments[-1].end_line = comments[-1].end_point[0] + 1
+            comments = []
+        for comment in comments:
+            pending = accumulate(pending, comment)
+        if pending is not None:
+            segments.append(pending)
+        # голый заголовок "class X:" без декораторов, комментариев и кода тела — не чанк:
+        # он есть в начале каждого куска класса
+        bare = header_segment.end_byte == header_end and header_segment.start_byte == self._line_start(definition)
+        return [seg for seg in segments if not (seg is header_segment and bare)]
+
+    def _cap(self, seg: _Segment):
+        """Возвращает (start_line, end_line, content); кусок больше max_bytes режется по строкам."""
+        text = self.filter.get_source_text(seg.start_byte, seg.end_byte)
+        prefix = seg.header + "\n" if seg.header else ""
+        if len(text.encode("utf8")) <= self.max_bytes:
+            yield seg.start_line, seg.end_line, prefix + text
+            return
+
+        lines = text.splitlines(keepends=True)
+        piece: List[str] = []
+        piece_size = 0
+        piece_start = seg.start_line
+        for offset, line in enumerate(lines):
+            size = len(line.encode("utf8"))
+            if piece and piece_size + size > self.max_bytes:
+                yield piece_start, piece_start + len(piece) - 1, prefix + "".join(piece)
+                piece, piece_size, piece_start = [], 0, seg.start_line + offset
+            piece.append(line)
+            piece_size += size
+        if piece:
+            yield piece_start, piece_start + len(piece) - 1, prefix + "".join(piece)
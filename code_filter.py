@@ -1,14 +1,21 @@
 import json
+import sys
+from typing import Any, BinaryIO, Iterator, Tuple, Union
+
 import tree_sitter
 from tree_sitter_go import language
+import codec
 import constants
 import filter_models
+from profiling import profiler
 
 class Filter:
 
     def __init__(self, language: str):
 
         language = language.lower()
+        # "C#", "golang", "js" и т.п. приводятся к одному имени: оно попадает в LanguageInfo
+        language = constants.LANGUAGE_ALIASES.get(language, language)
 
         self._language = language
 
@@ -16,20 +23,22 @@ class Filter:
             self._parser_language = constants.PY_LANGUAGE
         elif self._language == 'bash':
             self._parser_language = constants.BASH_LANGUAGE
-        elif self._language == 'c_sharp' or self._language == 'csharp' or self._language == 'C#':
+        elif self._language == 'c_sharp':
             self._parser_language = constants.C_SHARP_LANGUAGE
-        elif self._language == 'cpp' or self._language == 'c++':
+        elif self._language == 'cpp':
             self._parser_language = constants.CPP_LANGUAGE
-        elif self._language == 'go' or self._language == 'golang':
+        elif self._language == 'go':
             self._parser_language = constants.GO_LANGUAGE
         elif self._language == 'java':
             self._parser_language = constants.JAVA_LANGUAGE
-        elif self._language == 'javascript' or self._language == 'js':
+        elif self._language == 'javascript':
             self._parser_language = constants.JAVASCRIPT_LANGUAGE
         elif self._language == 'rust':
             self._parser_language = constants.RUST_LANGUAGE
         elif self._language == 'sql':
             self._parser_language = constants.SQL_LANGUAGE
+        else:
+            raise ValueError(f"Неподдерживаемый язык: {language}")
 
         self._parser = tree_sitter.Parser(self._parser_language)
 
@@ -42,17 +51,155 @@ class Filter:
         Создаёт AST из файла по указанному пути.
         """
         try:
-            with open(file_path, "r", encoding="utf8") as f:
+            with profiler.span("filter.read"), open(file_path, "r", encoding="utf8") as f:
                 source_code = f.read()
         except FileNotFoundError:
             raise FileNotFoundError(f"Файл не найден: {file_path}")
         except UnicodeDecodeError:
             raise ValueError(f"Не удалось прочитать файл как UTF-8: {file_path}")
 
-        source_code_bytes = bytes(source_code, "utf8")
-        self._tree = self._parser.parse(source_code_bytes)
+        self.create_tree_from_source(source_code)
+
+    def create_tree_from_source(self, source_code: Union[str, bytes]) -> None:
+        """Создаёт AST из исходного кода в памяти (например, запроса CoIR)."""
+        source_code_bytes = source_code.encode("utf8") if isinstance(source_code, str) else source_code
+        profiler.count("filter.bytes_read", len(source_code_bytes))
+        with profiler.span("filter.parse"):
+            self._tree = self._parser.parse(source_code_bytes)
         self._source_code = source_code_bytes
 
+    # начальный размер окна потокового разбора (iter_code_info)
+    _STREAM_WINDOW = 1 << 20
+
+    def _open_stream(self, source: Union[str, BinaryIO]) -> Tuple[BinaryIO, bool]:
+        """Возвращает (двоичный файл, нужно ли его закрыть). "-" — stdin."""
+        if isinstance(source, str):
+            if source == "-":
+                source = sys.stdin
+            else:
+                try:
+                    return open(source, "rb"), True
+                except FileNotFoundError:
+                    raise FileNotFoundError(f"Файл не найден: {source}")
+        return getattr(source, "buffer", source), False  # текстовый поток -> двоичный
+
+    def iter_code_info(self, source: Union[str, BinaryIO]) -> Iterator[Tuple[str, Any]]:
+        """
+        Потоковая экстракция для огромных файлов и stdin.
+
+        source — путь, "-" (stdin) или файловый объект, читается последовательно.
+        Исходник разбирается окнами по границам узлов верхнего уровня (_stream_cut):
+        из окна отдаются узлы до границы, которую не могла испортить граница окна,
+        и следующее окно начинается с неё. Если границы нет (огромный класс), окно
+        удваивается. В памяти — одно окно и его дерево, а не весь файл; настоящая
+        синтаксическая ошибка растягивает окно до конца файла.
+        Записи отдаются по мере обхода узлов верхнего уровня:
+            ("language", LanguageInfo) — первой,
+            ("import", ImportsInfo), ("class", ClassInfo), ("function", FunctionInfo).
+        Классы и функции — по тем же правилам, что в get_code_info, но в порядке
+        появления в файле, а не сгруппированные по виду.
+        """
+        f, owned = self._open_stream(source)
+        try:
+            window = self._STREAM_WINDOW
+            buffer = b""
+            eof = False
+            first = True
+            nodes_visited = 0
+            while True:
+                while not eof and len(buffer) < window:
+                    data = f.read(window - len(buffer))
+                    eof = not data
+                    buffer += data
+                profiler.count("filter.bytes_read", len(buffer))
+                with profiler.span("filter.parse"):
+                    self._tree = self._parser.parse(buffer)
+                # узлы окна адресуют байты от его начала
+                self._source_code = buffer
+                root = self._tree.root_node
+                if first:
+                    yield "language", self.get_language_info(root)
+                    first = False
+
+                children = root.children
+                if not eof:
+                    cut = self._stream_cut(root)
+                    if cut == 0:
+                        window *= 2
+                        continue
+                    children = children[:cut + 1]
+                done = children if eof else children[:-1]
+                nodes_visited += 1
+                for child in done:
+                    import_info = self.get_import_statement_info(child)
+                    if import_info is not None:
+                        yield "import", import_info
+                        continue
+                    classes_info: list[filter_models.ClassInfo] = []
+                    functions_info: list[filter_models.FunctionInfo] = []
+                    nodes_visited += self._collect_definitions(child, classes_info, functions_info)
+                    for class_info in classes_info:
+                        yield "class", class_info
+                    for function_info in functions_info:
+                        yield "function", function_info
+                if eof:
+                    break
+                buffer = buffer[children[-1].start_byte:]
+                window = self._STREAM_WINDOW
+            profiler.count("filter.nodes_visited", nodes_visited)
+        finally:
+            self._source_code = b""
+            if owned:
+                f.close()
+
+    @staticmethod
+    def _stream_cut(root: tree_sitter.Node) -> int:
+        """
+        Номер узла верхнего уровня, с которого начнётся следующее окно (0 — границы нет).
+        Граница окна ломает последний узел, а восстановление после ошибки отрезает
+        хвост и у узла перед ошибкой, поэтому граница — не позже узла перед первым
+        узлом с ошибкой, с начала строки и не на строке предыдущего узла
+        ("import a as b", обрезанное до "import a a", — два узла на одной строке).
+        """
+        if root.is_error:
+            # корень-ошибка: узлы верхнего уровня — обломки
+            return 0
+        children = root.children
+        error = next((i for i, c in enumerate(children) if c.has_error), None)
+        cut = len(children) - 1 if error is None else error - 1
+        while cut > 0:
+            start = children[cut].start_point
+            if start[1] == 0 and start[0] > children[cut - 1].end_point[0]:
+                return cut
+            cut -= 1
+        return 0
+
+    def extract_context_stream(self, source: Union[str, BinaryIO]) -> dict:
+        """То же, что extract_context, но через iter_code_info: полный CodeInfo не строится."""
+        context = {"language": "unknown", "imports": set(), "classes": [], "functions": []}
+        for kind, record in self.iter_code_info(source):
+            if kind == "language":
+                context["language"] = record.get("language", "unknown").strip()
+            elif kind == "import":
+                for imp in record if isinstance(record, list) else [record]:
+                    self._collect_imports_from_item_safe(imp, context["imports"])
+            else:
+                name = record.get("name", "").strip()
+                if name:
+                    context["classes" if kind == "class" else "functions"].append(name)
+        context["imports"] = sorted(context["imports"])
+        return context
+
+    def get_root_node(self) -> tree_sitter.Node:
+        """Корень AST, построенного последним вызовом create_tree_from_file."""
+        return self._tree.root_node
+
+    def get_node_text(self, node: tree_sitter.Node) -> str:
+        return self.get_source_text(node.start_byte, node.end_byte)
+
+    def get_source_text(self, start_byte: int, end_byte: int) -> str:
+        return self._source_code[start_byte:end_byte].decode("utf8", errors="ignore")
+
     def get_language_info(self, node: tree_sitter.Node) -> filter_models.LanguageInfo:
         if node is None:
             return
@@ -66,6 +213,16 @@ class Filter:
         
         imports: list = []
 
+        for child in node.children:
+            import_info = self.get_import_statement_info(child)
+            if import_info is not None:
+                imports.append(import_info)
+
+        return imports
+
+    def get_import_statement_info(self, node: tree_sitter.Node):
+        """Разбирает один узел import_statement / import_from_statement; для прочих узлов — None."""
+
         def _parse_import_statement(n) -> list[filter_models.ImportsInfo]:
             imports: list[filter_models.ImportsInfo] = []
 
@@ -156,13 +313,11 @@ class Filter:
                 names=names
             )
 
-        for child in node.children:
-            if child.type == "import_statement":
-                imports.append(_parse_import_statement(child))
-            elif child.type == "import_from_statement":
-                imports.append(_parse_import_from_statement(child))
-
-        return imports
+        if node.type == "import_statement":
+            return _parse_import_statement(node)
+        if node.type == "import_from_statement":
+            return _parse_import_from_statement(node)
+        return None
 
 
     def get_code_info(self, node: tree_sitter.Node) -> filter_models.CodeInfo:
@@ -174,7 +329,32 @@ class Filter:
         classes_info: list[filter_models.ClassInfo] = []
         functions_info: list[filter_models.FunctionInfo] = []
 
+        with profiler.span("filter.walk"):
+            nodes_visited = self._collect_definitions(node, classes_info, functions_info)
+            imports_info = self.get_imports_info(node)
+            language_info = self.get_language_info(node)
+        profiler.count("filter.nodes_visited", nodes_visited)
+
+        code_info: filter_models.CodeInfo = {}
+        code_info["language"] = language_info
+        code_info["imports"] = imports_info
+        code_info["classes"] = classes_info
+        code_info["functions"] = functions_info
+
+        return code_info
+        
+    def _collect_definitions(
+        self,
+        node: tree_sitter.Node,
+        classes_info: list[filter_models.ClassInfo],
+        functions_info: list[filter_models.FunctionInfo],
+    ) -> int:
+        """Собирает классы и функции вне классов в поддереве node. Возвращает число посещённых узлов."""
+        nodes_visited = 0
+
         def _get_top_level_classes_info(n):
+            nonlocal nodes_visited
+            nodes_visited += 1
             if n.type == "class_definition":
                 class_info = self.get_class_info(n)
                 classes_info.append(class_info)
@@ -182,27 +362,20 @@ class Filter:
                 _get_top_level_classes_info(child)
 
         def _get_top_level_functions_info(n): # функции, объявленные вне классов
+            nonlocal nodes_visited
+            nodes_visited += 1
             if n.type == "class_definition":
                 return
             if n.type == "function_definition":
                 function_info = self.get_function_info(n)
                 functions_info.append(function_info)
             for child in n.children:
-                _get_top_level_functions_info(child)       
+                _get_top_level_functions_info(child)
 
         _get_top_level_classes_info(node)
         _get_top_level_functions_info(node)
-        imports_info = self.get_imports_info(node)
-        language_info = self.get_language_info(node)
-
-        code_info: filter_models.CodeInfo = {}
-        code_info["language"] = language_info
-        code_info["imports"] = imports_info
-        code_info["classes"] = classes_info
-        code_info["functions"] = functions_info
+        return nodes_visited
 
-        return code_info
-        
     def get_class_info(self, node: tree_sitter.Node) -> filter_models.ClassInfo:
         if node is None:
             return
@@ -319,9 +492,22 @@ class Filter:
         Анализирует файл и возвращает плоский контекст для поиска.
         Безопасно обрабатывает отсутствующие ключи.
         """
+        with profiler.span("filter.extract_context"):
+            return self._extract_context(file_path)
+
+    def _extract_context(self, file_path: str) -> dict:
         self.create_tree_from_file(file_path)
         info = self.get_code_info(self._tree.root_node)
+        return self.flatten_code_info(info)
+
+    def extract_context_from_source(self, source_code: Union[str, bytes]) -> dict:
+        """То же, что extract_context, для кода в памяти."""
+        with profiler.span("filter.extract_context"):
+            self.create_tree_from_source(source_code)
+            return self.flatten_code_info(self.get_code_info(self._tree.root_node))
 
+    def flatten_code_info(self, info: filter_models.CodeInfo) -> dict:
+        """Сводит CodeInfo к плоскому контексту: язык, имена импортов, классов и функций."""
         # 1. Язык
         language = info.get("language", {}).get("language", "unknown").strip()
 
@@ -358,6 +544,32 @@ class Filter:
             "functions": functions,
         }
 
+    def qualified_imports(self, info: filter_models.CodeInfo) -> list:
+        """
+        Импорты CodeInfo вместе с модулем, откуда они взяты: "a.b" для import a.b,
+        "M.x" для from M import x, "M" для from M import *. У относительных импортов
+        точки в начале сохраняются (".utils.x", ".x" для from . import x): их
+        разрешает граф зависимостей по пути чанка.
+        """
+        qualified = []
+        for imp_group in info.get("imports", []):
+            for imp in imp_group if isinstance(imp_group, list) else [imp_group]:
+                if not isinstance(imp, dict):
+                    continue
+                module = imp.get("modules", {}).get("module", "").strip()
+                if imp.get("type") == "import":
+                    if module:
+                        qualified.append(module)
+                elif imp.get("type") == "import_from":
+                    for name_info in imp.get("names", []):
+                        name = name_info.get("name", "").strip() if isinstance(name_info, dict) else ""
+                        if name == "*":
+                            qualified.append(module)
+                        elif name:
+                            # "from . import x" -> ".x", "from .m import x" -> ".m.x"
+                            qualified.append(module + name if module.endswith(".") else f"{module}.{name}")
+        return sorted(set(q for q in qualified if q))
+
     def _collect_imports_from_item_safe(self, imp_item, imports_set):
         """Безопасное извлечение имён из одного элемента импорта."""
         if not isinstance(imp_item, dict):
@@ -381,4 +593,14 @@ class Filter:
 
     def make_info_in_json_file(self, info: filter_models.CodeInfo, filename: str) -> None:
         with open(filename, "w", encoding="utf8") as f:
-            json.dump(info, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+            json.dump(info, f, ensure_ascii=False, indent=2)
+
+    def make_info_in_binary_file(self, info: filter_models.CodeInfo, filename: str) -> None:
+        """Компактная двоичная запись CodeInfo (см. codec), читается read_info_from_binary_file."""
+        with open(filename, "wb") as f:
+            codec.write_code_infos(f, [info])
+
+    @staticmethod
+    def read_info_from_binary_file(filename: str) -> filter_models.CodeInfo:
+        with open(filename, "rb") as f:
+            return next(codec.iter_code_infos(f))
\ No newline at end of file
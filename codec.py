@@ -0,0 +1,391 @@
+"""
+Компактное двоичное хранение метаданных вместо JSON с отступами.
+
+Чанки (chunks.bin) хранятся по столбцам:
+    заголовок | таблица строк | столбцы id строк и номеров строк (numpy) |
+    списки imports/classes/functions/qualified_imports (CSR) | CodeInfo чанков (см. ниже) |
+    смещения текста | тексты подряд
+Повторяющиеся строки (репозитории, пути, языки, имена импортов) лежат в таблице
+один раз, числовые столбцы читаются через np.frombuffer без разбора. Чанки
+собираются из столбцов целиком, без промежуточного словаря на чанк. Тексты идут
+последним разделом, поэтому iter_chunks читает их последовательно и не держит в памяти.
+
+CodeInfo кодируется в тегированный формат (как msgpack) с фиксированной таблицей
+ключей схемы filter_models; записи в потоке предваряются длиной. CodeInfo чанков
+разбирается лениво (PackedCodeInfo): при загрузке базы он почти никогда не нужен.
+"""
+import dataclasses
+import struct
+from collections.abc import Mapping
+from itertools import repeat
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import filter_models
+
+
+_CHUNKS_MAGIC = b"CFCH"
+_CHUNKS_VERSION = 3  # 2: добавлен раздел CodeInfo чанков; 3: добавлен список qualified_imports
+_CHUNKS_HEADER = struct.Struct("<4sHII")  # magic, версия, число чанков, число строк в таблице
+_SECTION = struct.Struct("<Q")
+
+_STR_FIELDS = ("chunk_id", "repo", "path", "language", "symbol", "content_hash", "duplicate_of")
+_INT_FIELDS = ("start_line", "end_line")
+_LIST_FIELDS = ("imports", "classes", "functions", "qualified_imports")
+# списки, которые есть в файлах каждой версии (позже добавленные — в конце _LIST_FIELDS)
+_LIST_FIELDS_BY_VERSION = {1: 3, 2: 3, 3: 4}
+
+
+def _write_section(f: BinaryIO, data: bytes) -> None:
+    f.write(_SECTION.pack(len(data)))
+    f.write(data)
+
+
+def _read_section(f: BinaryIO) -> bytes:
+    (size,) = _SECTION.unpack(f.read(_SECTION.size))
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Файл чанков обрезан")
+    return data
+
+
+def write_chunks(f: BinaryIO, chunks: List[Any]) -> None:
+    """Пишет чанки (объекты с полями Chunk) в открытый двоичный файл."""
+    table: Dict[str, int] = {}
+    intern = lambda s: table.setdefault(s, len(table))
+
+    n = len(chunks)
+    str_ids = np.fromiter(
+        (intern(getattr(c, name)) for c in chunks for name in _STR_FIELDS),
+        dtype=np.uint32, count=n * len(_STR_FIELDS),
+    )
+    ints = np.fromiter(
+        (getattr(c, name) for c in chunks for name in _INT_FIELDS),
+        dtype=np.int32, count=n * len(_INT_FIELDS),
+    )
+    lists = []
+    for name in _LIST_FIELDS:
+        values = [getattr(c, name, None) or [] for c in chunks]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in values], out=indptr[1:])
+        ids = np.fromiter((intern(s) for v in values for s in v), dtype=np.uint32, count=int(indptr[-1]))
+        lists.append((indptr, ids))
+
+    # CodeInfo чанка — запись pack_code_info, пустая запись значит None;
+    # неразобранный PackedCodeInfo пишется теми же байтами
+    infos = [pack_code_info(c.info) if c.info is not None else b"" for c in chunks]
+    info_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in infos], out=info_offsets[1:])
+
+    contents = [c.content.encode("utf8") for c in chunks]
+    content_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in contents], out=content_offsets[1:])
+
+    f.write(_CHUNKS_HEADER.pack(_CHUNKS_MAGIC, _CHUNKS_VERSION, n, len(table)))
+    # строки таблицы — идентификаторы, пути, имена: без NUL, поэтому разделяем им
+    _write_section(f, "\0".join(table).encode("utf8"))
+    _write_section(f, str_ids.tobytes())
+    _write_section(f, ints.tobytes())
+    for indptr, ids in lists:
+        _write_section(f, indptr.tobytes())
+        _write_section(f, ids.tobytes())
+    _write_section(f, info_offsets.tobytes())
+    _write_section(f, b"".join(infos))
+    _write_section(f, content_offsets.tobytes())
+    f.write(_SECTION.pack(int(content_offsets[-1])))
+    for b in contents:
+        f.write(b)
+
+
+def _read_columns(f: BinaryIO) -> Tuple[int, Dict[str, List[Any]], np.ndarray]:
+    """Читает всё, кроме текстов: возвращает число чанков, столбцы полей без content и смещения текстов."""
+    magic, version, n, n_strings = _CHUNKS_HEADER.unpack(f.read(_CHUNKS_HEADER.size))
+    if magic != _CHUNKS_MAGIC:
+        raise ValueError("Не файл чанков")
+    if version not in _LIST_FIELDS_BY_VERSION:
+        raise ValueError(f"Неподдерживаемая версия файла чанков: {version}")
+
+    raw = _read_section(f).decode("utf8")
+    strings = np.array(raw.split("\0") if n_strings else [], dtype=object)
+
+    columns: Dict[str, List[Any]] = {}
+    str_ids = np.frombuffer(_read_section(f), dtype=np.uint32).reshape(n, len(_STR_FIELDS))
+    for j, name in enumerate(_STR_FIELDS):
+        columns[name] = strings[str_ids[:, j]].tolist()
+    ints = np.frombuffer(_read_section(f), dtype=np.int32).reshape(n, len(_INT_FIELDS))
+    for j, name in enumerate(_INT_FIELDS):
+        columns[name] = ints[:, j].tolist()
+    # в файлах старых версий недостающих списков нет: поля получат значения по умолчанию
+    for name in _LIST_FIELDS[:_LIST_FIELDS_BY_VERSION[version]]:
+        indptr = np.frombuffer(_read_section(f), dtype=np.int64).tolist()
+        values = strings[np.frombuffer(_read_section(f), dtype=np.uint32)].tolist()
+        columns[name] = [values[s:e] for s, e in zip(indptr, indptr[1:])]
+    if version >= 2:
+        info_offsets = np.frombuffer(_read_section(f), dtype=np.int64).tolist()
+        blob = _read_section(f)
+        columns["info"] = [
+            PackedCodeInfo(blob[s:e]) if e > s else None for s, e in zip(info_offsets, info_offsets[1:])
+        ]
+    else:
+        columns["info"] = [None] * n
+    content_offsets = np.frombuffer(_read_section(f), dtype=np.int64)
+    f.read(_SECTION.size)  # длина раздела текстов
+    return n, columns, content_offsets
+
+
+def _constructor(make: Callable[..., Any], n: int, columns: Dict[str, List[Any]]) -> Tuple[Callable[..., Any], List[Any]]:
+    """
+    Для dataclass — позиционные столбцы в порядке его полей (недостающие поля
+    заполняются значениями по умолчанию): чанки создаются через map без словарей
+    аргументов. Для прочих конструкторов — вызов с именованными аргументами.
+    """
+    if not dataclasses.is_dataclass(make):
+        names = list(columns)
+        return (lambda *values: make(**dict(zip(names, values)))), [columns[name] for name in names]
+    ordered = []
+    for field in dataclasses.fields(make):
+        if field.name in columns:
+            ordered.append(columns[field.name])
+        elif field.default_factory is not dataclasses.MISSING:
+            ordered.append([field.default_factory() for _ in range(n)])
+        else:
+            ordered.append(repeat(field.default, n))
+    return make, ordered
+
+
+def read_chunks(f: BinaryIO, make: Callable[..., Any]) -> List[Any]:
+    """Читает все чанки; make — конструктор чанка (например, Chunk)."""
+    n, columns, offsets = _read_columns(f)
+    blob = f.read(int(offsets[-1]))
+    bounds = offsets.tolist()
+    if blob.isascii():
+        # в ASCII смещения байтов совпадают со смещениями символов: декодируем раздел целиком
+        text = blob.decode("ascii")
+        columns["content"] = [text[s:e] for s, e in zip(bounds, bounds[1:])]
+    else:
+        columns["content"] = [blob[s:e].decode("utf8") for s, e in zip(bounds, bounds[1:])]
+    make, ordered = _constructor(make, n, columns)
+    return list(map(make, *ordered))
+
+
+def iter_chunks(f: BinaryIO, make: Callable[..., Any]) -> Iterator[Any]:
+    """Потоковое чтение: тексты читаются по одному, в памяти — только метаданные."""
+    n, columns, offsets = _read_columns(f)
+    sizes = np.diff(offsets).tolist()
+    columns["content"] = (f.read(size).decode("utf8") for size in sizes)
+    make, ordered = _constructor(make, n, columns)
+    yield from map(make, *ordered)
+
+
+def pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Список строк для .npz: байты UTF-8 подряд (uint8) и смещения строк (int64).
+    В отличие от np.array(strings, dtype=str), строки не дополняются до самой длинной.
+    """
+    encoded = [s.encode("utf8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    if data.isascii():
+        text = data.decode("ascii")
+        return [text[s:e] for s, e in zip(bounds, bounds[1:])]
+    return [data[s:e].decode("utf8") for s, e in zip(bounds, bounds[1:])]
+
+
+def append_rows(view: np.ndarray, buffer: Optional[np.ndarray], rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Дописывает rows к массиву view, лежащему в начале buffer — буфера с запасом
+    (растёт удвоением), поэтому дописывание стоит O(len(rows)), а не O(len(view)).
+    Возвращает (новый view, буфер). Если view не из buffer (массив заменили целиком),
+    буфер заводится заново.
+    """
+    n, k = len(view), len(rows)
+    if buffer is None or view.base is not buffer or len(buffer) < n + k:
+        buffer = np.empty((max(2 * (n + k), 1024), *view.shape[1:]), dtype=view.dtype)
+        buffer[:n] = view
+    buffer[n:n + k] = rows
+    return buffer[:n + k], buffer
+
+
+# ---------------------------------------------------------------------------
+# CodeInfo
+
+_KEYS = [
+    "language", "imports", "type", "modules", "module", "alias", "names", "name",
+    "classes", "superclasses", "functions", "decorators", "parameters", "return_type",
+    "default_value",
+]
+_KEY_IDS = {k: i + 1 for i, k in enumerate(_KEYS)}  # 0 — ключ вне схемы, записан строкой
+
+_T_NONE, _T_STR, _T_LIST, _T_DICT, _T_INT, _T_TRUE, _T_FALSE = range(7)
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_str(out: bytearray, s: str) -> None:
+    b = s.encode("utf8")
+    _write_varint(out, len(b))
+    out += b
+
+
+def _encode(out: bytearray, value: Any) -> None:
+    if value is None:
+        out.append(_T_NONE)
+    elif isinstance(value, str):
+        out.append(_T_STR)
+        _write_str(out, value)
+    elif isinstance(value, bool):
+        out.append(_T_TRUE if value else _T_FALSE)
+    elif isinstance(value, int):
+        out.append(_T_INT)
+        _write_varint(out, (value << 1) ^ (value >> 63))  # zigzag
+    elif isinstance(value, dict):
+        out.append(_T_DICT)
+        _write_varint(out, len(value))
+        for k, v in value.items():
+            key_id = _KEY_IDS.get(k, 0)
+            _write_varint(out, key_id)
+            if key_id == 0:
+                _write_str(out, k)
+            _encode(out, v)
+    elif isinstance(value, (list, tuple)):
+        out.append(_T_LIST)
+        _write_varint(out, len(value))
+        for v in value:
+            _encode(out, v)
+    else:
+        raise TypeError(f"Неподдерживаемый тип в CodeInfo: {type(value).__name__}")
+
+
+def _decode(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _T_STR:
+        size, pos = _read_varint(data, pos)
+        return data[pos:pos + size].decode("utf8"), pos + size
+    if tag == _T_DICT:
+        size, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(size):
+            key_id, pos = _read_varint(data, pos)
+            if key_id:
+                key = _KEYS[key_id - 1]
+            else:
+                key_size, pos = _read_varint(data, pos)
+                key = data[pos:pos + key_size].decode("utf8")
+                pos += key_size
+            result[key], pos = _decode(data, pos)
+        return result, pos
+    if tag == _T_LIST:
+        size, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(size):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == _T_INT:
+        raw, pos = _read_varint(data, pos)
+        return (raw >> 1) ^ -(raw & 1), pos
+    if tag == _T_NONE:
+        return None, pos
+    if tag == _T_TRUE:
+        return True, pos
+    if tag == _T_FALSE:
+        return False, pos
+    raise ValueError(f"Неизвестный тег {tag} в позиции {pos - 1}")
+
+
+class PackedCodeInfo(Mapping):
+    """
+    CodeInfo в упакованном виде (запись pack_code_info), разбирается при первом
+    обращении. Ведёт себя как словарь только для чтения; при записи файла чанков
+    байты копируются без разбора.
+    """
+
+    __slots__ = ("data", "_value")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._value: Optional[Dict[str, Any]] = None
+
+    def _unpacked(self) -> Dict[str, Any]:
+        if self._value is None:
+            self._value = unpack_code_info(self.data)
+        return self._value
+
+    def __getitem__(self, key: str) -> Any:
+        return self._unpacked()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._unpacked())
+
+    def __len__(self) -> int:
+        return len(self._unpacked())
+
+    def __repr__(self) -> str:
+        return repr(self._unpacked())
+
+    def __reduce__(self):
+        return PackedCodeInfo, (self.data,)
+
+
+def pack_code_info(info: filter_models.CodeInfo) -> bytes:
+    if isinstance(info, PackedCodeInfo):
+        return info.data
+    out = bytearray()
+    _encode(out, info)
+    return bytes(out)
+
+
+def unpack_code_info(data: bytes) -> filter_models.CodeInfo:
+    info, _ = _decode(data, 0)
+    return info
+
+
+def write_code_infos(f: BinaryIO, infos: List[filter_models.CodeInfo]) -> None:
+    """Пишет поток записей CodeInfo, каждая предваряется своей длиной."""
+    for info in infos:
+        data = pack_code_info(info)
+        header = bytearray()
+        _write_varint(header, len(data))
+        f.write(header)
+        f.write(data)
+
+
+def iter_code_infos(f: BinaryIO) -> Iterator[filter_models.CodeInfo]:
+    """Потоковое чтение записей CodeInfo из файла, записанного write_code_infos."""
+    while True:
+        size = shift = 0
+        while True:
+            b = f.read(1)
+            if not b:
+                if shift:
+                    raise ValueError("Файл CodeInfo обрезан")
+                return
+            size |= (b[0] & 0x7F) << shift
+            if b[0] < 0x80:
+                break
+            shift += 7
+        yield unpack_code_info(f.read(size))
@@ -17,4 +17,21 @@ GO_LANGUAGE = tree_sitter.Language(ts_go.language())
 JAVA_LANGUAGE = tree_sitter.Language(ts_java.language())
 JAVASCRIPT_LANGUAGE = tree_sitter.Language(ts_javascript.language())
 RUST_LANGUAGE = tree_sitter.Language(ts_rust.language())
-SQL_LANGUAGE = tree_sitter.Language(ts_sql.language())
\ No newline at end of file
+SQL_LANGUAGE = tree_sitter.Language(ts_sql.language())
+
+# другие написания языков -> имя, под которым язык известен Filter
+LANGUAGE_ALIASES = {
+    "py": "python",
+    "python3": "python",
+    "sh": "bash",
+    "shell": "bash",
+    "csharp": "c_sharp",
+    "c#": "c_sharp",
+    "cs": "c_sharp",
+    "c++": "cpp",
+    "cxx": "cpp",
+    "golang": "go",
+    "js": "javascript",
+    "node": "javascript",
+    "rs": "rust",
+}
@@ -0,0 +1,193 @@
+"""
+Поиск точных и почти-дубликатов при загрузке чанков.
+
+Точные дубликаты — по хэшу содержимого (с нормализованными переводами строк
+и хвостовыми пробелами). Почти-дубликаты — MinHash по шинглам токенов
+(tokenize из kb_local_hybrid) и LSH по полосам сигнатуры; кандидаты из LSH
+проверяются оценкой сходства Жаккара.
+"""
+import hashlib
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+_PRIME = np.uint64((1 << 31) - 1)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+
+def content_hash(text: str) -> str:
+    normalized = "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").split("\n")).strip()
+    return hashlib.blake2b(normalized.encode("utf8"), digest_size=16).hexdigest()
+
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token: str) -> int:
+    # crc32 стабилен между процессами, в отличие от hash()
+    return zlib.crc32(token.encode("utf8"))
+
+
+class MinHasher:
+    """MinHash-сигнатуры по шинглам из shingle подряд идущих токенов."""
+
+    def __init__(self, num_perm: int = 64, shingle: int = 3, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)
+
+    def signature(self, tokens: List[str]) -> np.ndarray:
+        h = np.fromiter((_token_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+        if h.size == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+
+        # шингл = полиномиальная свёртка хэшей соседних токенов (в 32 битах)
+        n = max(h.size - self.shingle + 1, 1)
+        shingles = np.zeros(n, dtype=np.uint64)
+        for i in range(min(self.shingle, h.size)):
+            shingles = (shingles * np.uint64(0x01000193) + h[i:i + n]) & _MASK32
+        x = np.unique(shingles)
+
+        # a < 2^31, x < 2^32: произведение помещается в uint64
+        values = (np.outer(self._a, x) + self._b[:, None]) % _PRIME
+        return values.min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        """Оценка сходства Жаккара по доле совпавших компонент."""
+        return float(np.mean(sig_a == sig_b))
+
+
+class LSHIndex:
+    """
+    LSH по полосам MinHash-сигнатур: bands полос по rows компонент.
+    Для каждой полосы хранится отсортированный массив ключей и номера документов,
+    поиск кандидатов — searchsorted без обхода документов.
+
+    Новые документы (add) ложатся отдельным сегментом; сегмент, не меньший
+    предыдущего, сливается с ним, поэтому сегментов O(log n), а каждый документ
+    пересортировывается O(log n) раз.
+    """
+
+    def __init__(self, signatures: np.ndarray, bands: int = 8):
+        self.bands = bands
+        self.rows = signatures.shape[1] // bands if signatures.ndim == 2 and signatures.shape[1] else 0
+        self._mult = np.random.default_rng(7).integers(1, 1 << 62, max(self.rows, 1), dtype=np.uint64) | np.uint64(1)
+        self.n_docs = 0
+        # сегменты: (число документов, ключи по полосам, номера документов по полосам)
+        self._segments: List[Tuple[int, List[np.ndarray], List[np.ndarray]]] = []
+        self.add(signatures)
+
+    def _band_keys(self, signatures: np.ndarray, band: int) -> np.ndarray:
+        part = signatures[:, band * self.rows:(band + 1) * self.rows].astype(np.uint64)
+        # переполнение uint64 здесь ожидаемо: это хэш
+        with np.errstate(over="ignore"):
+            return (part * self._mult).sum(axis=1, dtype=np.uint64)
+
+    def add(self, signatures: np.ndarray) -> None:
+        """Добавляет документы с номерами n_docs, n_docs + 1, ... по их сигнатурам."""
+        if self.rows == 0 or len(signatures) == 0:
+            return
+        keys = [self._band_keys(signatures, band) for band in range(self.bands)]
+        docs = [np.arange(self.n_docs, self.n_docs + len(signatures), dtype=np.int64)] * self.bands
+        self.n_docs += len(signatures)
+        segment = self._sorted(len(signatures), keys, docs)
+        while self._segments and self._segments[-1][0] <= segment[0]:
+            n, prev_keys, prev_docs = self._segments.pop()
+            segment = self._sorted(
+                n + segment[0],
+                [np.concatenate(pair) for pair in zip(prev_keys, segment[1])],
+                [np.concatenate(pair) for pair in zip(prev_docs, segment[2])],
+            )
+        self._segments.append(segment)
+
+    @staticmethod
+    def _sorted(n: int, keys: List[np.ndarray], docs: List[np.ndarray]) -> Tuple[int, List[np.ndarray], List[np.ndarray]]:
+        orders = [np.argsort(k, kind="stable") for k in keys]
+        return n, [k[o] for k, o in zip(keys, orders)], [d[o] for d, o in zip(docs, orders)]
+
+    def candidates(self, signature: np.ndarray) -> np.ndarray:
+        if not self._segments:
+            return np.zeros(0, dtype=np.int64)
+        found = []
+        sig = signature.reshape(1, -1)
+        for band in range(self.bands):
+            key = self._band_keys(sig, band)[0]
+            for _, keys, docs in self._segments:
+                lo = np.searchsorted(keys[band], key, side="left")
+                hi = np.searchsorted(keys[band], key, side="right")
+                if hi > lo:
+                    found.append(docs[band][lo:hi])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+
+def find_duplicates(
+    hashes: List[str],
+    signatures: np.ndarray,
+    known_hashes: Dict[str, int],
+    known_signatures: np.ndarray,
+    lsh: LSHIndex,
+    threshold: float = 0.85,
+    alive: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    sizes: Optional[List[int]] = None,
+    min_size: int = 0,
+) -> List[Optional[Tuple[str, str, int]]]:
+    """
+    Классифицирует новые документы относительно уже известных и друг друга.
+
+    Для каждого нового документа возвращает None, если он уникален, иначе
+    (kind, scope, index): kind — "exact" или "near"; scope — "kb", если канонический
+    документ уже в базе (index — его номер), или "batch", если это более ранний
+    документ того же батча. alive — функция: номера известных документов-кандидатов ->
+    маска тех, что ещё могут быть каноническими для почти-дубликатов (точная копия
+    может ссылаться на любой известный документ); проверяются только кандидаты LSH. sizes — число токенов новых документов:
+    почти-дубликаты ищутся только для документов не короче min_size, у коротких
+    оценка сходства по шинглам слишком шумная.
+    """
+    result: List[Optional[Tuple[str, str, int]]] = []
+    batch_hashes: Dict[str, int] = {}
+    # LSH по сигнатурам батча: кандидаты — более ранние уникальные документы батча
+    batch_lsh = LSHIndex(signatures, bands=lsh.bands) if len(hashes) > 1 else None
+    batch_unique = np.zeros(len(hashes), dtype=bool)
+
+    for i, h in enumerate(hashes):
+        known = known_hashes.get(h)
+        if known is not None:
+            result.append(("exact", "kb", known))
+            continue
+        if h in batch_hashes:
+            result.append(("exact", "batch", batch_hashes[h]))
+            continue
+
+        sig = signatures[i]
+        match: Optional[Tuple[str, str, int]] = None
+
+        if sizes is None or sizes[i] >= min_size:
+            candidates = lsh.candidates(sig)
+            if alive is not None and candidates.size:
+                candidates = candidates[alive(candidates)]
+            if candidates.size:
+                sims = (known_signatures[candidates] == sig).mean(axis=1)
+                best = int(np.argmax(sims))
+                if sims[best] >= threshold:
+                    match = ("near", "kb", int(candidates[best]))
+
+            if match is None and batch_lsh is not None:
+                candidates = batch_lsh.candidates(sig)
+                candidates = candidates[batch_unique[candidates]]
+                if candidates.size:
+                    sims = (signatures[candidates] == sig).mean(axis=1)
+                    best = int(np.argmax(sims))
+                    if sims[best] >= threshold:
+                        match = ("near", "batch", int(candidates[best]))
+
+        if match is None:
+            batch_hashes[h] = i
+            batch_unique[i] = True
+        result.append(match)
+    return result
@@ -0,0 +1,396 @@
+"""
+Граф зависимостей между чанками по извлечённым импортам.
+
+Чанк определяет ключи: имя своего модуля по пути файла (все суффиксы: "pkg.sub.mod",
+"sub.mod", "mod") и имена своих классов и функций внутри модуля ("pkg.sub.mod.Base",
+..., "mod.Base"). Ссылки чанка — импорты вместе с модулем (Chunk.qualified_imports):
+"a.b" для import a.b, "M.x" для from M import x, относительные — от пакета чанка.
+Чанк A зависит от чанка B того же репозитория, если ссылка A совпадает с ключом B:
+from M import x находит x только в модуле M, а не одноимённые символы других модулей.
+Голые имена классов и функций — ключи с префиксом "\0": по ним ищут запросы
+(dependents(["Base"])) и ссылки чанков старых баз, где модуля импорта нет.
+
+Всё хранится массивами CSR:
+    ключ -> чанки, которые его определяют;     чанк -> его ключи;
+    ссылка -> чанки, которые на неё ссылаются;  чанк -> его ссылки;
+    импорт -> чанки, которые его импортируют (фильтр по импортам).
+Рёбра не материализуются: шаг обхода — два среза CSR (чанки -> ключи -> чанки) по
+всему фронту массивами numpy, без перебора чанков в Python. Новые чанки добавляются
+сегментом CSR (extend), без перестроения графа; строки CSR ключ -> чанки в сегменте —
+только его ключи, поэтому размер сегмента не зависит от размера словаря ключей.
+"""
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import codec
+
+
+# имена файлов, которые определяют пакет (каталог), а не модуль
+_PACKAGE_FILES = {"__init__", "index"}
+
+# отношения ключ -> чанки; у "def" и "ref" есть и обратные CSR чанк -> ключи
+_RELATIONS = ("def", "ref", "imp")
+
+# префикс ключа голого имени класса или функции
+_BARE = "\0"
+
+# версия раскладки .npz; файлы других версий не читаются, граф строится заново
+_FORMAT = 4
+
+
+def _path_parts(path: str) -> List[str]:
+    stem = os.path.splitext(path.replace("\\", "/"))[0]
+    return [p for p in stem.split("/") if p and p != "."]
+
+
+def module_keys(path: str) -> List[str]:
+    """Имена модуля по пути файла: суффиксы через точку и через "/" (импорты Go и JS)."""
+    parts = _path_parts(path)
+    if len(parts) > 1 and parts[-1] in _PACKAGE_FILES:
+        parts = parts[:-1]
+    keys = []
+    for i in range(len(parts)):
+        keys.append(".".join(parts[i:]))
+        if len(parts) - i > 1:
+            keys.append("/".join(parts[i:]))
+    return keys
+
+
+def resolve_import(ref: str, path: str) -> Optional[str]:
+    """
+    Относительную ссылку (".utils.x", "..x") переводит в абсолютную от пакета файла
+    path (его каталога); None — ссылка выше корня репозитория. Прочие — как есть.
+    """
+    if not ref.startswith("."):
+        return ref
+    rest = ref.lstrip(".")
+    level = len(ref) - len(rest)
+    package = _path_parts(path)[:-1]
+    if level - 1 > len(package):
+        return None
+    parts = package[:len(package) - (level - 1)] + [p for p in rest.split(".") if p]
+    return ".".join(parts) or None
+
+
+def _csr(rows: np.ndarray, cols: np.ndarray, n_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR по парам (строка, столбец): indptr и столбцы, упорядоченные по строке."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order].astype(np.int64)
+
+
+def _sparse_csr(rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """CSR только по встречающимся строкам: (строки по возрастанию, indptr, столбцы по строке)."""
+    order = np.argsort(rows, kind="stable")
+    row_ids, counts = np.unique(rows, return_counts=True)
+    indptr = np.zeros(len(row_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return row_ids.astype(np.int64), indptr, cols[order].astype(np.int64)
+
+
+def _gather(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Соседи всех строк rows одним срезом: (длины по строкам, соседи подряд)."""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return lengths, np.zeros(0, dtype=np.int64)
+    # позиция каждого соседа = начало его строки + номер внутри строки
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    return lengths, indices[offsets]
+
+
+class _GraphSegment:
+    """CSR чанков start .. start + n_chunks - 1: ключ -> чанки по отношениям и чанк -> ключи ("def", "ref")."""
+
+    def __init__(
+        self,
+        start: int,
+        n_chunks: int,
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]],
+        chunk_keys: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    ):
+        self.start = start
+        self.n_chunks = n_chunks
+        # ключи сегмента по возрастанию -> чанки (номера в базе): (ключи, indptr, чанки)
+        self.postings = postings
+        # чанк сегмента (номер от start) -> ключи
+        self.chunk_keys = chunk_keys
+
+    @classmethod
+    def from_pairs(
+        cls, start: int, n_chunks: int, pairs: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    ) -> "_GraphSegment":
+        """pairs: отношение -> (номера ключей, номера чанков в базе)."""
+        postings, chunk_keys = {}, {}
+        for rel, (key_rows, chunk_rows) in pairs.items():
+            postings[rel] = _sparse_csr(key_rows, chunk_rows)
+            if rel in ("def", "ref"):
+                chunk_keys[rel] = _csr(chunk_rows - start, key_rows, n_chunks)
+        return cls(start, n_chunks, postings, chunk_keys)
+
+    def pairs(self, rel: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(номера ключей, номера чанков) всех пар отношения."""
+        key_ids, indptr, chunks = self.postings[rel]
+        return np.repeat(key_ids, np.diff(indptr)), chunks
+
+    @classmethod
+    def merge(cls, first: "_GraphSegment", second: "_GraphSegment") -> "_GraphSegment":
+        """Сегмент из двух соседних: чанки second идут сразу за чанками first."""
+        pairs = {
+            rel: tuple(np.concatenate(part) for part in zip(first.pairs(rel), second.pairs(rel)))
+            for rel in _RELATIONS
+        }
+        return cls.from_pairs(first.start, first.n_chunks + second.n_chunks, pairs)
+
+    def keys_of(self, rel: str, chunks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ключи rel чанков сегмента (номера в базе): (длины по чанкам, ключи подряд)."""
+        return _gather(*self.chunk_keys[rel], chunks - self.start)
+
+    def chunks_of(self, rel: str, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Чанки сегмента с ключами keys: (длины по ключам, чанки подряд)."""
+        key_ids, indptr, chunks = self.postings[rel]
+        rows = np.searchsorted(key_ids, keys)
+        known = rows < len(key_ids)
+        known[known] = key_ids[rows[known]] == keys[known]
+        lengths = np.zeros(len(keys), dtype=np.int64)
+        known_lengths, found = _gather(indptr, chunks, rows[known])
+        lengths[known] = known_lengths
+        return lengths, found
+
+
+class DependencyGraph:
+    """
+    Граф зависимостей чанков (см. описание модуля); строится по спискам чанков, хранится в .npz.
+
+    Словарь ключей и коды репозиториев общие, CSR лежат сегментами: extend строит
+    сегмент только для новых чанков, сегмент, не меньший предыдущего, сливается с
+    ним (сегментов O(log n)). Удалённый чанк (remove) получает код репозитория -1
+    и пропускается поиском и обходом.
+    """
+
+    def __init__(self, keys: Optional[List[str]] = None, repos: Optional[List[str]] = None):
+        self.keys: List[str] = keys or []
+        self.key_ids: Dict[str, int] = {k: i for i, k in enumerate(self.keys)}
+        self.repos: List[str] = repos or []
+        self.repo_ids: Dict[str, int] = {r: i for i, r in enumerate(self.repos)}
+        self.n_chunks = 0
+        # код репозитория чанка, -1 — удалённый; дописывается в буфер с запасом (codec.append_rows)
+        self.repo_codes: np.ndarray = np.zeros(0, dtype=np.int32)
+        self._repo_codes_buffer: Optional[np.ndarray] = None
+        self.segments: List[_GraphSegment] = []
+
+    @classmethod
+    def build(cls, chunks: List) -> "DependencyGraph":
+        """Граф по чанкам (см. extend)."""
+        graph = cls()
+        graph.extend(chunks)
+        return graph
+
+    def extend(self, chunks: List) -> None:
+        """
+        Добавляет чанки с номерами n_chunks, n_chunks + 1, ...
+        chunks — объекты с полями repo, path, imports, qualified_imports, classes,
+        functions (Chunk); None на месте чанка — удалённый чанк: номер занят, рёбер нет.
+        У чанков без qualified_imports (базы до них) ссылками служат imports: как
+        модули и как голые имена.
+        """
+        if not chunks:
+            return
+        key_ids = self.key_ids
+        start = self.n_chunks
+        repo_codes = np.full(len(chunks), -1, dtype=np.int32)
+        pairs: Dict[str, Tuple[List[int], List[int]]] = {rel: ([], []) for rel in _RELATIONS}
+
+        def add(rel: str, keys: Iterable[str], chunk: int) -> None:
+            key_list, chunk_list = pairs[rel]
+            for key in keys:
+                key_id = key_ids.get(key)
+                if key_id is None:
+                    key_id = key_ids[key] = len(self.keys)
+                    self.keys.append(key)
+                key_list.append(key_id)
+                chunk_list.append(chunk)
+
+        for offset, c in enumerate(chunks):
+            if c is None:
+                continue
+            i = start + offset
+            repo_codes[offset] = self.repo_ids.setdefault(c.repo, len(self.repo_ids))
+            if repo_codes[offset] == len(self.repos):
+                self.repos.append(c.repo)
+            modules = module_keys(c.path)
+            names = set(c.classes) | set(c.functions)
+            defined = set(modules)
+            defined.update(f"{m}.{name}" for m in modules if "/" not in m for name in names)
+            defined.update(_BARE + name for name in names)
+            qualified = getattr(c, "qualified_imports", None)
+            if qualified:
+                refs = {r for r in (resolve_import(ref, c.path) for ref in qualified) if r}
+            else:
+                refs = set(c.imports) | {_BARE + name for name in c.imports}
+            add("def", defined, i)
+            add("ref", refs, i)
+            add("imp", set(c.imports), i)
+
+        self.n_chunks += len(chunks)
+        self.repo_codes, self._repo_codes_buffer = codec.append_rows(self.repo_codes, self._repo_codes_buffer, repo_codes)
+        arrays = {
+            rel: (np.array(key_list, dtype=np.int64), np.array(chunk_list, dtype=np.int64))
+            for rel, (key_list, chunk_list) in pairs.items()
+        }
+        segment = _GraphSegment.from_pairs(start, len(chunks), arrays)
+        while self.segments and self.segments[-1].n_chunks <= segment.n_chunks:
+            segment = _GraphSegment.merge(self.segments.pop(), segment)
+        self.segments.append(segment)
+
+    def remove(self, chunks: np.ndarray) -> None:
+        """Помечает чанки удалёнными."""
+        self.repo_codes[chunks] = -1
+
+    @property
+    def n_refs(self) -> int:
+        """Число ссылок чанков (до разрешения в рёбра)."""
+        return sum(int(seg.postings["ref"][1].size) for seg in self.segments)
+
+    def _key_rows(self, names: Iterable[str]) -> np.ndarray:
+        return np.array([self.key_ids[k] for k in names if k in self.key_ids], dtype=np.int64)
+
+    def _chunks_of(self, rel: str, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Чанки всех сегментов с ключами keys: (номер ключа в keys, чанк) для каждой пары."""
+        positions, found = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for seg in self.segments:
+            lengths, chunks = seg.chunks_of(rel, keys)
+            positions.append(np.repeat(np.arange(len(keys), dtype=np.int64), lengths))
+            found.append(chunks)
+        return np.concatenate(positions), np.concatenate(found)
+
+    def _lookup(self, rel: str, names: Iterable[str]) -> np.ndarray:
+        _, found = self._chunks_of(rel, self._key_rows(names))
+        found = np.unique(found)
+        return found[self.repo_codes[found] >= 0]
+
+    def definers(self, names: Iterable[str]) -> np.ndarray:
+        """Чанки, которые определяют хотя бы одно из имён (модуль, "модуль.символ" или голое имя класса/функции)."""
+        names = list(names)
+        return self._lookup("def", names + [_BARE + name for name in names])
+
+    def importers(self, names: Iterable[str]) -> np.ndarray:
+        """Чанки, в импортах которых есть хотя бы одно из имён (в том числе внешних модулей)."""
+        return self._lookup("imp", names)
+
+    def _step(self, frontier: np.ndarray, outgoing: str, incoming: str) -> np.ndarray:
+        """
+        Соседи фронта через ключи: чанк -> его ключи outgoing -> чанки с тем же
+        ключом incoming; соседи из других репозиториев и удалённые отбрасываются.
+        """
+        sources, keys = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for seg in self.segments:
+            part = frontier[(frontier >= seg.start) & (frontier < seg.start + seg.n_chunks)]
+            lengths, found = seg.keys_of(outgoing, part)
+            sources.append(np.repeat(part, lengths))
+            keys.append(found)
+        sources, keys = np.concatenate(sources), np.concatenate(keys)
+        positions, targets = self._chunks_of(incoming, keys)
+        sources = sources[positions]
+        same_repo = (self.repo_codes[sources] == self.repo_codes[targets]) & (self.repo_codes[targets] >= 0)
+        return np.unique(targets[same_repo & (sources != targets)])
+
+    def _dependents_step(self, frontier: np.ndarray) -> np.ndarray:
+        return self._step(frontier, "def", "ref")
+
+    def _dependencies_step(self, frontier: np.ndarray) -> np.ndarray:
+        return self._step(frontier, "ref", "def")
+
+    @staticmethod
+    def _walk(step: Callable[[np.ndarray], np.ndarray], seeds: np.ndarray, hops: Optional[int], visited: np.ndarray) -> np.ndarray:
+        """Обход в ширину от seeds (уже отмеченных в visited) не дальше hops шагов; None — до конца."""
+        frontier = seeds
+        depth = 0
+        while frontier.size and (hops is None or depth < hops):
+            neighbors = step(frontier)
+            frontier = neighbors[~visited[neighbors]]
+            visited[frontier] = True
+            depth += 1
+        return visited
+
+    def dependents(self, names: Iterable[str], hops: Optional[int] = None) -> np.ndarray:
+        """
+        Номера чанков, которые зависят от имён names: импортируют их напрямую или
+        импортируют чанки, которые их определяют, и так далее не дальше hops шагов
+        (None — транзитивно). Сами определяющие чанки в результат не входят.
+        """
+        names = list(names)
+        if hops == 0:
+            return np.zeros(0, dtype=np.int64)
+        seeds = self.definers(names)
+        visited = np.zeros(self.n_chunks, dtype=bool)
+        visited[seeds] = True
+        # первый шаг: прямые импортёры имени и чанки, зависящие от определяющих
+        first = np.union1d(self._dependents_step(seeds), self.importers(names))
+        first = np.union1d(first, self._lookup("ref", names))
+        first = first[~visited[first]]
+        visited[first] = True
+        self._walk(self._dependents_step, first, None if hops is None else hops - 1, visited)
+        visited[seeds] = False
+        return np.flatnonzero(visited)
+
+    def dependencies(self, chunks: np.ndarray, hops: Optional[int] = 1) -> np.ndarray:
+        """Номера чанков, от которых зависят chunks (не дальше hops шагов), без самих chunks."""
+        seeds = np.unique(np.asarray(chunks, dtype=np.int64))
+        visited = np.zeros(self.n_chunks, dtype=bool)
+        visited[seeds] = True
+        self._walk(self._dependencies_step, seeds, hops, visited)
+        visited[seeds] = False
+        return np.flatnonzero(visited)
+
+    def _merged(self) -> Optional[_GraphSegment]:
+        """Все сегменты одним (для записи в файл)."""
+        if not self.segments:
+            return None
+        merged = self.segments[0]
+        for seg in self.segments[1:]:
+            merged = _GraphSegment.merge(merged, seg)
+        return merged
+
+    def save(self, f) -> None:
+        keys_blob, keys_offsets = codec.pack_strings(self.keys)
+        repos_blob, repos_offsets = codec.pack_strings(self.repos)
+        arrays = {"repo_codes": self.repo_codes}
+        merged = self._merged()
+        if merged is not None:
+            for rel, (key_ids, indptr, chunks) in merged.postings.items():
+                arrays[f"{rel}_keys"], arrays[f"{rel}_indptr"], arrays[f"{rel}_chunks"] = key_ids, indptr, chunks
+            for rel, (indptr, keys) in merged.chunk_keys.items():
+                arrays[f"chunk_{rel}_indptr"], arrays[f"chunk_{rel}_keys"] = indptr, keys
+        np.savez(
+            f,
+            format=np.array(_FORMAT, dtype=np.int64),
+            keys_blob=keys_blob, keys_offsets=keys_offsets,
+            repos_blob=repos_blob, repos_offsets=repos_offsets,
+            n_chunks=np.array(self.n_chunks, dtype=np.int64),
+            **arrays,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["DependencyGraph"]:
+        """Граф из файла; None — файл прежней раскладки, граф надо построить."""
+        with np.load(path) as data:
+            if "format" not in data.files or int(data["format"]) != _FORMAT:
+                return None
+            graph = cls(
+                codec.unpack_strings(data["keys_blob"], data["keys_offsets"]),
+                codec.unpack_strings(data["repos_blob"], data["repos_offsets"]),
+            )
+            graph.n_chunks = int(data["n_chunks"])
+            graph.repo_codes = data["repo_codes"]
+            if "def_indptr" in data.files:
+                graph.segments.append(_GraphSegment(
+                    0, graph.n_chunks,
+                    {rel: (data[f"{rel}_keys"], data[f"{rel}_indptr"], data[f"{rel}_chunks"]) for rel in _RELATIONS},
+                    {rel: (data[f"chunk_{rel}_indptr"], data[f"chunk_{rel}_keys"]) for rel in ("def", "ref")},
+                ))
+            return graph
@@ -0,0 +1,234 @@
+"""
+Офлайн-оценка качества и скорости поиска на датасете в формате CoIR.
+
+Каталог датасета (локальная копия, например CoIR-Retrieval/codetrans-dl):
+    corpus.jsonl    — {"_id", "text", ...}
+    queries.jsonl   — {"_id", "text", ...}
+    qrels/test.tsv  — query-id, corpus-id, score (первая строка — заголовок)
+
+Документы корпуса загружаются в LocalKB как чанки с метаданными из code_filter,
+для каждого запроса метаданные извлекаются так же. Режимы:
+    filter            — только префильтр (язык + хотя бы один импорт): recall набора кандидатов;
+    bm25, vector, hybrid           — поиск по всей базе;
+    bm25+filter, vector+filter, hybrid+filter — поиск среди отфильтрованных.
+Для каждого режима — nDCG@k, recall@k, задержка (p50/p99) и размер набора кандидатов;
+отдельно — задержка стадий: экстракция, фильтр, эмбеддинг запроса.
+
+Пример:
+    python evaluate.py --data ./codetrans-dl --kb ./kb_eval --k 10 --out eval.json
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from code_filter import Filter
+from kb_local_hybrid import Chunk, LocalKB, embed
+
+
+SEARCH_MODES = ("bm25", "vector", "hybrid")
+
+
+def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def read_qrels(path: str) -> Dict[str, Dict[str, int]]:
+    """query-id -> {corpus-id: оценка}; строки с нулевой оценкой пропускаются."""
+    qrels: Dict[str, Dict[str, int]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, None)
+        if header and header[-1].strip().lstrip("-").isdigit():
+            # файл без заголовка
+            reader = iter([header, *reader])
+        for row in reader:
+            if len(row) < 3:
+                continue
+            score = int(row[2])
+            if score > 0:
+                qrels.setdefault(row[0], {})[row[1]] = score
+    return qrels
+
+
+def ndcg_at_k(ranked: List[str], relevant: Dict[str, int], k: int) -> float:
+    gains = [relevant.get(doc_id, 0) for doc_id in ranked[:k]]
+    dcg = sum(g / np.log2(rank + 2) for rank, g in enumerate(gains))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum(g / np.log2(rank + 2) for rank, g in enumerate(ideal))
+    return float(dcg / idcg) if idcg > 0 else 0.0
+
+
+def recall_at_k(ranked: List[str], relevant: Dict[str, int], k: Optional[int]) -> float:
+    found = set(ranked if k is None else ranked[:k])
+    return len(found.intersection(relevant)) / len(relevant) if relevant else 0.0
+
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    arr = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def _timed(fn: Callable[[], Any]) -> Tuple[Any, float]:
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+def build_kb(kb: LocalKB, corpus: List[Dict[str, Any]], language: str, repo: str, batch: int = 256) -> None:
+    """Загружает корпус в базу: один документ — один чанк с метаданными из Filter."""
+    filters: Dict[str, Filter] = {}
+    pending: List[Chunk] = []
+    for doc in corpus:
+        doc_language = doc.get("language") or language
+        if doc_language not in filters:
+            filters[doc_language] = Filter(doc_language)
+        context = filters[doc_language].extract_context_from_source(doc["text"])
+        pending.append(Chunk(
+            chunk_id=str(doc["_id"]),
+            repo=repo,
+            path=str(doc["_id"]),
+            language=context["language"],
+            imports=context["imports"],
+            classes=context["classes"],
+            functions=context["functions"],
+            content=doc["text"],
+        ))
+        if len(pending) >= batch:
+            # одинаковые документы корпуса — разные id в qrels, дедупликация исказила бы оценку
+            kb.add_many(pending, dedup=False)
+            pending = []
+    if pending:
+        kb.add_many(pending, dedup=False)
+
+
+def evaluate(
+    kb: LocalKB,
+    queries: List[Dict[str, Any]],
+    qrels: Dict[str, Dict[str, int]],
+    language: str,
+    k: int = 10,
+    candidates: int = 50,
+) -> Dict[str, Any]:
+    filters: Dict[str, Filter] = {}
+    stages: Dict[str, List[float]] = {"extract": [], "filter": [], "embed": []}
+    modes = ["filter"] + [m for base in SEARCH_MODES for m in (base, f"{base}+filter")]
+    latency: Dict[str, List[float]] = {m: [] for m in modes}
+    ndcg: Dict[str, List[float]] = {m: [] for m in modes}
+    recall: Dict[str, List[float]] = {m: [] for m in modes}
+    sizes: Dict[str, List[int]] = {"all": [], "filter": []}
+
+    n_alive = int((~kb.deleted).sum())
+    for q in queries:
+        relevant = qrels.get(str(q["_id"]))
+        if not relevant:
+            continue
+        q_language = q.get("language") or language
+        if q_language not in filters:
+            filters[q_language] = Filter(q_language)
+
+        context, seconds = _timed(lambda: filters[q_language].extract_context_from_source(q["text"]))
+        stages["extract"].append(seconds)
+        prefilter = {"language": context["language"], "imports": context["imports"] or None}
+
+        (idx,), seconds = _timed(lambda: kb.filter_many([prefilter]))
+        stages["filter"].append(seconds)
+        latency["filter"].append(seconds)
+        sizes["all"].append(n_alive)
+        sizes["filter"].append(int(idx.size))
+        candidate_ids = [kb.chunks[i].chunk_id for i in idx.tolist()]
+        recall["filter"].append(recall_at_k(candidate_ids, relevant, None))
+
+        query_vector, seconds = _timed(lambda: embed(q["text"]))
+        stages["embed"].append(seconds)
+
+        for mode in modes[1:]:
+            base, _, filtered = mode.partition("+")
+            kwargs: Dict[str, Any] = dict(prefilter) if filtered else {}
+            if base != "bm25":
+                kwargs["query_vector"] = query_vector
+            if base == "hybrid":
+                kwargs["candidates"] = candidates
+            search = getattr(kb, f"search_{base}")
+            results, seconds = _timed(lambda: search(q["text"], k=k, **kwargs))
+            latency[mode].append(seconds)
+            ranked = [r["chunk_id"] for r in results]
+            ndcg[mode].append(ndcg_at_k(ranked, relevant, k))
+            recall[mode].append(recall_at_k(ranked, relevant, k))
+
+    report_modes = {}
+    for mode in modes:
+        entry: Dict[str, Any] = {
+            f"recall@{k}" if mode != "filter" else "recall": float(np.mean(recall[mode])) if recall[mode] else 0.0,
+            "latency": _latency(latency[mode]),
+            "candidates_mean": float(np.mean(sizes["filter" if mode.endswith("filter") else "all"] or [0])),
+        }
+        if mode != "filter":
+            entry[f"ndcg@{k}"] = float(np.mean(ndcg[mode])) if ndcg[mode] else 0.0
+        report_modes[mode] = entry
+
+    return {
+        "queries": len(sizes["all"]),
+        "k": k,
+        "chunks": n_alive,
+        "candidates": {
+            "filter_p50": float(np.percentile(sizes["filter"], 50)) if sizes["filter"] else 0.0,
+            "filter_empty_share": float(np.mean([s == 0 for s in sizes["filter"]])) if sizes["filter"] else 0.0,
+        },
+        "stages": {name: _latency(samples) for name, samples in stages.items()},
+        "modes": report_modes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Оценка фильтрации и поиска на датасете CoIR")
+    parser.add_argument("--data", required=True, help="каталог с corpus.jsonl, queries.jsonl, qrels/")
+    parser.add_argument("--qrels", default=None, help="файл qrels (по умолчанию qrels/test.tsv)")
+    parser.add_argument("--kb", default=None, help="каталог базы (по умолчанию <data>/kb_eval)")
+    parser.add_argument("--rebuild", action="store_true", help="заново загрузить корпус в базу")
+    parser.add_argument("--language", default="python", help="язык документов и запросов, если не указан в записи")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=50, help="кандидатов на ветку в hybrid")
+    parser.add_argument("--max-queries", type=int, default=None)
+    parser.add_argument("--out", default=None, help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    kb_dir = args.kb or os.path.join(args.data, "kb_eval")
+    if args.rebuild and os.path.isdir(kb_dir):
+        shutil.rmtree(kb_dir)
+    kb = LocalKB(kb_dir)
+    if not kb.chunks:
+        corpus = read_jsonl(os.path.join(args.data, "corpus.jsonl"))
+        _, seconds = _timed(lambda: build_kb(kb, corpus, args.language, repo=os.path.basename(os.path.normpath(args.data))))
+        print(f"Корпус загружен: {len(corpus)} документов за {seconds:.1f} с", file=sys.stderr)
+
+    queries = read_jsonl(os.path.join(args.data, "queries.jsonl"))
+    if args.max_queries:
+        queries = queries[:args.max_queries]
+    qrels = read_qrels(args.qrels or os.path.join(args.data, "qrels", "test.tsv"))
+
+    report = evaluate(kb, queries, qrels, args.language, k=args.k, candidates=args.candidates)
+    report["dataset"] = os.path.basename(os.path.normpath(args.data))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Пакетный analyze: много файлов или запросов за один запуск.
+
+Вход — список файлов или JSONL с запросами. Строка запроса содержит id и одно из:
+    "file": путь к файлу,
+    "code" или "text": исходный код (например, запрос CoIR), язык — в "language",
+    "language"/"imports": уже извлечённый контекст.
+Язык файла без "language" определяется по расширению или shebang
+(lang_router). Экстракция идёт параллельно на пуле процессов, запросы
+отправляются воркерам сгруппированными по языку, в каждом процессе Filter
+создаётся один раз на язык. Фильтр по базе считается для всех запросов сразу
+(LocalKB.filter_many), результат — JSONL, одна строка на запрос.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from kb_local_hybrid import CodeFilter, LocalKB
+from lang_router import FilterPool, detect_language
+from profiling import profiler
+
+
+# кэш Filter внутри процесса-воркера: язык -> Filter
+_WORKER_FILTERS = FilterPool()
+
+
+def _get_filter(language: str) -> CodeFilter:
+    return _WORKER_FILTERS.get(language)
+
+
+def _item_language(item: Dict[str, Any]) -> Optional[str]:
+    language = item.get("language")
+    if language is None and "file" in item:
+        language = detect_language(item["file"])
+    return language
+
+
+def _extract(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Контекст одного запроса; ошибка разбора возвращается в поле error, а не бросается."""
+    if "file" in item:
+        language = _item_language(item)
+        if language is None:
+            return {"error": f"Неизвестный язык файла: {item['file']}"}
+        try:
+            return _get_filter(language).extract_context(item["file"])
+        except (OSError, ValueError) as e:
+            return {"error": str(e)}
+    code = item.get("code", item.get("text"))
+    if code is not None:
+        try:
+            return _get_filter(item.get("language") or "python").extract_context_from_source(code)
+        except ValueError as e:
+            return {"error": str(e)}
+    return {
+        "language": item.get("language"),
+        "imports": item.get("imports") or [],
+        "classes": item.get("classes") or [],
+        "functions": item.get("functions") or [],
+    }
+
+
+def extract_contexts(items: List[Dict[str, Any]], max_workers: Optional[int] = None, chunksize: int = 16) -> List[Dict[str, Any]]:
+    """Контексты всех запросов в исходном порядке. max_workers=0 — в текущем процессе."""
+    with profiler.span("batch.extract"):
+        if max_workers == 0 or len(items) <= 1:
+            return [_extract(item) for item in items]
+        workers = max_workers or os.cpu_count() or 1
+        # одноязычные пачки: воркер держит меньше Filter, а парсер остаётся «горячим»
+        order = sorted(range(len(items)), key=lambda i: _item_language(items[i]) or "")
+        contexts: List[Dict[str, Any]] = [{}] * len(items)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, ctx in zip(order, pool.map(_extract, [items[i] for i in order], chunksize=chunksize)):
+                contexts[i] = ctx
+        return contexts
+
+
+def read_queries(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def analyze_batch(
+    kb: LocalKB,
+    items: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+    limit: Optional[int] = 100,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Для каждого запроса: извлечённый контекст, число чанков, прошедших фильтр
+    (язык + хотя бы один импорт, как в analyze), и их chunk_id (не больше limit).
+    """
+    contexts = extract_contexts(items, max_workers=max_workers)
+    queries = [
+        {"language": ctx.get("language"), "imports": ctx.get("imports"), "depends_on": item.get("depends_on")}
+        for item, ctx in zip(items, contexts)
+    ]
+    results = kb.filter_many(queries)
+    profiler.count("batch.queries", len(items))
+
+    for i, (item, ctx, idx) in enumerate(zip(items, contexts, results)):
+        record: Dict[str, Any] = {"id": item.get("id", item.get("_id", i))}
+        if "error" in ctx:
+            record["error"] = ctx["error"]
+            yield record
+            continue
+        record.update(ctx)
+        record["count"] = int(idx.size)
+        shown = idx if limit is None else idx[:limit]
+        record["chunk_ids"] = [kb.chunks[j].chunk_id for j in shown.tolist()]
+        yield record
+
+
+def write_jsonl(records: Iterable[Dict[str, Any]], path: Optional[str]) -> int:
+    """Пишет записи в файл (или stdout, если path не задан). Возвращает их число."""
+    f = open(path, "w", encoding="utf-8") if path else None
+    n = 0
+    try:
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False)
+            if f is None:
+                print(line)
+            else:
+                f.write(line + "\n")
+            n += 1
+    finally:
+        if f is not None:
+            f.close()
+    return n
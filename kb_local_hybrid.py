@@ -1,25 +1,318 @@
+import itertools
 import json
 import os
 import argparse
 import re
-from dataclasses import dataclass, asdict
-from typing import List, Optional, Dict, Any, Tuple
+import sys
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Dict, Any, Set, Tuple
 
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
 from tree_sitter_go import language
 
+import codec
+import profiling
 from code_filter import Filter as CodeFilter
+from dep_graph import DependencyGraph
+from dedup import LSHIndex, MinHasher, content_hash, find_duplicates
+from kb_storage import (
+    LOCK_NAME,
+    WriterLock,
+    atomic_write,
+    generation_file,
+    read_manifest,
+    remove_old_generations,
+    write_manifest,
+)
+from lang_router import EXTENSION_LANGUAGES, detect_language, iter_source_files
+from profiling import profiler
+from symbol_index import KINDS as SYMBOL_KINDS, SymbolIndex
 
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
 
+@lru_cache(maxsize=1)
+def load_model() -> SentenceTransformer:
+    """
+    Модель загружается лениво и одна на процесс: шардам и процессам, которые
+    только фильтруют или ищут по готовому вектору запроса, она не нужна.
+    """
+    with profiler.span("kb.model_load"):
+        return SentenceTransformer(MODEL_NAME)
+
+
+def embed(text: str) -> np.ndarray:
+    model = load_model()
+    with profiler.span("kb.embed"):
+        v = model.encode(text, normalize_embeddings=True)
+    return np.asarray(v, dtype=np.float32)
+
+
+def embed_many(texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Кодирует тексты батчами, возвращает матрицу (len(texts), D)."""
+    model = load_model()
+    profiler.count("kb.encode_batch_size", len(texts))
+    with profiler.span("kb.embed_many"):
+        v = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    return np.asarray(v, dtype=np.float32).reshape(len(texts), -1)
+
+
 _TOKEN_RE = re.compile(r"[A-Za-z_]\w+|\d+|==|!=|<=|>=|->|=>|::|[:(){}\[\].,;]")
+# части идентификатора: HTTPResponse -> HTTP, Response; parse_json2 -> parse, json, 2
+_SUBWORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+@lru_cache(maxsize=1 << 16)
+def _split_token(token: str) -> Tuple[str, ...]:
+    """
+    Токен в нижнем регистре + его части для camelCase/snake_case идентификаторов.
+    Идентификаторы в коде сильно повторяются, поэтому результат кэшируется.
+    """
+    lowered = token.lower()
+    if not (token[0].isalpha() or token[0] == "_"):
+        return (lowered,)
+    parts = _SUBWORD_RE.findall(token)
+    if len(parts) <= 1:
+        return (lowered,)
+    return (lowered, *(p.lower() for p in parts))
+
 
 def tokenize(text: str) -> List[str]:
-    return [t.lower() for t in _TOKEN_RE.findall(text)]
+    tokens: List[str] = []
+    extend = tokens.extend
+    for t in _TOKEN_RE.findall(text):
+        extend(_split_token(t))
+    return tokens
+
+
+class Vocabulary:
+    """Отображение токен -> целочисленный id. Порядок вставки в словарь совпадает с id."""
+
+    def __init__(self, tokens: Optional[List[str]] = None):
+        self.token_to_id: Dict[str, int] = {t: i for i, t in enumerate(tokens or [])}
+
+    def __len__(self) -> int:
+        return len(self.token_to_id)
+
+    def encode(self, tokens: List[str], add: bool = True) -> np.ndarray:
+        """
+        Переводит токены в массив id (int32).
+        add=True — новые токены добавляются в словарь, иначе неизвестные пропускаются.
+        """
+        ids = self.token_to_id
+        if add:
+            setdefault = ids.setdefault
+            return np.fromiter((setdefault(t, len(ids)) for t in tokens), dtype=np.int32, count=len(tokens))
+        return np.fromiter((ids[t] for t in tokens if t in ids), dtype=np.int32)
+
+    @classmethod
+    def load(cls, path: str) -> "Vocabulary":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def extend(self, tokens: List[str]) -> None:
+        """Дописывает токены в конец словаря (часть словаря, сохранённая отдельно: dump(f, start))."""
+        ids = self.token_to_id
+        for t in tokens:
+            ids.setdefault(t, len(ids))
+
+    def dump(self, f, start: int = 0) -> None:
+        """Пишет токены с id от start (обход с конца словаря: O(len - start))."""
+        tail = list(itertools.islice(reversed(self.token_to_id), len(self) - start))
+        json.dump(tail[::-1], f, ensure_ascii=False)
+
+
+class _BM25Segment:
+    """
+    Постинги BM25 документов start .. start + n_docs - 1 (номера документов в постингах — локальные).
+    Строки CSR — только термины, встречающиеся в сегменте (term_ids по возрастанию),
+    поэтому размер сегмента не зависит от размера словаря.
+    """
+
+    def __init__(self, start: int, doc_len: np.ndarray, terms: np.ndarray, docs: np.ndarray, tf: np.ndarray):
+        # terms, docs, tf упорядочены по (термин, документ)
+        self.start = start
+        self.n_docs = len(doc_len)
+        self.doc_len = doc_len
+        self.post_docs = docs.astype(np.int32)
+        self.post_tf = tf.astype(np.float32)
+        self.term_ids, counts = np.unique(terms, return_counts=True)
+        self.indptr = np.zeros(len(self.term_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+
+    @classmethod
+    def build(cls, start: int, token_ids: np.ndarray, offsets: np.ndarray) -> "_BM25Segment":
+        n_docs = len(offsets) - 1
+        doc_of = np.repeat(np.arange(n_docs, dtype=np.int64), np.diff(offsets))
+        keys = token_ids.astype(np.int64) * max(n_docs, 1) + doc_of
+        uniq, tf = np.unique(keys, return_counts=True)
+        return cls(start, np.diff(offsets).astype(np.float32), uniq // max(n_docs, 1), uniq % max(n_docs, 1), tf)
+
+    def terms(self) -> np.ndarray:
+        return np.repeat(self.term_ids, np.diff(self.indptr))
+
+    def df(self) -> np.ndarray:
+        """Число документов сегмента с каждым из term_ids."""
+        return np.diff(self.indptr)
+
+    def postings(self, term: int) -> Tuple[int, int]:
+        """Границы постингов термина в post_docs/post_tf; (0, 0), если его в сегменте нет."""
+        j = int(np.searchsorted(self.term_ids, term))
+        if j == len(self.term_ids) or self.term_ids[j] != term:
+            return 0, 0
+        return int(self.indptr[j]), int(self.indptr[j + 1])
+
+    @classmethod
+    def merge(cls, first: "_BM25Segment", second: "_BM25Segment") -> "_BM25Segment":
+        """Сегмент из двух соседних: документы second идут сразу за документами first."""
+        terms = np.concatenate([first.terms(), second.terms()])
+        docs = np.concatenate([first.post_docs.astype(np.int64), second.post_docs.astype(np.int64) + first.n_docs])
+        tf = np.concatenate([first.post_tf, second.post_tf])
+        # внутри термина документы first меньше документов second: устойчивой сортировки по термину достаточно
+        order = np.argsort(terms, kind="stable")
+        return cls(first.start, np.concatenate([first.doc_len, second.doc_len]), terms[order], docs[order], tf[order])
+
+
+class BM25Index:
+    """
+    BM25 (Okapi) поверх потоков id токенов.
+
+    Документы хранятся одним плоским массивом token_ids и массивом offsets (CSR):
+    токены документа i — token_ids[offsets[i]:offsets[i + 1]].
+    Постинги (термин -> документы, tf) строятся векторно через np.unique.
+    Формулы и параметры совпадают с rank_bm25.BM25Okapi.
+
+    Постинги лежат сегментами: extend строит сегмент только для новых документов,
+    сегмент, не меньший предыдущего, сливается с ним (сегментов O(log n)).
+    Статистики (df, idf, средняя длина) общие для всех сегментов; idf
+    пересчитывается при первом запросе после изменения.
+    """
+
+    def __init__(
+        self,
+        token_ids: np.ndarray,
+        offsets: np.ndarray,
+        vocab_size: int,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.n_docs = 0
+        self.total_len = 0
+        self.df = np.zeros(vocab_size, dtype=np.int64)
+        self._df_buffer: Optional[np.ndarray] = None
+        self.segments: List[_BM25Segment] = []
+        self._idf: Optional[np.ndarray] = None
+        self.extend(token_ids, offsets, vocab_size)
+
+    def extend(self, token_ids: np.ndarray, offsets: np.ndarray, vocab_size: int) -> None:
+        """Добавляет документы (offsets — от начала token_ids) с номерами n_docs, n_docs + 1, ..."""
+        n_docs = len(offsets) - 1
+        if n_docs <= 0:
+            return
+        segment = _BM25Segment.build(self.n_docs, token_ids, offsets)
+        self.n_docs += n_docs
+        self.total_len += int(offsets[-1] - offsets[0])
+        if len(self.df) < vocab_size:
+            self.df, self._df_buffer = codec.append_rows(
+                self.df, self._df_buffer, np.zeros(vocab_size - len(self.df), dtype=np.int64),
+            )
+        self.df[segment.term_ids] += segment.df()
+        self._idf = None
+        while self.segments and self.segments[-1].n_docs <= segment.n_docs:
+            segment = _BM25Segment.merge(self.segments.pop(), segment)
+        self.segments.append(segment)
+
+    @property
+    def idf(self) -> np.ndarray:
+        if self._idf is None:
+            # idf как в BM25Okapi: отрицательные значения заменяются на epsilon * средний idf
+            df, n_docs = self.df, self.n_docs
+            seen = df > 0
+            idf = np.zeros(len(df), dtype=np.float32)
+            idf[seen] = np.log((n_docs - df[seen] + 0.5) / (df[seen] + 0.5))
+            if seen.any():
+                eps = self.epsilon * float(idf[seen].mean())
+                idf[seen & (idf < 0)] = eps
+            self._idf = idf
+        return self._idf
+
+    def get_scores(self, query_ids: np.ndarray) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        idf = self.idf
+        vocab_size = len(idf)
+        avgdl = np.float32(self.total_len / self.n_docs) if self.n_docs else np.float32(1.0)
+        k1, b = np.float32(self.k1), np.float32(self.b)
+        postings = 0
+        for q in query_ids:
+            if q >= vocab_size or idf[q] == 0:
+                continue
+            for seg in self.segments:
+                s, e = seg.postings(q)
+                if s == e:
+                    continue
+                postings += e - s
+                docs = seg.post_docs[s:e]
+                tf = seg.post_tf[s:e]
+                norm = k1 * (1 - b + b * seg.doc_len[docs] / avgdl)
+                scores[seg.start + docs] += idf[q] * tf * (k1 + 1) / (tf + norm)
+        profiler.count("kb.bm25_postings_scanned", int(postings))
+        return scores
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k наибольших значений по убыванию (argpartition вместо полной сортировки)."""
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.size:
+        part = np.argpartition(-scores, k - 1)[:k]
+        return part[np.argsort(-scores[part], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+def rrf_merge(
+    bm: List[Dict[str, Any]],
+    ve: List[Dict[str, Any]],
+    k: int = 5,
+    rrf_k: int = 60,
+) -> List[Dict[str, Any]]:
+    """Reciprocal Rank Fusion двух ранжированных списков результатов."""
+    bm_rank = {r["chunk_id"]: i + 1 for i, r in enumerate(bm)}
+    ve_rank = {r["chunk_id"]: i + 1 for i, r in enumerate(ve)}
+
+    by_id = {r["chunk_id"]: r for r in ve}
+    by_id.update({r["chunk_id"]: r for r in bm})
+    if not by_id:
+        return []
+
+    # посчитаем rrf
+    scored: List[Tuple[str, float]] = []
+    for cid in by_id:
+        s = 0.0
+        if cid in bm_rank:
+            s += 1.0 / (rrf_k + bm_rank[cid])
+        if cid in ve_rank:
+            s += 1.0 / (rrf_k + ve_rank[cid])
+        scored.append((cid, s))
+
+    scored.sort(key=lambda x: x[1], reverse=True)
+
+    return [
+        {
+            **by_id[cid],
+            "source": "hybrid",
+            "score": s,
+            "bm25_rank": bm_rank.get(cid),
+            "vector_rank": ve_rank.get(cid),
+        }
+        for cid, s in scored[:k]
+    ]
 
 
 @dataclass
@@ -32,279 +325,1163 @@ class Chunk:
     classes: List[str]
     functions: List[str]
     content: str
+    # положение чанка в файле (строки с 1) и его символ: "func", "Class", "Class.method"
+    start_line: int = 0
+    end_line: int = 0
+    symbol: str = ""
+    # хэш нормализованного содержимого (dedup.content_hash)
+    content_hash: str = ""
+    # chunk_id канонического чанка, если этот чанк — дубликат (у точной копии с теми же байтами content пуст)
+    duplicate_of: str = ""
+    # CodeInfo классов и функций, определённых в чанке (chunker), для индекса символов
+    info: Optional[Dict[str, Any]] = None
+    # импорты вместе с модулем ("a.b", "M.x" для from M import x; см. Filter.qualified_imports) для графа зависимостей
+    qualified_imports: List[str] = field(default_factory=list)
+
+
+# файлы одного поколения базы: ключ манифеста -> (имя, расширение)
+_SNAPSHOT_FILES = {
+    "chunks": ("chunks", "bin"),
+    "vectors": ("vectors", "npy"),
+    "bm25_tokens": ("bm25_tokens", "npy"),
+    "bm25_offsets": ("bm25_offsets", "npy"),
+    "vocab": ("vocab", "json"),
+    "minhash": ("minhash", "npy"),
+    "chunk_docs": ("chunk_docs", "npy"),
+    "depgraph": ("depgraph", "npz"),
+    "symbols": ("symbols", "npz"),
+    "tombstones": ("tombstones", "npy"),
+}
+
+# имена файлов базы без манифеста (до версионирования)
+_LEGACY_FILES = {
+    "chunks": "chunks.json",
+    "vectors": "vectors.npy",
+    "bm25_tokens": "bm25_tokens.npy",
+    "bm25_offsets": "bm25_offsets.npy",
+    "vocab": "vocab.json",
+}
+
+# файлы поколений прежних форматов, которые ещё читаются при загрузке
+_OLD_SNAPSHOT_KEYS = ("duplicates",)
+
+# файлы части журнала (изменения одного или нескольких apply_changes после снимка):
+# новые строки, их документы, новые токены словаря и номера строк под надгробия
+_LOG_FILES = {
+    "chunks": ("chunks", "bin"),
+    "vectors": ("vectors", "npy"),
+    "bm25_tokens": ("bm25_tokens", "npy"),
+    "bm25_offsets": ("bm25_offsets", "npy"),
+    "vocab": ("vocab", "json"),
+    "minhash": ("minhash", "npy"),
+    "chunk_docs": ("chunk_docs", "npy"),
+    "deletes": ("deletes", "npy"),
+}
+
+_LOAD_RETRIES = 3
 
 
 class LocalKB:
+    """
+    Локальная база знаний.
+
+    Данные хранятся поколениями (см. kb_storage): запись создаёт новые файлы (снимок
+    целиком или часть журнала изменений поверх него) и атомарно подменяет
+    manifest.json, читатель держит согласованный снимок того поколения, которое прочитал. Писатели сериализуются блокировкой kb.lock, так что
+    загрузку и обслуживание запросов можно вести на одной базе одновременно.
+    """
+
+    # сколько последних поколений файлов хранить для читателей, не успевших обновиться
+    keep_generations = 3
+    # порог оценки сходства Жаккара, начиная с которого чанк считается почти-дубликатом
+    dedup_threshold = 0.85
+    # почти-дубликаты ищутся только среди чанков не короче стольких токенов
+    near_dup_min_tokens = 50
+    # доля удалённых (надгробия) чанков, при которой apply_changes уплотняет базу
+    compact_ratio = 0.25
 
     def __init__(self, dir_path: str = "./kb_store"):
         self.dir_path = dir_path
-        self.chunks_path = os.path.join(dir_path, "chunks.json")
-        self.vectors_path = os.path.join(dir_path, "vectors.npy")
-        self.bm25_tokens_path = os.path.join(dir_path, "bm25_tokens.json")
+        self.lock_path = os.path.join(dir_path, LOCK_NAME)
+        # старый формат: списки строк в JSON
+        self.legacy_bm25_tokens_path = os.path.join(dir_path, "bm25_tokens.json")
 
         os.makedirs(dir_path, exist_ok=True)
 
-        self.model = SentenceTransformer(MODEL_NAME)
+        # номер поколения загруженного снимка; 0 — база без манифеста (старый формат)
+        self.generation = 0
+        self._set_paths(None)
 
         self.chunks: List[Chunk] = []
         self.vectors: Optional[np.ndarray] = None  # (N, D)
 
-        # BM25
-        self.bm25_tokens: List[List[str]] = []
-        self.bm25: Optional[BM25Okapi] = None
+        # BM25: потоки id токенов в CSR-виде
+        self.vocab = Vocabulary()
+        self.bm25_tokens: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.bm25_offsets: np.ndarray = np.zeros(1, dtype=np.int64)
+        self.bm25: Optional[BM25Index] = None
+
+        # надгробия: True — чанк удалён, но ещё не вычищен из массивов (см. compact);
+        # счётчик надгробий ведётся вместе с маской, чтобы не пересчитывать её при записи
+        self.deleted: np.ndarray = np.zeros(0, dtype=bool)
+        self.n_deleted = 0
+
+        # документы: уникальные тексты, у каждого свой вектор, поток токенов BM25 и
+        # MinHash-сигнатура (num_perm). Дубликаты — обычные чанки со ссылкой на документ
+        # канонического чанка, поэтому их метаданные есть во всех индексах, а в выдаче
+        # поиска документ встречается один раз.
+        self.chunk_docs: np.ndarray = np.zeros(0, dtype=np.int64)  # чанк -> документ
+        self.doc_refs: np.ndarray = np.zeros(0, dtype=np.int64)  # число живых чанков документа
+        self.doc_rows: np.ndarray = np.zeros(0, dtype=np.int64)  # документ -> чанк с его текстом
+        self.minhasher = MinHasher()
+        self.signatures: np.ndarray = np.zeros((0, self.minhasher.num_perm), dtype=np.uint32)
+        self.lsh = LSHIndex(self.signatures)
+        self.hash_to_doc: Dict[str, int] = {}
+
+        # граф зависимостей между чанками по импортам и номер чанка по chunk_id
+        self.graph = DependencyGraph()
+        self.id_to_index: Dict[str, int] = {}
+
+        # индекс символов: классы, методы, параметры, декораторы, базовые классы
+        self.symbols = SymbolIndex()
+
+        # фильтр по языку: код языка каждого чанка
+        self.language_ids: Dict[str, int] = {}
+        self.lang_codes: np.ndarray = np.zeros(0, dtype=np.int32)
+
+        # буферы с запасом под дописываемые массивы (см. _append_array)
+        self._buffers: Dict[str, np.ndarray] = {}
+
+        # журнал: части из манифеста поверх снимка (см. _save_files) и что уже записано
+        self._log: List[Dict[str, Any]] = []
+        self._retired: List[Any] = []
+        self._base_rows = 0
+        self._saved = (0, 0, 0)  # строк, документов, токенов словаря
+        self._unsaved_deletes: List[np.ndarray] = []
+        # снимок на диске старого формата или устарел (уплотнение): следующая запись — целиком
+        self._rewrite_base = False
 
         self._load()
 
+    @property
+    def model(self) -> SentenceTransformer:
+        return load_model()
+
     #эмбединги
     # возвращает эмбэдинги
     def _embed(self, text: str) -> np.ndarray:
-        v = self.model.encode(text, normalize_embeddings=True)
-        return np.asarray(v, dtype=np.float32)
+        return embed(text)
 
     # загружает чанки, токены и векторы
     def _load(self) -> None:
-        if os.path.exists(self.chunks_path):
-            with open(self.chunks_path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            self.chunks = [Chunk(**x) for x in raw]
-        else:
-            self.chunks = []
+        with profiler.span("kb.load"):
+            self._load_files()
+
+    def _set_paths(self, files: Optional[Dict[str, str]]) -> None:
+        """files — файлы поколения из манифеста, None — старые имена без поколения."""
+        self._snapshot_files = files
+        for key in (*_SNAPSHOT_FILES, *_OLD_SNAPSHOT_KEYS):
+            # в манифестах старых поколений может не быть новых видов файлов
+            filename = (_LEGACY_FILES if files is None else files).get(key)
+            setattr(self, f"{key}_path", os.path.join(self.dir_path, filename) if filename else None)
+
+    def _exists(self, path: Optional[str]) -> bool:
+        if path is None:
+            return False
+        # файлы из манифеста обязаны существовать: отсутствие значит, что поколение уже удалено
+        if os.path.exists(path):
+            return True
+        if self._snapshot_files is not None:
+            raise FileNotFoundError(path)
+        return False
+
+    def refresh(self) -> bool:
+        """
+        Перечитывает базу, если писатель опубликовал новое поколение. Возвращает True, если перечитал.
+        Если снимок тот же и к журналу только дописаны части, читаются только они.
+        """
+        manifest = read_manifest(self.dir_path)
+        generation = manifest["generation"] if manifest else 0
+        if generation == self.generation:
+            return False
+        if manifest and self._snapshot_files == manifest["files"] and not self._rewrite_base:
+            log = manifest.get("log", [])
+            if log[:len(self._log)] == self._log:
+                try:
+                    with profiler.span("kb.load"):
+                        self._load_log(log[len(self._log):])
+                except FileNotFoundError:
+                    # части уже слиты следующими записями — читаем поколение целиком
+                    pass
+                else:
+                    self._set_manifest(manifest)
+                    return True
+        self._load()
+        return True
+
+    def _set_manifest(self, manifest: Optional[Dict[str, Any]]) -> None:
+        self.generation = manifest["generation"] if manifest else 0
+        self._log = list(manifest.get("log", [])) if manifest else []
+        self._retired = list(manifest.get("retired", [])) if manifest else []
+        self._saved = (len(self.chunks), len(self.doc_refs), len(self.vocab))
+        self._unsaved_deletes = []
+
+    def _load_files(self) -> None:
+        for attempt in range(_LOAD_RETRIES):
+            manifest = read_manifest(self.dir_path)
+            self._set_paths(manifest["files"] if manifest else None)
+            self._rewrite_base = False
+            try:
+                self._load_snapshot()
+                self._load_log(manifest.get("log", []) if manifest else [])
+            except FileNotFoundError:
+                # пока читали, писатель успел опубликовать несколько поколений — берём свежий манифест
+                if manifest is None or attempt == _LOAD_RETRIES - 1:
+                    raise
+                continue
+            self._set_manifest(manifest)
+            return
 
-        if os.path.exists(self.vectors_path):
-            self.vectors = np.load(self.vectors_path)
-        else:
-            self.vectors = None
+    def _load_log(self, parts: List[Dict[str, Any]]) -> None:
+        """Дописывает к загруженному снимку части журнала: строки, документы и надгробия каждой."""
+        with profiler.span("kb.load.log"):
+            for part in parts:
+                path = lambda key: os.path.join(self.dir_path, part["files"][key])
+                with open(path("chunks"), "rb") as f:
+                    rows = codec.read_chunks(f, Chunk)
+                with open(path("vocab"), "r", encoding="utf-8") as f:
+                    self.vocab.extend(json.load(f))
+                vectors = np.load(path("vectors"))
+                self._extend(
+                    rows, np.load(path("chunk_docs")), np.load(path("bm25_tokens")),
+                    np.diff(np.load(path("bm25_offsets"))), np.load(path("minhash")),
+                    vectors if len(vectors) else None, np.load(path("deletes")),
+                )
+            profiler.count("kb.log_parts_loaded", len(parts))
+
+    def _load_snapshot(self) -> None:
+        with profiler.span("kb.load.chunks"):
+            self._load_chunks()
+
+        with profiler.span("kb.load.vectors"):
+            if self._exists(self.vectors_path):
+                self.vectors = np.load(self.vectors_path)
+            else:
+                self.vectors = None
+
+        with profiler.span("kb.load.bm25_tokens"):
+            self._load_token_streams()
+
+        with profiler.span("kb.load.dedup"):
+            relaid = self._load_chunk_docs()
+            if self._exists(self.minhash_path):
+                self.signatures = np.load(self.minhash_path)
+            else:
+                self.signatures = np.zeros((0, self.minhasher.num_perm), dtype=np.uint32)
 
-        if os.path.exists(self.bm25_tokens_path):
-            with open(self.bm25_tokens_path, "r", encoding="utf-8") as f:
-                self.bm25_tokens = json.load(f)
+        self._rebuild_bm25()
+        self._rebuild_dedup_index()
+
+        with profiler.span("kb.load.graph"):
+            # в поколениях до графа зависимостей (или с прежней раскладкой графа) он строится заново
+            graph = DependencyGraph.load(self.depgraph_path) if self._exists(self.depgraph_path) and not relaid else None
+            if graph is not None:
+                self.graph = graph
+                self.id_to_index = {c.chunk_id: i for i, c in enumerate(self._alive_chunks()) if c is not None}
+            else:
+                self._rebuild_graph()
+
+        with profiler.span("kb.load.symbols"):
+            symbols = SymbolIndex.load(self.symbols_path) if self._exists(self.symbols_path) and not relaid else None
+            if symbols is not None:
+                self.symbols = symbols
+            else:
+                self._rebuild_symbols()
+
+        self._rebuild_filter_index()
+        self.n_deleted = int(np.count_nonzero(self.deleted))
+        self._base_rows = len(self.chunks)
+
+    def _load_chunks(self) -> None:
+        self.chunks = self._read_chunk_file(self.chunks_path) if self._exists(self.chunks_path) else []
+        profiler.count("kb.chunks_loaded", len(self.chunks))
+        if self._exists(self.tombstones_path):
+            self.deleted = np.load(self.tombstones_path)
         else:
-            self.bm25_tokens = []
+            self.deleted = np.zeros(len(self.chunks), dtype=bool)
 
-        self._rebuild_bm25()
+    def _load_chunk_docs(self) -> bool:
+        """
+        Документы чанков. В поколениях до общей таблицы документов дубликаты лежали
+        отдельным файлом (duplicates.bin): они дописываются в self.chunks с документом
+        своего канонического чанка. Возвращает True, если номера чанков изменились
+        и сохранённые граф и индекс символов не годятся.
+        """
+        if self._exists(self.chunk_docs_path):
+            self.chunk_docs = np.load(self.chunk_docs_path)
+            return False
+        self._rewrite_base = True
+        self.chunk_docs = np.arange(len(self.chunks), dtype=np.int64)
+        if not self._exists(self.duplicates_path):
+            return False
+        # канонический чанк дубликата всегда жив: раньше при удалении дубликаты поднимались
+        by_id = {c.chunk_id: i for i, c in enumerate(self.chunks)}
+        duplicates = [d for d in self._read_chunk_file(self.duplicates_path) if d.duplicate_of in by_id]
+        self.chunks.extend(duplicates)
+        docs = np.fromiter((by_id[d.duplicate_of] for d in duplicates), dtype=np.int64, count=len(duplicates))
+        self.chunk_docs = np.concatenate([self.chunk_docs, docs])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(duplicates), dtype=bool)])
+        return True
+
+    @staticmethod
+    def _read_chunk_file(path: str) -> List[Chunk]:
+        # поколения до двоичного формата хранили чанки в JSON
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                return [Chunk(**x) for x in json.load(f)]
+        with open(path, "rb") as f:
+            return codec.read_chunks(f, Chunk)
+
+    def iter_chunks(self):
+        """
+        Потоковый обход чанков текущего поколения с диска, без загрузки всех текстов в память.
+        У точных копий с теми же байтами content пуст: текст хранится у канонического чанка (duplicate_of).
+        """
+        if not self._exists(self.chunks_path):
+            return
+        if self.chunks_path.endswith(".json"):
+            yield from self._read_chunk_file(self.chunks_path)
+            return
+        with open(self.chunks_path, "rb") as f:
+            yield from codec.iter_chunks(f, Chunk)
+
+    def _load_token_streams(self) -> None:
+        if self._exists(self.bm25_tokens_path):
+            self.vocab = Vocabulary.load(self.vocab_path)
+            self.bm25_tokens = np.load(self.bm25_tokens_path)
+            self.bm25_offsets = np.load(self.bm25_offsets_path)
+        elif os.path.exists(self.legacy_bm25_tokens_path):
+            # в старых списках токенов нет частей camelCase/snake_case, которые теперь есть
+            # в запросах: токенизируем тексты заново, чтобы оценки совпадали со свежей базой
+            self.vocab = Vocabulary()
+            self._set_token_streams([self.vocab.encode(tokenize(c.content)) for c in self.chunks])
+        else:
+            self.vocab = Vocabulary()
+            self.bm25_tokens = np.zeros(0, dtype=np.int32)
+            self.bm25_offsets = np.zeros(1, dtype=np.int64)
 
     def _save(self) -> None:
-        with open(self.chunks_path, "w", encoding="utf-8") as f:
-            json.dump([asdict(c) for c in self.chunks], f, ensure_ascii=False, indent=2)
+        with profiler.span("kb.save"):
+            self._save_files()
 
-        if self.vectors is None:
-            np.save(self.vectors_path, np.zeros((0, 384), dtype=np.float32))
+    def _save_files(self) -> None:
+        """
+        Публикует новое поколение. Обычно это часть журнала только с изменениями после
+        прошлой записи: новые строки и их документы, новые токены словаря и номера
+        строк под надгробия, — запись стоит O(изменений), а не O(базы). Хвостовые
+        части журнала, не большие новой, сливаются с ней (частей O(log n)); когда
+        журнал дорастает до размера снимка, а также после уплотнения и для базы
+        старого формата снимок пишется целиком, журнал обнуляется.
+
+        Файлы пишутся через временные + rename, последним атомарно подменяется
+        манифест. Вызывается под WriterLock.
+        """
+        generation = self.generation + 1
+        previous = self._referenced_files()
+        log = None if self._rewrite_base or self._snapshot_files is None else self._write_log_part(generation)
+        if log is None:
+            files = self._write_snapshot(generation)
+            log = []
         else:
-            np.save(self.vectors_path, self.vectors)
-
-        with open(self.bm25_tokens_path, "w", encoding="utf-8") as f:
-            json.dump(self.bm25_tokens, f, ensure_ascii=False, indent=2)
+            files = self._snapshot_files
+
+        self._log = log
+        self._set_paths(files)
+        current = self._referenced_files()
+        # файлы, на которые ссылались предыдущие поколения, нужны их читателям, пока
+        # эти поколения в пределах keep_generations
+        retired = [entry for entry in self._retired if entry[0] > generation - self.keep_generations + 1]
+        if previous - current:
+            retired.append([generation, sorted(previous - current)])
+        write_manifest(self.dir_path, {
+            "generation": generation, "count": len(self.chunks), "files": files, "log": log, "retired": retired,
+        })
+        self.generation = generation
+        self._retired = retired
+        self._saved = (len(self.chunks), len(self.doc_refs), len(self.vocab))
+        self._unsaved_deletes = []
+        profiler.count("kb.log_parts", len(log))
+
+        referenced = current.union(*(names for _, names in retired))
+        remove_old_generations(self.dir_path, generation, self.keep_generations, referenced)
+
+    def _referenced_files(self) -> Set[str]:
+        """Файлы текущего поколения: снимок и части журнала."""
+        if self._snapshot_files is None:
+            return set()
+        return set(self._snapshot_files.values()).union(*(part["files"].values() for part in self._log))
+
+    def _write_snapshot(self, generation: int) -> Dict[str, str]:
+        """Пишет все файлы снимка поколения generation; возвращает их имена по ключам манифеста."""
+        files = {key: generation_file(name, generation, ext) for key, (name, ext) in _SNAPSHOT_FILES.items()}
+        path = lambda key: os.path.join(self.dir_path, files[key])
+
+        atomic_write(path("chunks"), lambda f: codec.write_chunks(f, self.chunks), binary=True)
+
+        vectors = self.vectors if self.vectors is not None else np.zeros((0, 384), dtype=np.float32)
+        atomic_write(path("vectors"), lambda f: np.save(f, vectors), binary=True)
+
+        atomic_write(path("bm25_tokens"), lambda f: np.save(f, self.bm25_tokens), binary=True)
+        atomic_write(path("bm25_offsets"), lambda f: np.save(f, self.bm25_offsets), binary=True)
+        atomic_write(path("vocab"), self.vocab.dump)
+
+        atomic_write(path("minhash"), lambda f: np.save(f, self.signatures), binary=True)
+        atomic_write(path("chunk_docs"), lambda f: np.save(f, self.chunk_docs), binary=True)
+        atomic_write(path("depgraph"), self.graph.save, binary=True)
+        atomic_write(path("symbols"), self.symbols.save, binary=True)
+        atomic_write(path("tombstones"), lambda f: np.save(f, self.deleted), binary=True)
+
+        self._base_rows = len(self.chunks)
+        self._rewrite_base = False
+        profiler.count("kb.snapshot_rows_written", len(self.chunks))
+        return files
+
+    def _write_log_part(self, generation: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Дописывает часть журнала поколения generation, сливая с ней хвостовые части
+        не больше её. Возвращает новый журнал; None — журнал дорос до снимка, пора
+        писать снимок целиком.
+        """
+        rows, docs, tokens = self._saved
+        deletes = list(self._unsaved_deletes)
+        size = len(self.chunks) - rows + sum(len(d) for d in deletes)
+        log = list(self._log)
+        while log and log[-1]["size"] <= size:
+            part = log.pop()
+            rows, docs, tokens = part["rows"][0], part["docs"][0], part["vocab"][0]
+            size += part["size"]
+            deletes.append(np.load(os.path.join(self.dir_path, part["files"]["deletes"])))
+        if not log and size >= self._base_rows:
+            return None
+
+        files = {key: generation_file(name, generation, ext) for key, (name, ext) in _LOG_FILES.items()}
+        path = lambda key: os.path.join(self.dir_path, files[key])
+        offsets = self.bm25_offsets[docs:]
+        vectors = self.vectors[docs:] if self.vectors is not None else np.zeros((0, 384), dtype=np.float32)
+        dead = np.unique(np.concatenate([np.zeros(0, dtype=np.int64), *deletes]))
+
+        atomic_write(path("chunks"), lambda f: codec.write_chunks(f, self.chunks[rows:]), binary=True)
+        atomic_write(path("vectors"), lambda f: np.save(f, vectors), binary=True)
+        atomic_write(path("bm25_tokens"), lambda f: np.save(f, self.bm25_tokens[offsets[0]:]), binary=True)
+        atomic_write(path("bm25_offsets"), lambda f: np.save(f, offsets - offsets[0]), binary=True)
+        atomic_write(path("vocab"), lambda f: self.vocab.dump(f, tokens))
+        atomic_write(path("minhash"), lambda f: np.save(f, self.signatures[docs:]), binary=True)
+        atomic_write(path("chunk_docs"), lambda f: np.save(f, self.chunk_docs[rows:]), binary=True)
+        atomic_write(path("deletes"), lambda f: np.save(f, dead), binary=True)
+
+        profiler.count("kb.log_rows_written", len(self.chunks) - rows)
+        log.append({
+            "files": files,
+            "rows": [rows, len(self.chunks)],
+            "docs": [docs, len(self.doc_refs)],
+            "vocab": [tokens, len(self.vocab)],
+            "size": size,
+        })
+        return log
+
+    def _set_token_streams(self, streams: List[np.ndarray]) -> None:
+        self.bm25_tokens = np.concatenate(streams).astype(np.int32) if streams else np.zeros(0, dtype=np.int32)
+        self.bm25_offsets = np.zeros(len(streams) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in streams], out=self.bm25_offsets[1:])
+
+    def _append_array(self, name: str, rows: np.ndarray) -> None:
+        """Дописывает rows к массиву self.<name> за O(len(rows)) (codec.append_rows)."""
+        view, self._buffers[name] = codec.append_rows(getattr(self, name), self._buffers.get(name), rows)
+        setattr(self, name, view)
 
     def _rebuild_bm25(self) -> None:
-        if self.bm25_tokens and len(self.bm25_tokens) == len(self.chunks):
-            self.bm25 = BM25Okapi(self.bm25_tokens)
-        else:
-            self.bm25 = BM25Okapi(self.bm25_tokens) if self.bm25_tokens else None
+        """BM25 по всем документам заново (загрузка, уплотнение); новые документы — BM25Index.extend."""
+        n_docs = len(self.bm25_offsets) - 1
+        with profiler.span("kb.bm25_rebuild"):
+            self.bm25 = BM25Index(self.bm25_tokens, self.bm25_offsets, len(self.vocab)) if n_docs else None
+
+    def _rebuild_indexes(self) -> None:
+        """Перестраивает все индексы по текущим self.chunks, токенам и векторам (загрузка и уплотнение)."""
+        if len(self.deleted) != len(self.chunks):
+            self.deleted = np.zeros(len(self.chunks), dtype=bool)
+            self.n_deleted = 0
+        self._rebuild_bm25()
+        self._rebuild_dedup_index()
+        self._rebuild_graph()
+        self._rebuild_symbols()
+        self._rebuild_filter_index()
+
+    def _alive_chunks(self) -> List[Optional[Chunk]]:
+        """self.chunks, где удалённые заменены на None (номера сохраняются)."""
+        if not self.deleted.any():
+            return list(self.chunks)
+        return [None if dead else c for c, dead in zip(self.chunks, self.deleted.tolist())]
+
+    def _rebuild_graph(self) -> None:
+        with profiler.span("kb.graph_rebuild"):
+            alive = self._alive_chunks()
+            self.graph = DependencyGraph.build(alive)
+            self.id_to_index = {c.chunk_id: i for i, c in enumerate(alive) if c is not None}
+        profiler.count("kb.graph_refs", self.graph.n_refs)
+
+    def _rebuild_symbols(self) -> None:
+        with profiler.span("kb.symbols_rebuild"):
+            self.symbols = SymbolIndex.build(self._alive_chunks())
+
+    def _rebuild_dedup_index(self) -> None:
+        """
+        Индексы документов: хэш -> документ, число живых чанков документа и чанк с его
+        текстом, LSH по сигнатурам. Недостающие хэши и сигнатуры досчитываются.
+        """
+        with profiler.span("kb.dedup_rebuild"):
+            n_docs = len(self.bm25_offsets) - 1
+            if len(self.chunk_docs) != len(self.chunks):
+                # чанки заданы без документов: у каждого свой
+                self.chunk_docs = np.arange(len(self.chunks), dtype=np.int64)
+            for c in self.chunks:
+                if not c.content_hash:
+                    c.content_hash = content_hash(c.content)
+            self.doc_refs = np.bincount(self.chunk_docs[~self.deleted], minlength=n_docs).astype(np.int64)
+
+            # текст документа хранит его канонический чанк (без duplicate_of), живой — в первую очередь
+            owners = np.flatnonzero(np.fromiter(
+                (not c.duplicate_of for c in self.chunks), dtype=bool, count=len(self.chunks),
+            ))
+            owners = owners[np.lexsort((owners, self.deleted[owners]))]
+            docs, first = np.unique(self.chunk_docs[owners], return_index=True)
+            self.doc_rows = np.full(n_docs, -1, dtype=np.int64)
+            self.doc_rows[docs] = owners[first]
+            self.hash_to_doc = {}
+            for d, i in zip(docs.tolist(), owners[first].tolist()):
+                self.hash_to_doc.setdefault(self.chunks[i].content_hash, d)
+
+            if len(self.signatures) != n_docs:
+                # база старого формата: сигнатур ещё нет
+                self._rewrite_base = True
+                self.signatures = self._signatures([tokenize(self.chunks[i].content) for i in self.doc_rows.tolist()])
+            self.lsh = LSHIndex(self.signatures)
+
+    def _signatures(self, token_lists: List[List[str]]) -> np.ndarray:
+        if not token_lists:
+            return np.zeros((0, self.minhasher.num_perm), dtype=np.uint32)
+        return np.vstack([self.minhasher.signature(t) for t in token_lists])
+
+    def _alive_docs(self, dead: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+        """
+        Проверка для find_duplicates: у каких документов останутся живые чанки после
+        удаления строк dead. Считается только для кандидатов, без копии doc_refs.
+        """
+        released, counts = np.unique(self.chunk_docs[dead], return_counts=True)
+
+        def alive(docs: np.ndarray) -> np.ndarray:
+            refs = self.doc_refs[docs]
+            pos = np.searchsorted(released, docs)
+            hit = pos < len(released)
+            hit[hit] = released[pos[hit]] == docs[hit]
+            refs[hit] -= counts[pos[hit]]
+            return refs > 0
+
+        return alive
+
+    def _find_duplicates(
+        self, hashes: List[str], signatures: np.ndarray, alive: Callable[[np.ndarray], np.ndarray], sizes: List[int],
+    ) -> List[Optional[Tuple[str, str, int]]]:
+        return find_duplicates(
+            hashes, signatures, self.hash_to_doc, self.signatures, self.lsh,
+            threshold=self.dedup_threshold, alive=alive, sizes=sizes, min_size=self.near_dup_min_tokens,
+        )
+
+    def _text(self, i: int) -> str:
+        """Текст чанка i: у точной копии с теми же байтами он хранится только в чанке-владельце документа."""
+        c = self.chunks[i]
+        if c.content or not c.duplicate_of:
+            return c.content
+        return self.chunks[self.doc_rows[self.chunk_docs[i]]].content
+
+    def _resolved(self, i: int) -> Chunk:
+        """Чанк i с текстом (для точной копии — копия чанка с текстом документа)."""
+        c = self.chunks[i]
+        if c.content or not c.duplicate_of:
+            return c
+        return replace(c, content=self._text(i))
+
+    def get_duplicates(self, chunk_id: str) -> List[Chunk]:
+        """Живые чанки с тем же документом, что и chunk_id: его точные и почти-дубликаты."""
+        i = self.id_to_index.get(chunk_id)
+        if i is None:
+            return []
+        same = np.flatnonzero((self.chunk_docs == self.chunk_docs[i]) & ~self.deleted)
+        return [self._resolved(j) for j in same.tolist() if j != i]
 
     #добавление чанков
-    def add_many(self, chunks: List[Chunk]) -> None:
-        vecs = [self._embed(c.content) for c in chunks]
-        vecs = np.vstack([v.reshape(1, -1) for v in vecs])
+    def add_many(
+        self,
+        chunks: List[Chunk],
+        batch_size: int = 64,
+        dedup: bool = True,
+        vectors: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Добавляет чанки в базу.
+
+        При dedup=True точные (по хэшу содержимого) и почти-дубликаты (MinHash/LSH,
+        только чанки не короче near_dup_min_tokens токенов) не кодируются моделью:
+        они ссылаются (duplicate_of) на канонический чанк и делят с ним вектор и
+        токены BM25, поэтому в выдаче поиска встречаются один раз. Язык, импорты,
+        символы и зависимости дубликатов индексируются как у остальных чанков.
+        Текст точной копии не хранится. Из чанков с одинаковым chunk_id добавляется
+        последний. Переданные чанки не изменяются.
+
+        vectors — готовые эмбеддинги (строка на чанк): модель не вызывается
+        (массовая загрузка уже посчитанных векторов, бенчмарки).
+        """
+        if not chunks:
+            return
+        vector_cache = None
+        if vectors is not None:
+            if len(vectors) != len(chunks):
+                raise ValueError(f"vectors: {len(vectors)} строк на {len(chunks)} чанков")
+            vector_cache = {content_hash(c.content): v for c, v in zip(chunks, np.asarray(vectors, dtype=np.float32))}
+        self._write_batch(chunks, [], batch_size=batch_size, dedup=dedup, upsert=False, vector_cache=vector_cache)
+
+    def apply_changes(
+        self,
+        upserts: List[Chunk],
+        deletes: Iterable[str] = (),
+        batch_size: int = 64,
+        dedup: bool = True,
+    ) -> None:
+        """
+        Инкрементальное обновление одним поколением: удаляет чанки с chunk_id из deletes
+        и добавляет upserts, заменяя чанки с теми же chunk_id (из повторов chunk_id
+        в upserts действует последний).
+
+        Удалённые чанки помечаются надгробиями (self.deleted) и пропускаются фильтрами
+        и поиском; документ удалённого канонического чанка остаётся, пока на него
+        ссылаются дубликаты. Векторы чанков, чьё содержимое уже есть в базе, не
+        считаются заново. Upsert без изменений пропускается; если менять нечего
+        (в том числе удаляются только неизвестные chunk_id), поколение не публикуется.
+
+        Стоимость пропорциональна изменениям, а не размеру базы: индексы (BM25, LSH,
+        граф, символы, фильтр) дополняются сегментами новых строк, на диск пишется
+        часть журнала с изменениями (см. _save_files). Полная перестройка и запись
+        снимка — только при уплотнении (доля надгробий превышает compact_ratio) и
+        когда журнал дорастает до размера снимка.
+        """
+        deletes = list(deletes)
+        if not upserts and not deletes:
+            return
+        self._write_batch(upserts, deletes, batch_size=batch_size, dedup=dedup, upsert=True)
+
+    def compact(self) -> None:
+        """Вычищает удалённые чанки из всех массивов и индексов и публикует новое поколение (если было что вычищать)."""
+        with WriterLock(self.lock_path):
+            self.refresh()
+            if self._compact():
+                self._save()
+
+    def _compact(self) -> bool:
+        keep = np.flatnonzero(~self.deleted)
+        if keep.size == len(self.chunks):
+            return False
+        with profiler.span("kb.compact"):
+            profiler.count("kb.tombstones_compacted", len(self.chunks) - keep.size)
+            docs, inverse = np.unique(self.chunk_docs[keep], return_inverse=True)
+            chunks = [self.chunks[i] for i in keep.tolist()]
+
+            # владелец текста документа удалён: текст и роль канонического переходят
+            # первой точной копии (у неё своего текста нет), иначе первому почти-дубликату
+            orphaned = np.flatnonzero(self.deleted[self.doc_rows[docs]])
+            if orphaned.size:
+                order = np.argsort(inverse, kind="stable")
+                bounds = np.searchsorted(inverse[order], np.stack([orphaned, orphaned + 1]))
+                for d, lo, hi in zip(orphaned.tolist(), bounds[0].tolist(), bounds[1].tolist()):
+                    members = order[lo:hi].tolist()
+                    owner = next((p for p in members if not chunks[p].content), members[0])
+                    text = self.chunks[self.doc_rows[docs[d]]].content
+                    chunks[owner] = replace(chunks[owner], content=chunks[owner].content or text, duplicate_of="")
+                    for p in members:
+                        if p != owner:
+                            chunks[p] = replace(chunks[p], duplicate_of=chunks[owner].chunk_id)
+
+            offsets = self.bm25_offsets
+            self._set_token_streams([self.bm25_tokens[offsets[d]:offsets[d + 1]] for d in docs.tolist()])
+            self.chunks = chunks
+            self.chunk_docs = inverse.astype(np.int64)
+            if self.vectors is not None:
+                self.vectors = self.vectors[docs]
+            self.signatures = self.signatures[docs]
+            self.deleted = np.zeros(len(self.chunks), dtype=bool)
+            self.n_deleted = 0
+            self._rebuild_indexes()
+            # номера строк изменились: журнал поверх прежнего снимка больше не годится
+            self._rewrite_base = True
+        return True
+
+    def _unchanged(self, c: Chunk) -> bool:
+        """Живой чанк с тем же chunk_id уже есть с тем же текстом и метаданными."""
+        i = self.id_to_index.get(c.chunk_id)
+        if i is None or self._text(i) != c.content:
+            return False
+        # роль дубликата и хэш — производные базы, а не поля, которые задаёт вызывающий код
+        derived = {"content": "", "content_hash": "", "duplicate_of": ""}
+        return replace(self.chunks[i], **derived) == replace(c, **derived)
+
+    def _plan_deletes(self, chunks: List[Chunk], deletes: List[str], upsert: bool) -> np.ndarray:
+        """Номера живых чанков под надгробия: удаляемые и заменяемые (upsert) чанки."""
+        ids = set(deletes)
+        if upsert:
+            ids.update(c.chunk_id for c in chunks)
+        return np.array(sorted(self.id_to_index[cid] for cid in ids if cid in self.id_to_index), dtype=np.int64)
+
+    def _prepare_batch(
+        self,
+        chunks: List[Chunk],
+        deletes: List[str],
+        upsert: bool,
+        dedup: bool,
+        batch_size: int,
+        vector_cache: Dict[str, np.ndarray],
+    ) -> Dict[str, Any]:
+        """
+        Всё, что можно посчитать до блокировки: токены, хэши, сигнатуры, дубликаты
+        и эмбеддинги уникальных чанков. vector_cache (хэш содержимого -> вектор)
+        переживает повторную подготовку, если за это время вышло новое поколение.
+        Upsert, совпадающий с живым чанком (текст и метаданные), ничего не меняет и пропускается.
+        """
+        batch = [c for c in chunks if not (upsert and self._unchanged(c))]
+        profiler.count("kb.upserts_unchanged", len(chunks) - len(batch))
+        dead = self._plan_deletes(batch, deletes, upsert)
+
+        with profiler.span("kb.tokenize"):
+            token_lists = [tokenize(c.content) for c in batch]
+
+        with profiler.span("kb.dedup"):
+            hashes = [content_hash(c.content) for c in batch]
+            signatures = self._signatures(token_lists)
+            if dedup:
+                # почти-дубликаты ищутся среди документов, у которых после удалений останутся живые чанки
+                matches = self._find_duplicates(hashes, signatures, self._alive_docs(dead), [len(t) for t in token_lists])
+            else:
+                matches = [None] * len(batch)
+        keep = [i for i, m in enumerate(matches) if m is None]
+
+        # эмбеддинг зависит только от текста: уже посчитанные векторы берём из базы
+        missing = []
+        for i in keep:
+            h = hashes[i]
+            if h in vector_cache:
+                continue
+            doc = self.hash_to_doc.get(h)
+            if doc is not None and self.vectors is not None:
+                vector_cache[h] = self.vectors[doc]
+                profiler.count("kb.vectors_reused")
+            elif h not in missing:
+                missing.append(h)
+        if missing:
+            texts = {hashes[i]: batch[i].content for i in keep}
+            vecs = embed_many([texts[h] for h in missing], batch_size=batch_size)
+            vector_cache.update(zip(missing, vecs))
+
+        return {
+            "batch": batch, "token_lists": token_lists, "hashes": hashes, "signatures": signatures,
+            "matches": matches, "keep": keep, "dead": dead,
+        }
+
+    def _write_batch(
+        self,
+        chunks: List[Chunk],
+        deletes: List[str],
+        batch_size: int,
+        dedup: bool,
+        upsert: bool,
+        vector_cache: Optional[Dict[str, np.ndarray]] = None,
+    ) -> None:
+        # повтор chunk_id в батче: остаётся последний чанк с этим id, иначе живых строк
+        # с одним id стало бы несколько, а найти и заменить можно только одну
+        unique = list({c.chunk_id: c for c in chunks}.values())
+        profiler.count("kb.batch_duplicate_ids", len(chunks) - len(unique))
+        chunks = unique
+        # хэш содержимого -> вектор: готовые векторы вызывающего кода и уже посчитанные
+        vector_cache = dict(vector_cache or {})
+        self.refresh()
+        # дорогие эмбеддинги и токенизация — вне блокировки, под ней только слияние и запись
+        plan = self._prepare_batch(chunks, deletes, upsert, dedup, batch_size, vector_cache)
+        if not plan["batch"] and not plan["dead"].size:
+            # удаление неизвестных chunk_id и upsert без изменений: нового поколения нет
+            return
+        with WriterLock(self.lock_path):
+            # другой писатель мог опубликовать новое поколение — готовим батч заново
+            # поверх него; посчитанные эмбеддинги остаются в vector_cache
+            if self.refresh():
+                plan = self._prepare_batch(chunks, deletes, upsert, dedup, batch_size, vector_cache)
+                if not plan["batch"] and not plan["dead"].size:
+                    return
+            self._apply_batch(plan, vector_cache)
+            if self.chunks and self.n_deleted > self.compact_ratio * len(self.chunks):
+                self._compact()
+            self._save()
+
+    def _apply_batch(self, plan: Dict[str, Any], vector_cache: Dict[str, np.ndarray]) -> None:
+        batch, hashes, matches, keep, dead = plan["batch"], plan["hashes"], plan["matches"], plan["keep"], plan["dead"]
+        dying = set(dead.tolist())
+
+        # уникальные чанки батча получают новые документы в конце
+        start, n_docs = len(self.chunks), len(self.doc_refs)
+        new_docs = {i: n_docs + offset for offset, i in enumerate(keep)}
+        # документ -> строка с его текстом, если она меняется в этом батче
+        owners: Dict[int, int] = {}
+        docs = np.zeros(len(batch), dtype=np.int64)
+        # копии: чанки вызывающего кода не изменяются
+        rows: List[Chunk] = []
+        for i, c in enumerate(batch):
+            m = matches[i]
+            if m is None:
+                docs[i] = new_docs[i]
+                owners[new_docs[i]] = start + i
+                rows.append(replace(c, content_hash=hashes[i], duplicate_of=""))
+                continue
+            kind, scope, index = m
+            doc = index if scope == "kb" else int(docs[index])
+            owner = owners[doc] if doc in owners else int(self.doc_rows[doc])
+            docs[i] = doc
+            canonical = self.chunks[owner] if owner < start else rows[owner - start]
+            # хэш нормализован (переводы строк, хвостовые пробелы): байты точной копии
+            # могут отличаться от текста канонического чанка, тогда она хранит свой текст
+            same_bytes = kind == "exact" and c.content == canonical.content
+            if same_bytes and owner < start and (self.deleted[owner] or owner in dying):
+                # владелец текста удалён: точная копия сама становится каноническим чанком документа
+                owners[doc] = start + i
+                rows.append(replace(c, content_hash=hashes[i], duplicate_of=""))
+                continue
+            rows.append(replace(
+                c, content_hash=hashes[i], duplicate_of=canonical.chunk_id,
+                content="" if same_bytes else c.content,
+            ))
+        profiler.count("kb.duplicates_skipped", len(batch) - len(keep))
+        profiler.count("kb.tombstoned", int(dead.size))
+
+        streams = [self.vocab.encode(plan["token_lists"][i]) for i in keep]
+        self._extend(
+            rows, docs,
+            np.concatenate([np.zeros(0, dtype=np.int32), *streams]),
+            np.array([len(t) for t in streams], dtype=np.int64),
+            plan["signatures"][keep],
+            np.vstack([vector_cache[hashes[i]] for i in keep]) if keep else None,
+            dead,
+        )
+        self._unsaved_deletes.append(dead)
 
-        tokens = [tokenize(c.content) for c in chunks]
+    def _extend(
+        self,
+        rows: List[Chunk],
+        docs: np.ndarray,
+        tokens: np.ndarray,
+        lengths: np.ndarray,
+        signatures: np.ndarray,
+        vectors: Optional[np.ndarray],
+        dead: np.ndarray,
+    ) -> None:
+        """
+        Дописывает строки rows с документами docs и помечает удалёнными строки dead
+        (номера могут указывать и на строки из rows). Новые документы (номера подряд
+        после имеющихся) приходят с потоками токенов (tokens подряд, lengths по
+        документам), сигнатурами и векторами. Строка без duplicate_of становится
+        владельцем текста своего документа. Индексы дополняются только новыми
+        строками и документами, без перестроения: общий путь apply_changes и
+        чтения журнала.
+        """
+        start, n_docs, n_new = len(self.chunks), len(self.doc_refs), len(lengths)
+        if rows:
+            self.chunks.extend(rows)
+            self._append_array("chunk_docs", docs.astype(np.int64))
+            self._append_array("deleted", np.zeros(len(rows), dtype=bool))
+            self._append_array("doc_refs", np.zeros(n_new, dtype=np.int64))
+            np.add.at(self.doc_refs, docs, 1)
+            self._append_array("doc_rows", np.full(n_new, -1, dtype=np.int64))
+            for offset, c in enumerate(rows):
+                if not c.duplicate_of:
+                    self.doc_rows[docs[offset]] = start + offset
+                self.id_to_index[c.chunk_id] = start + offset
+            for d in range(n_docs, n_docs + n_new):
+                self.hash_to_doc.setdefault(self.chunks[self.doc_rows[d]].content_hash, d)
+
+        if n_new:
+            offsets = np.zeros(n_new + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            self._append_array("bm25_tokens", tokens.astype(np.int32, copy=False))
+            self._append_array("bm25_offsets", self.bm25_offsets[-1] + offsets[1:])
+            self._append_array("signatures", signatures)
+            self.lsh.add(signatures)
+            if vectors is not None:
+                if self.vectors is None:
+                    self.vectors = vectors
+                else:
+                    self._append_array("vectors", vectors)
+            with profiler.span("kb.bm25_extend"):
+                if self.bm25 is None:
+                    self._rebuild_bm25()
+                else:
+                    self.bm25.extend(tokens, offsets, len(self.vocab))
+
+        if rows:
+            self._extend_filter_index(rows)
+            with profiler.span("kb.graph_extend"):
+                self.graph.extend(rows)
+            with profiler.span("kb.symbols_extend"):
+                self.symbols.extend(rows)
+
+        if dead.size:
+            self.n_deleted += int(dead.size - np.count_nonzero(self.deleted[dead]))
+            self.deleted[dead] = True
+            np.subtract.at(self.doc_refs, self.chunk_docs[dead], 1)
+            self.graph.remove(dead)
+            for r in dead.tolist():
+                chunk_id = self.chunks[r].chunk_id
+                # у заменённого чанка chunk_id уже указывает на новую строку
+                if self.id_to_index.get(chunk_id) == r:
+                    del self.id_to_index[chunk_id]
+
+    #фильтры
+    # функция которая возвращает массив индексов после фильтрации
+    def _get_filtered_indices(
+        self,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
+    ) -> np.ndarray:
+        """Возвращает массив индексов чанков, прошедших фильтрацию (правила как в get_filtered_chunks)."""
+        return self._filter_indices(language, imports, depends_on, hops, {})
 
-        self.chunks.extend(chunks)
-        self.bm25_tokens.extend(tokens)
+    def _filter_indices(
+        self,
+        language: Optional[str],
+        imports: Optional[List[str]],
+        depends_on: Optional[List[str]],
+        hops: Optional[int],
+        cache: Dict[Tuple[str, str], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Фильтрация без перебора чанков: импорты — по спискам импортёров из графа
+        зависимостей, язык — по массиву кодов языков. Удалённых чанков в этих
+        индексах нет. cache — общие для нескольких запросов списки (см. filter_many).
+        """
+        idx: Optional[np.ndarray] = None  # None — все живые чанки
 
-        if self.vectors is None:
-            self.vectors = vecs
-        else:
-            self.vectors = np.vstack([self.vectors, vecs])
+        if imports:
+            parts = []
+            for name in set(imports):
+                if ("import", name) not in cache:
+                    cache[("import", name)] = self.graph.importers([name])
+                parts.append(cache[("import", name)])
+            idx = np.unique(np.concatenate(parts))
+
+        if depends_on:
+            dependents = self.graph.dependents(depends_on, hops=hops)
+            idx = dependents if idx is None else np.intersect1d(idx, dependents, assume_unique=True)
+
+        if language is not None:
+            if ("language", language) not in cache:
+                code = self.language_ids.get(language, -1)
+                cache[("language", language)] = np.flatnonzero((self.lang_codes == code) & ~self.deleted)
+            by_language = cache[("language", language)]
+            idx = by_language if idx is None else np.intersect1d(idx, by_language, assume_unique=True)
+
+        if idx is None:
+            idx = np.flatnonzero(~self.deleted)
+        profiler.count("kb.postings_intersected", int(idx.size))
+        return idx.astype(np.int64, copy=False)
+
+    def filter_many(self, queries: List[Dict[str, Any]]) -> List[np.ndarray]:
+        """
+        Фильтрация сразу для многих запросов: словарей с ключами language, imports,
+        depends_on, hops (как у get_filtered_chunks). Списки импортёров и чанков
+        языка берутся из индексов один раз на имя и переиспользуются всеми запросами.
+        Возвращает номера чанков для каждого запроса.
+        """
+        cache: Dict[Tuple[str, str], np.ndarray] = {}
+        with profiler.span("kb.filter_many"):
+            return [
+                self._filter_indices(q.get("language"), q.get("imports"), q.get("depends_on"), q.get("hops"), cache)
+                for q in queries
+            ]
+
+    def _rebuild_filter_index(self) -> None:
+        """Коды языков чанков для векторизованного фильтра по языку."""
+        self.language_ids = {}
+        self.lang_codes = np.zeros(0, dtype=np.int32)
+        self._extend_filter_index(self.chunks)
+
+    def _extend_filter_index(self, rows: List[Chunk]) -> None:
+        intern = lambda name: self.language_ids.setdefault(name, len(self.language_ids))
+        self._append_array("lang_codes", np.fromiter((intern(c.language) for c in rows), dtype=np.int32, count=len(rows)))
+
+    def find_symbols(self, prefix: bool = False, **conditions: str) -> List[Chunk]:
+        """
+        Чанки, где выполнены все условия по символам (виды — symbol_index.KINDS):
+            kb.find_symbols(superclass="BaseModel")
+            kb.find_symbols(param_type="Request", decorator="app.route")
+        prefix=True — имена сравниваются по префиксу.
+        """
+        with profiler.span("kb.find_symbols"):
+            idx = self.symbols.query(prefix=prefix, **conditions)
+            # индекс символов дополняется, а не перестраивается: удалённые строки в нём остаются
+            return [self._resolved(i) for i in idx[~self.deleted[idx]].tolist()]
+
+    def get_dependents(self, names: List[str], hops: Optional[int] = None) -> List[Chunk]:
+        """
+        Чанки, которые зависят от модулей/символов names: импортируют их или чанки,
+        где они определены, транзитивно не дальше hops шагов (None — без ограничения).
+        """
+        with profiler.span("kb.get_dependents"):
+            return [self._resolved(i) for i in self.graph.dependents(names, hops=hops)]
+
+    def expand_context(self, chunk_ids: List[str], hops: int = 1) -> List[Chunk]:
+        """Чанки, от которых зависят chunk_ids (их импорты внутри базы) на hops шагов — для расширения контекста."""
+        with profiler.span("kb.expand_context"):
+            seeds = [self.id_to_index[cid] for cid in chunk_ids if cid in self.id_to_index]
+            return [self._resolved(i) for i in self.graph.dependencies(np.array(seeds, dtype=np.int64), hops=hops)]
 
-        self._rebuild_bm25()
-        self._save()
-
-    # #фильтры
-    # def _filter_mask(
-    #     self,
-    #     language: Optional[str],
-    #     dep_any: Optional[List[str]],
-    # ) -> np.ndarray:
-    #     n = len(self.chunks)
-    #     mask = np.ones(n, dtype=bool)
-
-    #     if language is not None:
-    #         mask &= np.array([c.language == language for c in self.chunks], dtype=bool)
-
-    #     if dep_any is not None:
-    #         dep_any_set = set(dep_any)
-    #         mask &= np.array(
-    #             [len(dep_any_set.intersection(set(c.deps))) > 0 for c in self.chunks],
-    #             dtype=bool,
-    #         )
-
-    #     return mask
-
-    # # функция которая возвращает массив индексов после фильтрации
-    # def _get_filtered_indices(
-    #     self,
-    #     language: Optional[str],
-    #     dep_any: Optional[List[str]],
-    #     ) -> np.ndarray:
-    #     """Возвращает массив индексов чанков, прошедших фильтрацию."""
-    #     indices = []
-    #     dep_any_set = set(dep_any) if dep_any else None
-
-    #     for i, c in enumerate(self.chunks):
-    #         if language is not None and c.language != language:
-    #             continue
-    #         if dep_any_set is not None:
-    #             if not dep_any_set.intersection(c.deps):
-    #                 continue
-    #         indices.append(i)
-        
-    #     return np.array(indices, dtype=np.int32)
-    
 
     def get_filtered_chunks(
         self,
         language: Optional[str] = None,
         imports: Optional[List[str]] = None,
         classes: Optional[List[str]] = None,
-        functions: Optional[List[str]] = None
+        functions: Optional[List[str]] = None,
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
     ) -> List[Chunk]:
         """
         Возвращает чанки, соответствующие:
         - языку (обязательно, если задан),
-        - хотя бы одному из импортов (обязательно, если список непустой).
+        - хотя бы одному из импортов (обязательно, если список непустой),
+        - зависящие от модулей/символов depends_on по графу зависимостей
+          не дальше hops шагов (обязательно, если список непустой).
         
         Поля classes и functions НЕ используются для фильтрации (мягкие).
         """
-        filtered = self.chunks
-
-        # Обязательный фильтр: язык
-        if language is not None:
-            filtered = [c for c in filtered if c.language == language]
-
-        # Обязательный фильтр: импорты (только если список непустой)
-        if imports:  # imports не None и не пустой список
-            imports_set = set(imports)
-            filtered = [
-                c for c in filtered
-                if imports_set.intersection(c.imports)
-            ]
+        with profiler.span("kb.get_filtered_chunks"):
+            return self._filter_chunks(language, imports, depends_on, hops)
 
+    def _filter_chunks(
+        self,
+        language: Optional[str],
+        imports: Optional[List[str]],
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
+    ) -> List[Chunk]:
         # classes и functions — игнорируются (мягкие фильтры)
+        return [self._resolved(i) for i in self._get_filtered_indices(language, imports, depends_on, hops).tolist()]
+
+    #поиск векторов
+    @profiling.timed("kb.search_vector")
+    def search_vector(
+        self,
+        query: str,
+        k: int = 5,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        query_vector: Optional[np.ndarray] = None,
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        query_vector — готовый эмбеддинг запроса (например, посчитанный один раз
+        для всех шардов), иначе запрос кодируется моделью.
+        """
+        if not self.chunks or self.vectors is None:
+            return []
+
+        # фильтрация до вычислений
+        idx = self._get_filtered_indices(language, imports, depends_on, hops)
+        if idx.size == 0:
+            return []
+
+        q = self._embed(query) if query_vector is None else query_vector
+        docs, rows = self._documents(idx)
+        sims = (self.vectors[docs] @ q).astype(np.float32)
+
+        top_local = _top_k(sims, k)
+        return [self._as_result(int(rows[j]), float(sims[j]), "vector") for j in top_local]
+
+    #BM25 поиск
+    @profiling.timed("kb.search_bm25")
+    def search_bm25(
+        self,
+        query: str,
+        k: int = 5,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        if not self.chunks or self.bm25 is None:
+            return []
+
+        idx = self._get_filtered_indices(language, imports, depends_on, hops)
+        if idx.size == 0:
+            return []
+
+        # статистики BM25 общие для всей базы, считаем только отфильтрованные документы
+        q_ids = self.vocab.encode(tokenize(query), add=False)
+        docs, rows = self._documents(idx)
+        scores = self.bm25.get_scores(q_ids)[docs]
+
+        top_local = _top_k(scores, k)
+        return [self._as_result(int(rows[j]), float(scores[j]), "bm25") for j in top_local]
+
+    #гибрид ррф
+    @profiling.timed("kb.search_hybrid")
+    def search_hybrid(
+        self,
+        query: str,
+        k: int = 5,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        candidates: int = 50,
+        rrf_k: int = 60,
+        query_vector: Optional[np.ndarray] = None,
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        bm = self.search_bm25(query, k=candidates, language=language, imports=imports, depends_on=depends_on, hops=hops)
+        ve = self.search_vector(
+            query, k=candidates, language=language, imports=imports, query_vector=query_vector,
+            depends_on=depends_on, hops=hops,
+        )
+        return rrf_merge(bm, ve, k=k, rrf_k=rrf_k)
+
+    def _documents(self, idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Документы отфильтрованных чанков idx и по одному чанку на документ (первому
+        в idx) для выдачи: дубликаты делят документ и в результаты поиска не попадают.
+        """
+        if len(self.chunks) == len(self.doc_refs):
+            # дубликатов в базе нет: чанки и документы взаимно однозначны
+            return self.chunk_docs[idx], idx
+        docs, first = np.unique(self.chunk_docs[idx], return_index=True)
+        return docs, idx[first]
+
+    def _as_result(self, i: int, score: float, source: str) -> Dict[str, Any]:
+        c = self.chunks[i]
+        return {
+            "source": source,
+            "score": score,
+            "chunk_id": c.chunk_id,
+            "repo": c.repo,
+            "path": c.path,
+            "language": c.language,
+            "imports": c.imports,
+            "content": self._text(i),
+        }
 
-        return filtered
-
-    # #поиск векторов 
-    # def search_vector(
-    #     self,
-    #     query: str,
-    #     k: int = 5,
-    #     language: Optional[str] = None,
-    #     dep_any: Optional[List[str]] = None,
-    # ) -> List[Dict[str, Any]]:
-    #     if not self.chunks or self.vectors is None:
-    #         return []
-
-    #     # ← ФИЛЬТРАЦИЯ ДО ВЫЧИСЛЕНИЙ
-    #     idx = self._get_filtered_indices(language, dep_any)
-    #     if idx.size == 0:
-    #         return []
-
-    #     # Работаем ТОЛЬКО с отфильтрованными векторами
-    #     filtered_vectors = self.vectors[idx]
-    #     q = self._embed(query)
-    #     sims = (filtered_vectors @ q).astype(np.float32)
-
-    #     # Выбираем топ-k среди отфильтрованных
-    #     top_local = np.argsort(-sims)[:k]
-    #     top_idx = idx[top_local]  # восстанавливаем оригинальные индексы
-
-    #     return [self._as_result(i, float(sims[j]), "vector") for j, i in enumerate(top_idx)]
-
-    # #BM25 поиск
-    # def search_bm25(
-    #     self,
-    #     query: str,
-    #     k: int = 5,
-    #     language: Optional[str] = None,
-    #     dep_any: Optional[List[str]] = None,
-    # ) -> List[Dict[str, Any]]:
-    #     if not self.chunks or self.bm25 is None:
-    #         return []
-
-    #     idx = self._get_filtered_indices(language, dep_any)
-    #     if idx.size == 0:
-    #         return []
-
-    #     # Фильтруем токены и пересоздаём BM25 (или используем предварительно отфильтрованный)
-    #     filtered_tokens = [self.bm25_tokens[i] for i in idx]
-    #     filtered_bm25 = BM25Okapi(filtered_tokens)
-
-    #     q_tokens = tokenize(query)
-    #     scores = np.array(filtered_bm25.get_scores(q_tokens), dtype=np.float32)
-
-    #     top_local = np.argsort(-scores)[:k]
-    #     top_idx = idx[top_local]
-
-    #     return [self._as_result(i, float(scores[j]), "bm25") for j, i in enumerate(top_idx)]
-
-    # #гибрид ррф
-    # def search_hybrid(
-    #     self,
-    #     query: str,
-    #     k: int = 5,
-    #     language: Optional[str] = None,
-    #     dep_any: Optional[List[str]] = None,
-    #     candidates: int = 50,
-    #     rrf_k: int = 60,
-    # ) -> List[Dict[str, Any]]:
-    #     bm = self.search_bm25(query, k=candidates, language=language, dep_any=dep_any)
-    #     ve = self.search_vector(query, k=candidates, language=language, dep_any=dep_any)
-
-    #     bm_rank = {r["chunk_id"]: i + 1 for i, r in enumerate(bm)}
-    #     ve_rank = {r["chunk_id"]: i + 1 for i, r in enumerate(ve)}
-
-    #     all_ids = set(bm_rank.keys()) | set(ve_rank.keys())
-    #     if not all_ids:
-    #         return []
-
-    #     # посчитаем rrf
-    #     scored: List[Tuple[str, float]] = []
-    #     for cid in all_ids:
-    #         s = 0.0
-    #         if cid in bm_rank:
-    #             s += 1.0 / (rrf_k + bm_rank[cid])
-    #         if cid in ve_rank:
-    #             s += 1.0 / (rrf_k + ve_rank[cid])
-    #         scored.append((cid, s))
-
-    #     scored.sort(key=lambda x: x[1], reverse=True)
-    #     top_ids = [cid for cid, _ in scored[:k]]
-
-    #     id_to_index = {c.chunk_id: i for i, c in enumerate(self.chunks)}
-    #     results = []
-    #     for cid in top_ids:
-    #         i = id_to_index[cid]
-    #         results.append(
-    #             {
-    #                 **self._as_result(i, float(next(s for _cid, s in scored if _cid == cid)), "hybrid"),
-    #                 "bm25_rank": bm_rank.get(cid),
-    #                 "vector_rank": ve_rank.get(cid),
-    #             }
-    #         )
-    #     return results
-
-    # def _as_result(self, i: int, score: float, source: str) -> Dict[str, Any]:
-    #     c = self.chunks[i]
-    #     return {
-    #         "source": source,
-    #         "score": score,
-    #         "chunk_id": c.chunk_id,
-    #         "repo": c.repo,
-    #         "path": c.path,
-    #         "language": c.language,
-    #         "deps": c.deps,
-    #         "content": c.content,
-    #     }
     
     def print_filtered_chunks(
         self,
@@ -312,9 +1489,13 @@ class LocalKB:
         imports: Optional[List[str]] = None,
         classes: Optional[List[str]] = None,
         functions: Optional[List[str]] = None,
+        depends_on: Optional[List[str]] = None,
+        hops: Optional[int] = None,
     ) -> None:
         """Печатает отфильтрованные чанки в человекочитаемом виде."""
-        chunks = self.get_filtered_chunks(language=language, imports=imports, classes=classes, functions=functions)
+        chunks = self.get_filtered_chunks(
+            language=language, imports=imports, classes=classes, functions=functions, depends_on=depends_on, hops=hops,
+        )
         
         print(f"\nНайдено {len(chunks)} чанков:")
         print("=" * 80)
@@ -329,6 +1510,8 @@ class LocalKB:
             print(f"Язык:     {c.language}")
             print(f"Зависимости: {c.imports}")
             print(f"Репо/путь: {c.repo} :: {c.path}")
+            if c.start_line:
+                print(f"Символ:   {c.symbol or '-'} (строки {c.start_line}-{c.end_line})")
             print(f"Контент:\n{c.content[:200]}{'...' if len(c.content) > 200 else ''}")
 
 
@@ -340,7 +1523,7 @@ def print_results(title: str, results: List[Dict[str, Any]]) -> None:
         print("Нет результатов")
         return
     for r in results:
-        header = f'{r["source"]:6s} score={r["score"]:.4f} id={r["chunk_id"]} lang={r["language"]} deps={r["deps"]}'
+        header = f'{r["source"]:6s} score={r["score"]:.4f} id={r["chunk_id"]} lang={r["language"]} imports={r["imports"]}'
         extra = ""
         if r["source"] == "hybrid":
             extra = f' (bm25_rank={r.get("bm25_rank")}, vec_rank={r.get("vector_rank")})'
@@ -350,8 +1533,50 @@ def print_results(title: str, results: List[Dict[str, Any]]) -> None:
 
 
 
+# расширение файла -> язык для Filter (полная таблица и shebang — в lang_router)
+LANG_BY_EXT = EXTENSION_LANGUAGES
+
+
+def ingest_directory(kb: LocalKB, root: str, repo: str, max_bytes: int = 2000, batch: int = 256) -> int:
+    """
+    Разбивает файлы каталога на чанки по классам/функциям (chunker.Chunker)
+    и добавляет их в базу. Возвращает число добавленных чанков.
+
+    Язык каждого файла определяется по расширению или shebang (lang_router),
+    файлы разбираются группами по языку: один Chunker и парсер на группу.
+    """
+    from chunker import Chunker
+
+    groups: Dict[str, List[str]] = {}
+    for file_path, language in iter_source_files(root):
+        groups.setdefault(language, []).append(file_path)
+
+    pending: List[Chunk] = []
+    total = 0
+    for language in sorted(groups):
+        chunker = Chunker(CodeFilter(language), max_bytes=max_bytes)
+        profiler.count(f"ingest.files.{language}", len(groups[language]))
+        for file_path in groups[language]:
+            rel_path = os.path.relpath(file_path, root)
+            try:
+                pending.extend(chunker.chunk_file(file_path, repo=repo, path=rel_path))
+            except ValueError as e:
+                print(f"Пропущен {file_path}: {e}")
+                continue
+            if len(pending) >= batch:
+                kb.add_many(pending)
+                total += len(pending)
+                pending = []
+    if pending:
+        kb.add_many(pending)
+        total += len(pending)
+    return total
+
+
 def cli():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true", help="замерить фазы и напечатать разбивку по времени")
+    parser.add_argument("--profile-out", default=None, help="дописывать события профилировщика в JSON Lines файл")
     sub = parser.add_subparsers(dest="cmd", required=True)
 
     p_demo = sub.add_parser("demo")
@@ -370,21 +1595,72 @@ def cli():
     p_search.add_argument("--k", type=int, default=5)
     p_search.add_argument("--lang", default=None)
     p_search.add_argument("--dep", action="append", default=None, help="можно указать несколько раз: --dep httpx --dep fastapi")
+    p_search.add_argument("--depends-on", action="append", default=None, help="только чанки, зависящие от модуля/символа (по графу)")
+    p_search.add_argument("--hops", type=int, default=None, help="глубина обхода графа для --depends-on (по умолчанию без ограничения)")
 
     p_filter = sub.add_parser("filter")
     p_filter.add_argument("--language")
     p_filter.add_argument("--imports")
     p_filter.add_argument("--classes")
     p_filter.add_argument("--functions")
+    p_filter.add_argument("--depends-on", help="модули/символы через запятую: чанки, которые от них зависят")
+    p_filter.add_argument("--hops", type=int, default=None)
+
+    p_watch = sub.add_parser("watch")
+    p_watch.add_argument("--dir", required=True, help="каталог репозитория")
+    p_watch.add_argument("--repo", required=True, help="имя репозитория в базе")
+    p_watch.add_argument("--interval", type=float, default=1.0, help="пауза между опросами, с")
+    p_watch.add_argument("--debounce", type=float, default=0.5, help="сколько каталог должен не меняться, с")
+    p_watch.add_argument("--max-bytes", type=int, default=2000, help="максимальный размер чанка")
+    p_watch.add_argument("--once", action="store_true", help="синхронизировать один раз и выйти")
+
+    p_symbols = sub.add_parser("symbols")
+    p_symbols.add_argument(
+        "--where", action="append", required=True, metavar="KIND=NAME",
+        help=f"условие по символу, можно несколько; виды: {', '.join(SYMBOL_KINDS)}",
+    )
+    p_symbols.add_argument("--prefix", action="store_true", help="сравнивать имена по префиксу")
+
+    p_deps = sub.add_parser("deps")
+    p_deps.add_argument("--id", required=True, help="chunk_id, чьи зависимости показать")
+    p_deps.add_argument("--hops", type=int, default=1)
 
     p_analyze = sub.add_parser("analyze")
-    p_analyze.add_argument("--file", required=True, help="Путь к файлу для анализа")
+    p_analyze.add_argument("--file", required=True, help="Путь к файлу для анализа, '-' — читать из stdin")
+    p_analyze.add_argument("--lang", default=None, help="язык файла (по умолчанию по расширению или shebang)")
+    p_analyze.add_argument("--stream", action="store_true", help="потоковая экстракция для очень больших файлов")
+
+    p_batch = sub.add_parser("analyze-batch")
+    p_batch_input = p_batch.add_mutually_exclusive_group(required=True)
+    p_batch_input.add_argument("--files", nargs="+", help="файлы для анализа")
+    p_batch_input.add_argument("--queries", help="JSONL: {id, file | code | language+imports}")
+    p_batch.add_argument("--out", default=None, help="куда писать JSONL (по умолчанию stdout)")
+    p_batch.add_argument("--workers", type=int, default=None, help="процессов для экстракции, 0 — без пула")
+    p_batch.add_argument("--limit", type=int, default=100, help="сколько chunk_id выводить на запрос")
+
+    p_ingest = sub.add_parser("ingest")
+    p_ingest.add_argument("--dir", required=True, help="каталог репозитория")
+    p_ingest.add_argument("--repo", required=True, help="имя репозитория в базе")
+    p_ingest.add_argument("--max-bytes", type=int, default=2000, help="максимальный размер чанка")
+    p_ingest.add_argument("--batch", type=int, default=256, help="сколько чанков добавлять за раз")
 
     args = parser.parse_args()
 
+    if args.profile or args.profile_out:
+        profiling.enable(*([profiling.JsonLinesSink(args.profile_out)] if args.profile_out else []))
+    try:
+        _run_command(args)
+    finally:
+        if profiler.enabled:
+            profiler.print_report()
+            profiling.disable()
+
+
+def _run_command(args: argparse.Namespace) -> None:
     kb = LocalKB("./kb_store")
 
-    print(len(kb.chunks))
+    # на stderr: stdout analyze-batch — поток JSONL
+    print(len(kb.chunks), file=sys.stderr)
 
     # if args.cmd == "demo":
     #     demo() 
@@ -405,16 +1681,17 @@ def cli():
     #     print(f"OK: added chunk {args.id}")
     #     return
 
-    # if args.cmd == "search":
-    #     dep_any = args.dep if args.dep else None
-    #     if args.mode == "bm25":
-    #         res = kb.search_bm25(args.q, k=args.k, language=args.lang, dep_any=dep_any)
-    #     elif args.mode == "vector":
-    #         res = kb.search_vector(args.q, k=args.k, language=args.lang, dep_any=dep_any)
-    #     else:
-    #         res = kb.search_hybrid(args.q, k=args.k, language=args.lang, dep_any=dep_any)
+    if args.cmd == "search":
+        imports = args.dep if args.dep else None
+        graph = {"depends_on": args.depends_on, "hops": args.hops}
+        if args.mode == "bm25":
+            res = kb.search_bm25(args.q, k=args.k, language=args.lang, imports=imports, **graph)
+        elif args.mode == "vector":
+            res = kb.search_vector(args.q, k=args.k, language=args.lang, imports=imports, **graph)
+        else:
+            res = kb.search_hybrid(args.q, k=args.k, language=args.lang, imports=imports, **graph)
 
-    #     print_results(f"SEARCH mode={args.mode} q='{args.q}'", res)
+        print_results(f"SEARCH mode={args.mode} q='{args.q}'", res)
 
     if args.cmd == "filter":
         language = args.language
@@ -427,19 +1704,52 @@ def cli():
             classes = [i.strip() for i in args.classes.split(",") if i.strip()]
         if args.functions is not None:
             functions = [i.strip() for i in args.functions.split(",") if i.strip()]
-        print(kb.print_filtered_chunks(language=language, imports=imports, classes=classes, functions=functions))
+        depends_on = None
+        if args.depends_on is not None:
+            depends_on = [i.strip() for i in args.depends_on.split(",") if i.strip()]
+        print(kb.print_filtered_chunks(
+            language=language, imports=imports, classes=classes, functions=functions,
+            depends_on=depends_on, hops=args.hops,
+        ))
+
+    if args.cmd == "watch":
+        from kb_watcher import RepoWatcher
+
+        watcher = RepoWatcher(
+            kb, args.dir, args.repo, interval=args.interval, debounce=args.debounce, max_bytes=args.max_bytes,
+        )
+        watcher.sync()
+        print(f"OK: {args.dir} синхронизирован, чанков в базе: {len(kb.chunks) - kb.n_deleted}")
+        if not args.once:
+            try:
+                watcher.run()
+            except KeyboardInterrupt:
+                pass
+
+    if args.cmd == "symbols":
+        conditions = dict(w.split("=", 1) for w in args.where)
+        for c in kb.find_symbols(prefix=args.prefix, **conditions):
+            print(f"{c.chunk_id}\t{c.symbol or '-'}")
+
+    if args.cmd == "deps":
+        for c in kb.expand_context([args.id], hops=args.hops):
+            print(f"{c.chunk_id}\t{c.symbol or '-'}")
 
     if args.cmd == "analyze":
     # 1. Анализируем файл через code_filter
         
 
-        # Определяем язык по расширению
-        ext = os.path.splitext(args.file)[1].lower()
-        lang_map = {".py": "python", ".go": "go", ".js": "javascript"}
-        language = lang_map.get(ext, "python")
+        # Определяем язык по расширению или shebang
+        language = args.lang or (None if args.file == "-" else detect_language(args.file))
+        if language is None:
+            print(f"Не удалось определить язык файла {args.file}, укажите --lang")
+            return
 
         code_filter = CodeFilter(language)
-        context = code_filter.extract_context(args.file)  # ← ваш метод
+        if args.stream or args.file == "-":
+            context = code_filter.extract_context_stream(args.file)
+        else:
+            context = code_filter.extract_context(args.file)  # ← ваш метод
 
         print(context)
 
@@ -450,6 +1760,18 @@ def cli():
             functions=[]
         )
 
+    if args.cmd == "analyze-batch":
+        from kb_batch import analyze_batch, read_queries, write_jsonl
+
+        items = read_queries(args.queries) if args.queries else [{"id": f, "file": f} for f in args.files]
+        n = write_jsonl(analyze_batch(kb, items, max_workers=args.workers, limit=args.limit), args.out)
+        if args.out:
+            print(f"OK: {n} запросов -> {args.out}")
+
+    if args.cmd == "ingest":
+        added = ingest_directory(kb, args.dir, args.repo, max_bytes=args.max_bytes, batch=args.batch)
+        print(f"OK: добавлено {added} чанков из {args.dir}")
+
 
 # def demo():
 #     """
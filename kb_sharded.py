@@ -0,0 +1,185 @@
+import heapq
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Dict, Any
+
+from kb_local_hybrid import LocalKB, Chunk, embed, rrf_merge
+
+
+# кэш открытых шардов внутри процесса-воркера: dir_path -> LocalKB
+# (воркеру достаются только его шарды, см. ShardedKB._scatter)
+_WORKER_SHARDS: Dict[str, LocalKB] = {}
+
+
+def _open_shard(dir_path: str) -> LocalKB:
+    """
+    Открывает шард в текущем процессе и держит его в памяти между вызовами.
+    Если другой процесс опубликовал новое поколение шарда, он перечитывается.
+    """
+    kb = _WORKER_SHARDS.get(dir_path)
+    if kb is None:
+        kb = LocalKB(dir_path)
+        _WORKER_SHARDS[dir_path] = kb
+    else:
+        kb.refresh()
+    return kb
+
+
+def _shard_call(dir_path: str, method: str, kwargs: Dict[str, Any]) -> Any:
+    return getattr(_open_shard(dir_path), method)(**kwargs)
+
+
+class ShardedKB:
+    """
+    База знаний из нескольких независимых шардов LocalKB.
+
+    Чанки распределяются по шардам по репозиторию (partition="repo") или по хэшу
+    chunk_id (partition="hash"). Каждый шард — обычный каталог LocalKB, поэтому
+    загружается и обслуживается независимо от остальных.
+    Запросы рассылаются по шардам на процессы-воркеры (scatter), результаты
+    сливаются в общий top-k (gather). Шард закреплён за одним воркером
+    (шард i -> воркер i % число воркеров), поэтому каждый процесс держит
+    в памяти только свои шарды, а не всю базу.
+    """
+
+    def __init__(
+        self,
+        dir_path: str = "./kb_sharded",
+        num_shards: int = 4,
+        partition: str = "hash",
+        max_workers: Optional[int] = None,
+    ):
+        if partition not in ("hash", "repo"):
+            raise ValueError(f"Неизвестный способ разбиения: {partition}")
+
+        self.dir_path = dir_path
+        self.manifest_path = os.path.join(dir_path, "shards.json")
+        os.makedirs(dir_path, exist_ok=True)
+
+        # параметры разбиения фиксируются при создании базы
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            num_shards = manifest["num_shards"]
+            partition = manifest["partition"]
+        else:
+            with open(self.manifest_path, "w", encoding="utf-8") as f:
+                json.dump({"num_shards": num_shards, "partition": partition}, f)
+
+        self.num_shards = num_shards
+        self.partition = partition
+        self.shard_dirs = [os.path.join(dir_path, f"shard_{i:03d}") for i in range(num_shards)]
+
+        # max_workers=0 — выполнять всё в текущем процессе
+        self.max_workers = max_workers
+        # однопроцессные пулы: воркер w обслуживает шарды w, w + n, w + 2n, ...
+        self._workers: List[ProcessPoolExecutor] = []
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.shutdown()
+        self._workers = []
+
+    def __enter__(self) -> "ShardedKB":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def shard_of(self, chunk: Chunk) -> int:
+        # crc32 стабилен между процессами и запусками, в отличие от hash()
+        key = chunk.repo if self.partition == "repo" else chunk.chunk_id
+        return zlib.crc32(key.encode("utf-8")) % self.num_shards
+
+    def _scatter(self, calls: List[tuple]) -> List[Any]:
+        """calls: список (номер шарда, метод, kwargs). Возвращает результаты в том же порядке."""
+        if self.max_workers == 0:
+            return [_shard_call(self.shard_dirs[i], m, kw) for i, m, kw in calls]
+
+        if not self._workers:
+            n_workers = min(self.max_workers or os.cpu_count() or 1, self.num_shards)
+            self._workers = [ProcessPoolExecutor(max_workers=1) for _ in range(n_workers)]
+        futures = [
+            self._workers[i % len(self._workers)].submit(_shard_call, self.shard_dirs[i], m, kw)
+            for i, m, kw in calls
+        ]
+        return [f.result() for f in futures]
+
+    def add_many(self, chunks: List[Chunk]) -> None:
+        by_shard: Dict[int, List[Chunk]] = {}
+        for c in chunks:
+            by_shard.setdefault(self.shard_of(c), []).append(c)
+        self._scatter([(i, "add_many", {"chunks": group}) for i, group in by_shard.items()])
+
+    def apply_changes(self, upserts: List[Chunk], deletes: List[str] = ()) -> None:
+        """
+        Upsert и удаление по chunk_id (см. LocalKB.apply_changes). Шард удаляемого
+        чанка по одному chunk_id не всегда известен (partition="repo"), поэтому
+        удаления рассылаются во все шарды: отсутствующие id шард пропускает.
+        """
+        by_shard: Dict[int, List[Chunk]] = {i: [] for i in range(self.num_shards)}
+        for c in upserts:
+            by_shard[self.shard_of(c)].append(c)
+        deletes = list(deletes)
+        self._scatter([
+            (i, "apply_changes", {"upserts": group, "deletes": deletes})
+            for i, group in by_shard.items() if group or deletes
+        ])
+
+    def get_filtered_chunks(
+        self,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        classes: Optional[List[str]] = None,
+        functions: Optional[List[str]] = None,
+    ) -> List[Chunk]:
+        kwargs = {"language": language, "imports": imports, "classes": classes, "functions": functions}
+        parts = self._scatter([(i, "get_filtered_chunks", kwargs) for i in range(self.num_shards)])
+        return [c for part in parts for c in part]
+
+    def _gather_top_k(self, method: str, k: int, kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+        parts = self._scatter([(i, method, {**kwargs, "k": k}) for i in range(self.num_shards)])
+        return heapq.nlargest(k, (r for part in parts for r in part), key=lambda r: r["score"])
+
+    def search_bm25(
+        self,
+        query: str,
+        k: int = 5,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Статистики BM25 (idf, средняя длина) считаются внутри каждого шарда,
+        поэтому оценки между шардами сравнимы приближённо.
+        """
+        return self._gather_top_k("search_bm25", k, {"query": query, "language": language, "imports": imports})
+
+    def search_vector(
+        self,
+        query: str,
+        k: int = 5,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        # запрос кодируется один раз, шардам передаётся готовый вектор
+        q = embed(query)
+        return self._gather_top_k(
+            "search_vector", k,
+            {"query": query, "language": language, "imports": imports, "query_vector": q},
+        )
+
+    def search_hybrid(
+        self,
+        query: str,
+        k: int = 5,
+        language: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        candidates: int = 50,
+        rrf_k: int = 60,
+    ) -> List[Dict[str, Any]]:
+        # ранги для RRF берутся из глобально слитых списков кандидатов
+        bm = self.search_bm25(query, k=candidates, language=language, imports=imports)
+        ve = self.search_vector(query, k=candidates, language=language, imports=imports)
+        return rrf_merge(bm, ve, k=k, rrf_k=rrf_k)
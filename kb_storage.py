@@ -0,0 +1,111 @@
+"""
+Версионированное хранение файлов LocalKB.
+
+Каждая запись создаёт новое поколение файлов (chunks.000007.json, vectors.000007.npy, ...),
+затем атомарно подменяет manifest.json, в котором указаны номер поколения и его файлы
+(в том числе файлы прежних поколений, которые поколение продолжает использовать).
+Читатель сначала читает манифест и дальше открывает только файлы этого поколения,
+поэтому всегда видит согласованный снимок. Писатели сериализуются файловой блокировкой.
+"""
+import json
+import os
+import re
+import uuid
+from typing import Any, Callable, Dict, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "kb.lock"
+
+_GENERATION_RE = re.compile(r"^(?P<name>[A-Za-z0-9_]+)\.(?P<gen>\d{6})\.(?P<ext>\w+)$")
+
+
+class WriterLock:
+    """Эксклюзивная блокировка писателя на файле kb.lock (ждёт, пока блокировку не отпустят)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = None
+
+    def __enter__(self) -> "WriterLock":
+        self._f = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        else:
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        else:
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        self._f.close()
+        self._f = None
+
+
+def atomic_write(path: str, write: Callable[[Any], None], binary: bool = False) -> None:
+    """
+    Пишет файл через временный файл в том же каталоге и os.replace:
+    под итоговым именем никогда не бывает недописанного файла.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    try:
+        if binary:
+            f = open(tmp_path, "wb")
+        else:
+            f = open(tmp_path, "w", encoding="utf-8")
+        with f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def generation_file(name: str, generation: int, ext: str) -> str:
+    return f"{name}.{generation:06d}.{ext}"
+
+
+def read_manifest(dir_path: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(dir_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(dir_path: str, manifest: Dict[str, Any]) -> None:
+    atomic_write(
+        os.path.join(dir_path, MANIFEST_NAME),
+        lambda f: json.dump(manifest, f, ensure_ascii=False),
+    )
+
+
+def remove_old_generations(dir_path: str, current: int, keep: int, referenced: Iterable[str] = ()) -> None:
+    """
+    Удаляет файлы поколений старше current - keep + 1, кроме referenced.
+    Несколько последних поколений остаются, чтобы читатели, уже прочитавшие
+    предыдущий манифест, успели дочитать свои файлы; referenced — файлы более
+    старых поколений, на которые ещё ссылаются манифесты (снимок под журналом).
+    """
+    oldest_kept = current - keep + 1
+    referenced = set(referenced)
+    for name in os.listdir(dir_path):
+        m = _GENERATION_RE.match(name)
+        if m and int(m.group("gen")) < oldest_kept and name not in referenced:
+            try:
+                os.remove(os.path.join(dir_path, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,244 @@
+"""
+Фоновая синхронизация LocalKB с каталогом репозитория.
+
+RepoWatcher опрашивает каталог: изменённые файлы находит по mtime и размеру,
+подтверждает хэшем содержимого, удалённые — по отсутствию. Изменения копятся,
+пока каталог не успокоится на debounce секунд (пачка сохранений из редактора
+или git checkout применяется одним поколением), затем заново разбираются
+только затронутые файлы (Chunker через Filter), а в базу уходит один вызов
+LocalKB.apply_changes: новые чанки файла — upsert, прежние — удаление.
+
+Состояние (mtime, размер, хэш и chunk_id чанков каждого файла) хранится в
+watch_state.json в каталоге базы, поэтому после перезапуска синхронизация
+продолжается с того же места.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from chunker import Chunker
+from kb_local_hybrid import Chunk, CodeFilter, LocalKB
+from kb_storage import atomic_write
+from lang_router import detect_language, iter_source_files
+from profiling import profiler
+
+
+STATE_NAME = "watch_state.json"
+
+logger = logging.getLogger("code_filter.watch")
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class RepoWatcher:
+    """
+    Опрос каталога root и инкрементальная загрузка изменений в kb под именем repo.
+
+    - interval — пауза между опросами, с;
+    - debounce — сколько каталог должен не меняться, прежде чем изменения применятся;
+    - max_delay — применить накопленное не позже этого срока, даже если изменения идут;
+    - batch_files — сколько файлов разбирать на один вызов apply_changes.
+    """
+
+    def __init__(
+        self,
+        kb: LocalKB,
+        root: str,
+        repo: str,
+        interval: float = 1.0,
+        debounce: float = 0.5,
+        max_delay: float = 10.0,
+        max_bytes: int = 2000,
+        batch_files: int = 256,
+    ):
+        self.kb = kb
+        self.root = root
+        self.repo = repo
+        self.interval = interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.batch_files = batch_files
+        self.state_path = os.path.join(kb.dir_path, STATE_NAME)
+
+        self._chunkers: Dict[str, Chunker] = {}
+        # rel_path -> {"mtime": ..., "size": ..., "hash": ..., "chunk_ids": [...]}
+        self.files: Dict[str, Dict[str, Any]] = self._load_state()
+        # накопленные, но ещё не применённые пути -> (mtime, размер) при последнем опросе,
+        # (-1, -1) для удалённых; время первого и последнего изменения
+        self._pending: Dict[str, Tuple[int, int]] = {}
+        self._first_change = 0.0
+        self._last_change = 0.0
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f).get(self.repo, {})
+
+    def _save_state(self) -> None:
+        state: Dict[str, Any] = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        state[self.repo] = self.files
+        atomic_write(self.state_path, lambda f: json.dump(state, f, ensure_ascii=False))
+
+    def _walk(self) -> Dict[str, os.stat_result]:
+        found = {}
+        for file_path, _language in iter_source_files(self.root):
+            try:
+                found[os.path.relpath(file_path, self.root)] = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+        return found
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Один опрос каталога: изменённые, новые и удалённые файлы относительно
+        последней синхронизации -> (mtime, размер), (-1, -1) для удалённых.
+        """
+        with profiler.span("watch.scan"):
+            found = self._walk()
+            changes = {}
+            for rel_path, st in found.items():
+                known = self.files.get(rel_path)
+                if known and known["mtime"] == st.st_mtime_ns and known["size"] == st.st_size:
+                    continue
+                changes[rel_path] = (st.st_mtime_ns, st.st_size)
+            for rel_path in self.files:
+                if rel_path not in found:
+                    changes[rel_path] = (-1, -1)
+        profiler.count("watch.files_scanned", len(found))
+        return changes
+
+    def poll(self) -> bool:
+        """
+        Опрашивает каталог и применяет изменения, если каталог успокоился
+        (или изменения копятся дольше max_delay). Возвращает True, если применил.
+        """
+        changes = self.scan()
+        now = time.monotonic()
+        # файл, изменившийся с прошлого опроса, продлевает ожидание
+        if any(self._pending.get(p) != sig for p, sig in changes.items()):
+            if not self._pending:
+                self._first_change = now
+            self._last_change = now
+        self._pending = changes
+
+        if not self._pending:
+            return False
+        if now - self._last_change < self.debounce and now - self._first_change < self.max_delay:
+            return False
+        self.flush()
+        return True
+
+    def flush(self) -> None:
+        """Применяет все накопленные изменения батчами по batch_files файлов."""
+        paths = sorted(self._pending)
+        self._pending = {}
+        for i in range(0, len(paths), self.batch_files):
+            self._apply(paths[i:i + self.batch_files])
+
+    def _chunk_file(self, rel_path: str) -> List[Chunk]:
+        language = detect_language(os.path.join(self.root, rel_path))
+        if language is None:
+            # shebang убрали: файл больше не исходник, его чанки удаляются
+            return []
+        if language not in self._chunkers:
+            self._chunkers[language] = Chunker(CodeFilter(language), max_bytes=self.max_bytes)
+        return self._chunkers[language].chunk_file(os.path.join(self.root, rel_path), repo=self.repo, path=rel_path)
+
+    def _apply(self, paths: List[str]) -> None:
+        upserts: List[Chunk] = []
+        deletes: List[str] = []
+        updated: Dict[str, Optional[Dict[str, Any]]] = {}
+
+        with profiler.span("watch.extract"):
+            for rel_path in paths:
+                known = self.files.get(rel_path)
+                file_path = os.path.join(self.root, rel_path)
+                try:
+                    st = os.stat(file_path)
+                    digest = _file_hash(file_path)
+                except FileNotFoundError:
+                    # файл удалён
+                    if known:
+                        deletes.extend(known["chunk_ids"])
+                        updated[rel_path] = None
+                    continue
+
+                entry = {"mtime": st.st_mtime_ns, "size": st.st_size, "hash": digest, "chunk_ids": []}
+                if known and known["hash"] == digest:
+                    # изменилось только время (touch, checkout того же содержимого)
+                    entry["chunk_ids"] = known["chunk_ids"]
+                    updated[rel_path] = entry
+                    continue
+                try:
+                    chunks = self._chunk_file(rel_path)
+                except (ValueError, OSError) as e:
+                    # прежние чанки файла удаляются, а его хэш записывается: до следующего
+                    # изменения файл не разбирается заново и ошибка не повторяется на каждом опросе
+                    logger.warning("Пропущен %s: %s", file_path, e)
+                    profiler.count("watch.files_failed")
+                    chunks = []
+
+                new_ids = {c.chunk_id for c in chunks}
+                if known:
+                    # чанки с тем же chunk_id заменяются upsert-ом, остальные удаляются
+                    deletes.extend(cid for cid in known["chunk_ids"] if cid not in new_ids)
+                upserts.extend(chunks)
+                entry["chunk_ids"] = list(dict.fromkeys(c.chunk_id for c in chunks))
+                updated[rel_path] = entry
+
+        profiler.count("watch.files_changed", len(updated))
+        if upserts or deletes:
+            with profiler.span("watch.apply"):
+                self.kb.apply_changes(upserts, deletes)
+
+        for rel_path, entry in updated.items():
+            if entry is None:
+                self.files.pop(rel_path, None)
+            else:
+                self.files[rel_path] = entry
+        self._save_state()
+
+    def sync(self) -> None:
+        """Разовая синхронизация без ожидания debounce."""
+        self._pending = self.scan()
+        self.flush()
+
+    def run(self) -> None:
+        """Цикл опроса до stop()."""
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:  # фоновый цикл не должен падать из-за одного опроса
+                print(f"Ошибка синхронизации {self.root}: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self) -> "RepoWatcher":
+        """Запускает опрос в фоновом потоке."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name=f"watch:{self.repo}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
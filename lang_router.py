@@ -0,0 +1,111 @@
+"""
+Определение языка файла и пул Filter по языкам.
+
+Язык определяется по расширению, для файлов без известного расширения — по
+shebang в первой строке ("#!/usr/bin/env python3"). Имена языков — те, что
+принимает code_filter.Filter (грамматики из constants).
+
+FilterPool держит по одному Filter (и парсеру tree-sitter) на язык;
+iter_source_files обходит каталог и отдаёт файлы вместе с их языком.
+"""
+import os
+import re
+from typing import Dict, Iterator, Optional, Tuple
+
+from code_filter import Filter
+
+
+# расширение -> язык
+EXTENSION_LANGUAGES = {
+    ".py": "python", ".pyi": "python", ".pyw": "python",
+    ".sh": "bash", ".bash": "bash", ".zsh": "bash", ".ksh": "bash",
+    ".cs": "c_sharp", ".csx": "c_sharp",
+    # отдельной грамматики C нет, грамматика C++ разбирает C
+    ".c": "cpp", ".h": "cpp", ".cc": "cpp", ".cpp": "cpp", ".cxx": "cpp", ".c++": "cpp",
+    ".hh": "cpp", ".hpp": "cpp", ".hxx": "cpp", ".h++": "cpp", ".ipp": "cpp", ".inl": "cpp",
+    ".go": "go",
+    ".java": "java",
+    ".js": "javascript", ".mjs": "javascript", ".cjs": "javascript", ".jsx": "javascript",
+    ".rs": "rust",
+    ".sql": "sql",
+}
+
+# имя файла целиком -> язык (файлы без расширения)
+FILENAME_LANGUAGES = {
+    ".bashrc": "bash", ".bash_profile": "bash", ".profile": "bash", ".zshrc": "bash", "PKGBUILD": "bash",
+}
+
+# интерпретатор из shebang (без номера версии) -> язык
+SHEBANG_LANGUAGES = {
+    "python": "python", "pypy": "python",
+    "sh": "bash", "bash": "bash", "dash": "bash", "zsh": "bash", "ksh": "bash",
+    "node": "javascript", "nodejs": "javascript",
+}
+
+_INTERPRETER_RE = re.compile(r"[A-Za-z]+")
+_SHEBANG_READ = 256
+
+
+def language_from_shebang(first_line: bytes) -> Optional[str]:
+    """Язык по первой строке файла вида "#!/usr/bin/env -S python3 -u"; None, если это не shebang."""
+    if not first_line.startswith(b"#!"):
+        return None
+    parts = first_line[2:].split(b"\n", 1)[0].decode("utf8", errors="ignore").split()
+    if not parts:
+        return None
+    interpreter = os.path.basename(parts[0])
+    if interpreter == "env":
+        # первый аргумент env, который не опция и не присваивание переменной
+        args = [p for p in parts[1:] if not p.startswith("-") and "=" not in p]
+        if not args:
+            return None
+        interpreter = os.path.basename(args[0])
+    m = _INTERPRETER_RE.match(interpreter)
+    return SHEBANG_LANGUAGES.get(m.group(0)) if m else None
+
+
+def detect_language(path: str, read_shebang: bool = True) -> Optional[str]:
+    """Язык файла по расширению, имени или shebang; None — язык не поддерживается."""
+    name = os.path.basename(path)
+    ext = os.path.splitext(name)[1].lower()
+    if ext in EXTENSION_LANGUAGES:
+        return EXTENSION_LANGUAGES[ext]
+    if name in FILENAME_LANGUAGES:
+        return FILENAME_LANGUAGES[name]
+    # shebang есть смысл искать только у файлов без расширения (скрипты)
+    if not read_shebang or ext:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return language_from_shebang(f.read(_SHEBANG_READ))
+    except OSError:
+        return None
+
+
+class FilterPool:
+    """По одному Filter на язык: парсер tree-sitter создаётся один раз и переиспользуется."""
+
+    def __init__(self):
+        self._filters: Dict[str, Filter] = {}
+
+    def get(self, language: str) -> Filter:
+        code_filter = self._filters.get(language)
+        if code_filter is None:
+            code_filter = Filter(language)
+            self._filters[language] = code_filter
+        return code_filter
+
+
+def iter_source_files(root: str, skip_hidden: bool = True) -> Iterator[Tuple[str, str]]:
+    """(путь, язык) для всех файлов каталога с поддерживаемым языком."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        if skip_hidden:
+            # служебные каталоги (.git, .venv, ...) не индексируются
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            language = detect_language(path)
+            if language is not None:
+                yield path, language
+
@@ -0,0 +1,192 @@
+"""
+Встроенные замеры горячих путей Filter и LocalKB.
+
+По умолчанию профилировщик выключен: span() возвращает общий пустой объект,
+count() сразу выходит, поэтому накладные расходы — один вызов функции.
+
+    import profiling
+    sink = profiling.MemorySink()
+    profiling.enable(sink)
+    ...
+    print(profiling.profiler.report())
+"""
+import functools
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+
+class LoggingSink:
+    """Пишет события в logging."""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("code_filter.profile")
+        self.level = level
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        self.logger.log(self.level, "%s", json.dumps(event, ensure_ascii=False))
+
+
+class JsonLinesSink:
+    """Пишет события построчно в JSON Lines (файл по пути или открытый поток)."""
+
+    def __init__(self, target: Any = None):
+        if target is None:
+            self._stream: TextIO = sys.stderr
+            self._owned = False
+        elif isinstance(target, str):
+            self._stream = open(target, "a", encoding="utf-8")
+            self._owned = True
+        else:
+            self._stream = target
+            self._owned = False
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        self._stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        if self._owned:
+            self._stream.close()
+        else:
+            self._stream.flush()
+
+
+class MemorySink:
+    """Копит события в памяти (для тестов и бенчмарков)."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        self.events.append(event)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_profiler", "name", "_t0")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self._profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._profiler._finish_span(self.name, time.perf_counter() - self._t0)
+
+
+class Profiler:
+    """
+    Таймеры (span) и счётчики (count) по фазам.
+
+    Для каждого span копятся суммарное время и число вызовов, для каждого
+    счётчика — сумма значений и число наблюдений (например, средний размер батча).
+    Каждое завершение span и каждое значение счётчика отправляются в sinks.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sinks: List[Any] = []
+        self.spans: Dict[str, List[float]] = {}  # name -> [seconds, calls]
+        self.counters: Dict[str, List[float]] = {}  # name -> [total, observations]
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        stat = self.counters.get(name)
+        if stat is None:
+            self.counters[name] = [value, 1]
+        else:
+            stat[0] += value
+            stat[1] += 1
+        self._emit({"type": "counter", "name": name, "value": value})
+
+    def _finish_span(self, name: str, seconds: float) -> None:
+        stat = self.spans.get(name)
+        if stat is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            stat[0] += seconds
+            stat[1] += 1
+        self._emit({"type": "span", "name": name, "seconds": seconds})
+
+    def _emit(self, event: Dict[str, Any]) -> None:
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def reset(self) -> None:
+        self.spans.clear()
+        self.counters.clear()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "spans": {
+                name: {"seconds": s, "calls": int(c)} for name, (s, c) in sorted(self.spans.items())
+            },
+            "counters": {
+                name: {"total": t, "observations": int(n), "mean": t / n} for name, (t, n) in sorted(self.counters.items())
+            },
+        }
+
+    def print_report(self, stream: Optional[TextIO] = None) -> None:
+        """Печатает разбивку по фазам."""
+        stream = stream or sys.stderr
+        report = self.report()
+        print("\n" + "=" * 80, file=stream)
+        print("Профиль по фазам", file=stream)
+        print("=" * 80, file=stream)
+        for name, s in report["spans"].items():
+            print(f"{name:40s} {s['seconds'] * 1000:12.2f} ms  calls={s['calls']}", file=stream)
+        for name, c in report["counters"].items():
+            print(f"{name:40s} total={c['total']:<12g} n={c['observations']:<8d} mean={c['mean']:.2f}", file=stream)
+
+
+profiler = Profiler()
+
+
+def timed(name: str):
+    """Декоратор: оборачивает вызов функции в span с именем name."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with _Span(profiler, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(*sinks: Any) -> Profiler:
+    profiler.enabled = True
+    profiler.sinks = list(sinks)
+    return profiler
+
+
+def disable() -> None:
+    profiler.enabled = False
+    for sink in profiler.sinks:
+        if hasattr(sink, "close"):
+            sink.close()
+    profiler.sinks = []
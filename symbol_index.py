@@ -0,0 +1,224 @@
+"""
+Индекс символов чанков по полному CodeInfo (Chunk.info).
+
+Каждая запись — ключ "вид\\0имя" и номер чанка. Виды:
+    class        — имя класса;
+    superclass   — базовый класс (чанки с подклассами);
+    function     — функция вне класса;
+    method       — метод, по имени и по "Класс.метод";
+    decorator    — декоратор без "@": целиком и без аргументов ("app.route");
+    param        — имя параметра функции или метода;
+    param_type   — тип параметра: целиком и каждое имя в нём ("Optional[User]" -> "Optional", "User");
+    return_type  — возвращаемый тип, так же как param_type.
+
+Ключи лежат в отсортированном списке, номера чанков — в CSR рядом с ними,
+поэтому точный поиск и поиск по префиксу — два бинарных поиска и один срез
+(на сегмент: новые чанки добавляются отдельным сегментом, см. SymbolIndex).
+Имена длиннее _MAX_NAME символов (декораторы с длинными аргументами, сложные типы)
+обрезаются и в индексе, и в запросах. В файле ключи хранятся байтами UTF-8 подряд
+со смещениями, а не массивом строк фиксированной ширины.
+"""
+import bisect
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import codec
+
+
+KINDS = ("class", "superclass", "function", "method", "decorator", "param", "param_type", "return_type")
+
+_SEP = "\0"
+# больше любого символа в именах: граница диапазона префикса
+_PREFIX_END = "\U0010ffff"
+_TYPE_NAME_RE = re.compile(r"[A-Za-z_][\w.]*")
+_MAX_NAME = 128
+# версия раскладки .npz; файлы других версий не читаются, индекс строится заново
+_FORMAT = 3
+
+
+def _key(kind: str, name: str) -> str:
+    return f"{kind}{_SEP}{name[:_MAX_NAME]}"
+
+
+def _type_names(type_text: str) -> List[str]:
+    names = _TYPE_NAME_RE.findall(type_text)
+    return [type_text] + [n for n in names if n != type_text]
+
+
+def _function_entries(fn: Dict[str, Any], kind: str, owner: str = "") -> Iterator[Tuple[str, str]]:
+    name = fn.get("name", "")
+    if name:
+        yield kind, name
+        if owner:
+            yield kind, f"{owner}.{name}"
+    for decorator in fn.get("decorators", []):
+        yield "decorator", decorator
+        yield "decorator", decorator.split("(", 1)[0].strip()
+    for param in fn.get("parameters", []):
+        if param.get("name"):
+            yield "param", param["name"]
+        if param.get("type"):
+            for type_name in _type_names(param["type"]):
+                yield "param_type", type_name
+    if fn.get("return_type"):
+        for type_name in _type_names(fn["return_type"]):
+            yield "return_type", type_name
+
+
+def symbol_entries(chunk: Any) -> Iterator[Tuple[str, str]]:
+    """Пары (вид, имя) чанка; без info — только имена из classes/functions."""
+    info = chunk.info
+    if info is None:
+        for name in chunk.classes:
+            yield "class", name
+        for name in chunk.functions:
+            yield "function", name
+        return
+    for cls in info.get("classes", []):
+        class_name = cls.get("name", "")
+        if class_name:
+            yield "class", class_name
+        for base in cls.get("superclasses", []):
+            yield "superclass", base
+        for method in cls.get("functions", []):
+            yield from _function_entries(method, "method", class_name)
+    for fn in info.get("functions", []):
+        yield from _function_entries(fn, "function")
+
+
+class _SymbolSegment:
+    """Отсортированные ключи "вид\\0имя" -> номера чанков (CSR) для части чанков базы."""
+
+    def __init__(self, keys: List[str], indptr: np.ndarray, postings: np.ndarray):
+        self.keys = keys
+        self.indptr = indptr
+        self.postings = postings
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, int]]) -> "_SymbolSegment":
+        """pairs — различные пары (ключ, номер чанка)."""
+        entries = sorted(pairs)
+        keys: List[str] = []
+        starts: List[int] = []
+        postings = np.empty(len(entries), dtype=np.int64)
+        # entries отсортированы по ключу: новая группа — там, где ключ меняется
+        for pos, (key, i) in enumerate(entries):
+            if not keys or keys[-1] != key:
+                keys.append(key)
+                starts.append(pos)
+            postings[pos] = i
+        return cls(keys, np.array(starts + [len(entries)], dtype=np.int64), postings)
+
+    def pairs(self) -> Iterator[Tuple[str, int]]:
+        bounds = self.indptr.tolist()
+        postings = self.postings.tolist()
+        for j, key in enumerate(self.keys):
+            for i in postings[bounds[j]:bounds[j + 1]]:
+                yield key, i
+
+    def range(self, key: str, prefix: bool) -> Tuple[int, int]:
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key + _PREFIX_END if prefix else key, lo)
+        return lo, hi
+
+
+class SymbolIndex:
+    """
+    Отсортированные ключи "вид\\0имя" -> номера чанков (CSR).
+
+    Индекс лежит сегментами: extend строит сегмент только для новых чанков,
+    сегмент, не меньший предыдущего, сливается с ним (сегментов O(log n)).
+    Удалённые после построения чанки остаются в индексе: их отбрасывает база.
+    """
+
+    def __init__(self):
+        self.n_chunks = 0
+        self.segments: List[_SymbolSegment] = []
+        # размер сегмента в чанках (для слияния)
+        self._sizes: List[int] = []
+
+    def __len__(self) -> int:
+        return sum(len(seg.keys) for seg in self.segments)
+
+    @classmethod
+    def build(cls, chunks: List[Any]) -> "SymbolIndex":
+        """chunks — объекты Chunk; None на месте чанка (удалённый) пропускается."""
+        index = cls()
+        index.extend(chunks)
+        return index
+
+    def extend(self, chunks: List[Any]) -> None:
+        """Добавляет чанки с номерами n_chunks, n_chunks + 1, ... (None — удалённый чанк)."""
+        if not chunks:
+            return
+        start = self.n_chunks
+        self.n_chunks += len(chunks)
+        segment = _SymbolSegment.from_pairs({
+            (_key(kind, name), start + offset)
+            for offset, c in enumerate(chunks) if c is not None
+            for kind, name in symbol_entries(c) if name
+        })
+        size = len(chunks)
+        while self.segments and self._sizes[-1] <= size:
+            size += self._sizes.pop()
+            segment = _SymbolSegment.from_pairs([*self.segments.pop().pairs(), *segment.pairs()])
+        self.segments.append(segment)
+        self._sizes.append(size)
+
+    def lookup(self, kind: str, name: str, prefix: bool = False) -> np.ndarray:
+        """Номера чанков с символом вида kind и именем name (или начинающимся с name)."""
+        if kind not in KINDS:
+            raise ValueError(f"Неизвестный вид символа: {kind}. Доступны: {', '.join(KINDS)}")
+        key = _key(kind, name)
+        found = [np.zeros(0, dtype=np.int64)]
+        for seg in self.segments:
+            lo, hi = seg.range(key, prefix)
+            found.append(seg.postings[seg.indptr[lo]:seg.indptr[hi]])
+        # сегменты идут по возрастанию номеров чанков: точное совпадение уже упорядочено
+        found = np.concatenate(found)
+        return np.unique(found) if prefix else found
+
+    def names(self, kind: str, prefix: str = "", limit: int = 50) -> List[str]:
+        """Имена вида kind, начинающиеся с prefix (для автодополнения)."""
+        key = _key(kind, prefix)
+        found = set()
+        for seg in self.segments:
+            lo, hi = seg.range(key, True)
+            found.update(seg.keys[lo:min(hi, lo + limit)])
+        return [k.split(_SEP, 1)[1] for k in sorted(found)[:limit]]
+
+    def query(self, prefix: bool = False, **conditions: str) -> np.ndarray:
+        """Пересечение условий: query(param_type="Request", decorator="app.route")."""
+        result: Optional[np.ndarray] = None
+        for kind, name in conditions.items():
+            found = self.lookup(kind, name, prefix=prefix)
+            result = found if result is None else np.intersect1d(result, found, assume_unique=True)
+            if result.size == 0:
+                break
+        return result if result is not None else np.zeros(0, dtype=np.int64)
+
+    def save(self, f) -> None:
+        if len(self.segments) == 1:
+            merged = self.segments[0]
+        else:
+            merged = _SymbolSegment.from_pairs([pair for seg in self.segments for pair in seg.pairs()])
+        keys_blob, keys_offsets = codec.pack_strings(merged.keys)
+        np.savez(
+            f, format=np.int64(_FORMAT), n_chunks=np.int64(self.n_chunks),
+            keys_blob=keys_blob, keys_offsets=keys_offsets, indptr=merged.indptr, postings=merged.postings,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SymbolIndex"]:
+        """Индекс из файла; None — файл прежней раскладки, индекс надо построить."""
+        with np.load(path) as data:
+            if "format" not in data.files or int(data["format"]) != _FORMAT:
+                return None
+            index = cls()
+            index.n_chunks = int(data["n_chunks"])
+            keys = codec.unpack_strings(data["keys_blob"], data["keys_offsets"])
+            index.segments.append(_SymbolSegment(keys, data["indptr"], data["postings"]))
+            index._sizes.append(index.n_chunks)
+            return index
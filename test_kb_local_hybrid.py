@@ -0,0 +1,44 @@
+import zlib
+
+import numpy as np
+import pytest
+
+kb_local_hybrid = pytest.importorskip("kb_local_hybrid")
+Chunk = kb_local_hybrid.Chunk
+LocalKB = kb_local_hybrid.LocalKB
+
+
+def _fake_embed_many(texts, batch_size=64):
+    # модель не нужна: вектор — детерминированный шум от текста
+    vectors = [np.random.default_rng(zlib.crc32(t.encode("utf8"))).standard_normal(8) for t in texts]
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+
+@pytest.fixture
+def kb_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_local_hybrid, "embed_many", _fake_embed_many)
+    return str(tmp_path / "kb")
+
+
+def _chunk(chunk_id: str, content: str) -> Chunk:
+    return Chunk(
+        chunk_id=chunk_id, repo="r", path="app.py", language="python",
+        imports=[], classes=[], functions=[], content=content,
+    )
+
+
+def _alive(kb: LocalKB):
+    return sorted((kb.chunks[i].chunk_id, kb._text(i)) for i in np.flatnonzero(~kb.deleted).tolist())
+
+
+def test_duplicate_ids_in_batch_keep_last(kb_dir):
+    kb = LocalKB(kb_dir)
+    kb.add_many([_chunk("a", "x = 1"), _chunk("b", "y = 1"), _chunk("a", "x = 2")])
+    assert _alive(kb) == [("a", "x = 2"), ("b", "y = 1")]
+
+    # повторная синхронизация файла с повторяющимися id не оставляет старых строк
+    for version in range(3, 6):
+        kb.apply_changes([_chunk("a", f"x = {version}"), _chunk("a", f"x = {version}0")])
+        assert _alive(kb) == [("a", f"x = {version}0"), ("b", "y = 1")]
+
+    assert _alive(LocalKB(kb_dir)) == [("a", "x = 50"), ("b", "y = 1")]